@@ -268,6 +268,20 @@ fade_list = ['fade', 'smoothleft', 'smoothright', 'smoothup', 'smoothdown', 'cir
              'wipetl', 'wipetr', 'wipebl', 'wipebr', 'zoomin', 'hlwind', 'hrwind', 'vuwind', 'vdwind', 'coverleft',
              'coverright', 'covertop', 'coverbottom', 'revealleft', 'revealright', 'revealup', 'revealdown']
 
+encode_profile_options = {
+    "draft": "encode profile draft",
+    "standard": "encode profile standard",
+    "final": "encode profile final"}
+
+
+def get_encode_profile_index():
+    # 页面上编码质量的默认选项，和配置文件里的video.encode_profile一致
+    profile_names = list(encode_profile_options)
+    profile_name = (my_config.get('video') or {}).get('encode_profile', 'standard')
+    if profile_name not in profile_names:
+        profile_name = 'standard'
+    return profile_names.index(profile_name)
+
 driver_types = {
     "chrome": 'chrome',
     "firefox": 'firefox'}
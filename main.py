@@ -29,11 +29,13 @@ from config.config import my_config, audio_voices_azure, audio_voices_ali, audio
 from services.audio.alitts_service import AliAudioService
 from services.audio.azure_service import AzureAudioService
 from services.audio.chattts_service import ChatTTSAudioService
+from services.audio.chunked_tts_service import is_long_text, synthesize_chunked
 from services.audio.gptsovits_service import GPTSoVITSAudioService
 from services.audio.cosyvoice_service import CosyVoiceAudioService
 from services.audio.tencent_tts_service import TencentAudioService
-from services.captioning.captioning_service import generate_caption, add_subtitles
-from services.hunjian.hunjian_service import concat_audio_list, get_audio_and_video_list, get_audio_and_video_list_local
+from services.captioning.captioning_service import generate_caption, add_subtitles, build_subtitle_filter
+from services.hunjian.hunjian_service import concat_audio_list, get_audio_and_video_list, get_audio_and_video_list_local, \
+    warm_audio_cache, warm_audio_cache_local
 from services.llm.azure_service import MyAzureService
 from services.llm.baichuan_service import MyBaichuanService
 from services.llm.baidu_qianfan_service import BaiduQianfanService
@@ -47,6 +49,9 @@ from services.resource.pexels_service import PexelsService
 from services.resource.pixabay_service import PixabayService
 from services.sd.sd_service import SDService
 from services.video.merge_service import merge_get_video_list, VideoMergeService, merge_generate_subtitle
+from services.video.proxy_service import is_proxy_preview, load_edl
+from services.video.render_graph_service import is_single_pass_render
+from services.video.timeline import ClipSpec
 from services.video.video_service import get_audio_duration, VideoService, VideoMixService
 from tools.tr_utils import tr
 from tools.utils import random_with_system_time, get_must_session_option, extent_audio
@@ -169,10 +174,10 @@ def main_generate_video_dubbing():
         audio_voice = get_must_session_option("audio_voice", "请先设置配音语音")
         if audio_voice is None:
             return
-        audio_service.save_with_ssml(video_content,
-                                     audio_output_file,
-                                     audio_voice,
-                                     audio_rate)
+        tts_provider = my_config['audio']['provider']
+
+        def synthesize(text, output_file):
+            audio_service.save_with_ssml(text, output_file, audio_voice, audio_rate)
     else:
         print("use local audio")
         selected_local_audio_tts_provider = my_config['audio'].get('local_tts', {}).get('provider', '')
@@ -183,7 +188,19 @@ def main_generate_video_dubbing():
             audio_service = GPTSoVITSAudioService()
         if selected_local_audio_tts_provider == "CosyVoice":
             audio_service = CosyVoiceAudioService()
-        audio_service.chat_with_content(video_content, audio_output_file)
+        tts_provider = selected_local_audio_tts_provider
+        synthesize = audio_service.chat_with_content
+
+    if is_long_text(video_content):
+        try:
+            synthesize_chunked(synthesize, video_content, audio_output_file, tts_provider)
+        except Exception as e:
+            print(f"分句合成配音失败，改为整段合成: {e}")
+            synthesize(video_content, audio_output_file)
+    else:
+        synthesize(video_content, audio_output_file)
+    # TTS服务没有返回时间时，生成字幕时用文案和配音对齐
+    st.session_state["caption_script"] = video_content
     # 语音扩展2秒钟,防止突然结束很突兀
     extent_audio(audio_output_file, 2)
     print("main_generate_video_dubbing end")
@@ -212,6 +229,26 @@ def main_generate_video_dubbing_for_mix():
     print("main_generate_video_dubbing_for_mix end")
 
 
+def main_warm_tts_cache_for_mix():
+    print("main_warm_tts_cache_for_mix begin")
+    if st.session_state.get("audio_type") == "remote":
+        audio_service = get_audio_service()
+        audio_rate = get_audio_rate()
+        success_count, total_count = warm_audio_cache(audio_service, audio_rate)
+    else:
+        selected_local_audio_tts_provider = my_config['audio'].get('local_tts', {}).get('provider', '')
+        audio_service = None
+        if selected_local_audio_tts_provider == "chatTTS":
+            audio_service = ChatTTSAudioService()
+        if selected_local_audio_tts_provider == "GPTSoVITS":
+            audio_service = GPTSoVITSAudioService()
+        if selected_local_audio_tts_provider == "CosyVoice":
+            audio_service = CosyVoiceAudioService()
+        success_count, total_count = warm_audio_cache_local(audio_service)
+    st.toast(f"{tr('Warm TTS cache')}: {success_count}/{total_count}")
+    print("main_warm_tts_cache_for_mix end")
+
+
 def get_audio_rate():
     audio_provider = my_config['audio']['provider']
     if audio_provider == "Azure":
@@ -295,6 +332,92 @@ def main_generate_subtitle():
         generate_caption()
 
 
+def get_subtitle_style():
+    return {
+        "font_name": st.session_state.get('subtitle_font'),
+        "font_size": st.session_state.get('subtitle_font_size'),
+        "primary_colour": st.session_state.get('subtitle_color'),
+        "outline_colour": st.session_state.get('subtitle_border_color'),
+        "outline": st.session_state.get('subtitle_border_width'),
+        "alignment": st.session_state.get('subtitle_position'),
+    }
+
+
+def main_render_video_single_pass(video_service):
+    # 一次编码完成拼接、配音、背景音乐和字幕
+    st.write(tr("Generate Video..."))
+    subtitle_filter = None
+    if st.session_state.get("enable_subtitles"):
+        subtitle_file = get_must_session_option('captioning_output', "请先生成字幕文件")
+        if subtitle_file is None:
+            return None
+        subtitle_filter = build_subtitle_filter(subtitle_file, **get_subtitle_style())
+    video_file = video_service.generate_video_single_pass(subtitle_filter)
+    print("final file:", video_file)
+    return video_file
+
+
+def main_render_video(video_service):
+    # 配音和字幕文件已经生成好，按照render_mode生成最终视频，预览模式同时保存EDL
+    # 先清掉上一次预览的EDL，正式视频和生成失败时都不能再按旧的预览生成
+    st.session_state["result_edl_file"] = None
+    if is_single_pass_render():
+        video_file = main_render_video_single_pass(video_service)
+    else:
+        print("normalize video")
+        video_service.normalize_video()
+        st.write(tr("Generate Video..."))
+        video_file = video_service.generate_video_with_audio()
+        print("final file without subtitle:", video_file)
+
+        enable_subtitles = st.session_state.get("enable_subtitles")
+        if enable_subtitles:
+            st.write(tr("Add Subtitles..."))
+            subtitle_file = get_must_session_option('captioning_output', "请先生成字幕文件")
+            if subtitle_file is None:
+                return None
+            add_subtitles(video_file, subtitle_file, encode_profile=video_service.encode_profile,
+                          **get_subtitle_style())
+            print("final file with subtitle:", video_file)
+    if video_file is not None and video_service.proxy:
+        st.session_state["result_edl_file"] = video_service.save_edl(video_file,
+                                                                     st.session_state.get('captioning_output'))
+    return video_file
+
+
+def main_conform_video(video_generator):
+    # 使用预览时保存的EDL和原始素材生成正式视频，不需要重新配音、识别字幕和选择素材
+    print("main_conform_video begin:")
+    edl_file = get_must_session_option("result_edl_file", "请先生成预览视频")
+    if edl_file is None:
+        return
+    with video_generator:
+        st_area = st.status(tr("Generate Video in process..."), expanded=True)
+        with st_area as status:
+            edl = load_edl(edl_file)
+            st.session_state["video_proxy_preview"] = False
+            if edl["type"] == "merge":
+                st.session_state["result_edl_file"] = None
+                st.write(tr("Video normalize..."))
+                video_service = VideoMergeService(edl["video_list"])
+                video_scene_video_list = video_service.normalize_video()
+                st.write(tr("Generate Video subtitles..."))
+                merge_generate_subtitle(video_scene_video_list, edl.get("text_list"), video_service.encode_profile)
+                st.write(tr("Generate Video..."))
+                video_file = video_service.generate_video_with_bg_music()
+            else:
+                st.session_state["audio_output_file"] = edl["audio_file"]
+                if edl.get("subtitle_file"):
+                    st.session_state["captioning_output"] = edl["subtitle_file"]
+                clip_specs = [ClipSpec.from_dict(clip) for clip in edl["clips"]]
+                video_file = main_render_video(VideoService(clip_specs, edl["audio_file"]))
+                if video_file is None:
+                    return
+            print("final file:", video_file)
+            st.session_state["result_video_file"] = video_file
+            status.update(label=tr("Generate Video completed!"), state="complete", expanded=False)
+
+
 def main_generate_ai_video(video_generator):
     print("main_generate_ai_video begin:")
     with video_generator:
@@ -314,34 +437,10 @@ def main_generate_ai_video(video_generator):
             if video_list is None:
                 return
 
-            video_service = VideoService(video_list, audio_file)
-            print("normalize video")
-            video_service.normalize_video()
-            st.write(tr("Generate Video..."))
-            video_file = video_service.generate_video_with_audio()
-            print("final file without subtitle:", video_file)
-
-            enable_subtitles = st.session_state.get("enable_subtitles")
-            if enable_subtitles:
-                st.write(tr("Add Subtitles..."))
-                subtitle_file = get_must_session_option('captioning_output', "请先生成字幕文件")
-                if subtitle_file is None:
-                    return
-
-                font_name = st.session_state.get('subtitle_font')
-                font_size = st.session_state.get('subtitle_font_size')
-                primary_colour = st.session_state.get('subtitle_color')
-                outline_colour = st.session_state.get('subtitle_border_color')
-                outline = st.session_state.get('subtitle_border_width')
-                alignment = st.session_state.get('subtitle_position')
-                add_subtitles(video_file, subtitle_file,
-                              font_name=font_name,
-                              font_size=font_size,
-                              primary_colour=primary_colour,
-                              outline_colour=outline_colour,
-                              outline=outline,
-                              alignment=alignment)
-                print("final file with subtitle:", video_file)
+            video_service = VideoService(video_list, audio_file, proxy=is_proxy_preview())
+            video_file = main_render_video(video_service)
+            if video_file is None:
+                return
             st.session_state["result_video_file"] = video_file
             status.update(label=tr("Generate Video completed!"), state="complete", expanded=False)
 
@@ -376,36 +475,14 @@ def main_generate_ai_video_for_mix(video_generator):
 
             final_audio_output_file = concat_audio_list(audio_output_file_list)
             st.session_state['audio_output_file'] = final_audio_output_file
+            # 识别字幕时可以分别识别每个场景的配音
+            st.session_state['caption_audio_parts'] = (final_audio_output_file, audio_output_file_list)
             st.write(tr("Generate Video subtitles..."))
             main_generate_subtitle()
-            video_service = VideoService(final_video_file_list, final_audio_output_file)
-            print("normalize video")
-            video_service.normalize_video()
-            st.write(tr("Generate Video..."))
-            video_file = video_service.generate_video_with_audio()
-            print("final file without subtitle:", video_file)
-
-            enable_subtitles = st.session_state.get("enable_subtitles")
-            if enable_subtitles:
-                st.write(tr("Add Subtitles..."))
-                subtitle_file = get_must_session_option('captioning_output', "请先生成字幕文件")
-                if subtitle_file is None:
-                    return
-
-                font_name = st.session_state.get('subtitle_font')
-                font_size = st.session_state.get('subtitle_font_size')
-                primary_colour = st.session_state.get('subtitle_color')
-                outline_colour = st.session_state.get('subtitle_border_color')
-                outline = st.session_state.get('subtitle_border_width')
-                alignment = st.session_state.get('subtitle_position')
-                add_subtitles(video_file, subtitle_file,
-                              font_name=font_name,
-                              font_size=font_size,
-                              primary_colour=primary_colour,
-                              outline_colour=outline_colour,
-                              outline=outline,
-                              alignment=alignment)
-                print("final file with subtitle:", video_file)
+            video_service = VideoService(final_video_file_list, final_audio_output_file, proxy=is_proxy_preview())
+            video_file = main_render_video(video_service)
+            if video_file is None:
+                return
             st.session_state["result_video_file"] = video_file
             status.update(label=tr("Generate Video completed!"), state="complete", expanded=False)
 
@@ -429,15 +506,18 @@ def main_generate_ai_video_for_merge(video_generator):
         st_area = st.status(tr("Generate Video in process..."), expanded=True)
         with st_area as status:
             video_scene_video_list, video_scene_text_list = merge_get_video_list()
+            st.session_state["result_edl_file"] = None
             st.write(tr("Video normalize..."))
-            video_service = VideoMergeService(video_scene_video_list)
+            video_service = VideoMergeService(video_scene_video_list, proxy=is_proxy_preview())
             print("normalize video")
             video_scene_video_list = video_service.normalize_video()
             st.write(tr("Generate Video subtitles..."))
-            merge_generate_subtitle(video_scene_video_list, video_scene_text_list)
+            merge_generate_subtitle(video_scene_video_list, video_scene_text_list, video_service.encode_profile)
             st.write(tr("Generate Video..."))
             video_file = video_service.generate_video_with_bg_music()
             print("final file:", video_file)
+            if video_service.proxy:
+                st.session_state["result_edl_file"] = video_service.save_edl(video_file, video_scene_text_list)
 
             st.session_state["result_video_file"] = video_file
             status.update(label=tr("Generate Video completed!"), state="complete", expanded=False)
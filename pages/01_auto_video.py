@@ -24,10 +24,10 @@
 import streamlit as st
 
 from config.config import my_config, save_config, languages, audio_languages, transition_types, \
-    fade_list, audio_types, load_session_state_from_yaml, save_session_state_to_yaml, app_title, GPT_soVITS_languages, CosyVoice_voice
+    fade_list, encode_profile_options, get_encode_profile_index, audio_types, load_session_state_from_yaml, save_session_state_to_yaml, app_title, GPT_soVITS_languages, CosyVoice_voice
 from main import main_generate_video_content, main_generate_ai_video, main_generate_video_dubbing, \
     main_get_video_resource, main_generate_subtitle, main_try_test_audio, get_audio_voices, main_try_test_local_audio, \
-    main_generate_ai_video_from_img
+    main_generate_ai_video_from_img, main_conform_video
 from pages.common import common_ui
 from services.sd.sd_service import SDService
 from tools.tr_utils import tr
@@ -336,7 +336,7 @@ video_container = st.container(border=True)
 
 with video_container:
     st.subheader(tr("Video Config"))
-    llm_columns = st.columns(3)
+    llm_columns = st.columns(4)
     with llm_columns[0]:
         layout_options = {"portrait": "竖屏", "landscape": "横屏", "square": "方形"}
         st.selectbox(label=tr("video layout"), key="video_layout", options=layout_options,
@@ -355,6 +355,10 @@ with video_container:
                                   "240x240": "240p"}
         st.selectbox(label=tr("video size"), key="video_size", options=video_size_options,
                      format_func=lambda x: video_size_options[x])
+    with llm_columns[3]:
+        st.selectbox(label=tr("video encode profile"), key="video_encode_profile",
+                     options=encode_profile_options, index=get_encode_profile_index(),
+                     format_func=lambda x: tr(encode_profile_options[x]))
     llm_columns = st.columns(2)
     with llm_columns[0]:
         st.slider(label=tr("video segment min length"), min_value=5, value=5, max_value=10, step=1,
@@ -431,6 +435,13 @@ with subtitle_container:
 video_generator = st.container(border=True)
 with video_generator:
     st.button(label=tr("Generate Video Button"), type="primary", on_click=generate_video, args=(video_generator,))
+    llm_columns = st.columns(2)
+    with llm_columns[0]:
+        st.checkbox(label=tr("Proxy preview"), key="video_proxy_preview", value=False,
+                    help=tr("Proxy preview help"))
+    with llm_columns[1]:
+        st.button(label=tr("Conform final video"), on_click=main_conform_video, args=(video_generator,),
+                  disabled=not st.session_state.get("result_edl_file"))
 result_video_file = st.session_state.get("result_video_file")
 if result_video_file:
     st.video(result_video_file)
\ No newline at end of file
@@ -25,9 +25,10 @@ import os
 
 import streamlit as st
 
-from config.config import transition_types, fade_list, load_session_state_from_yaml, \
+from config.config import transition_types, fade_list, encode_profile_options, get_encode_profile_index, load_session_state_from_yaml, \
     save_session_state_to_yaml, app_title
-from main import main_try_test_audio, main_try_test_local_audio, main_generate_ai_video_for_merge
+from main import main_try_test_audio, main_try_test_local_audio, main_generate_ai_video_for_merge, \
+    main_conform_video
 from pages.common import common_ui
 from tools.tr_utils import tr
 from tools.utils import get_file_map_from_dir
@@ -148,7 +149,7 @@ with bg_music_container:
 video_container = st.container(border=True)
 with video_container:
     st.subheader(tr("Video Config"))
-    llm_columns = st.columns(3)
+    llm_columns = st.columns(4)
     with llm_columns[0]:
         layout_options = {"portrait": "竖屏", "landscape": "横屏", "square": "方形"}
         st.selectbox(label=tr("video layout"), key="video_layout", options=layout_options,
@@ -167,6 +168,10 @@ with video_container:
                                   "240x240": "240p"}
         st.selectbox(label=tr("video size"), key="video_size", options=video_size_options,
                      format_func=lambda x: video_size_options[x])
+    with llm_columns[3]:
+        st.selectbox(label=tr("video encode profile"), key="video_encode_profile",
+                     options=encode_profile_options, index=get_encode_profile_index(),
+                     format_func=lambda x: tr(encode_profile_options[x]))
     # llm_columns = st.columns(2)
     # with llm_columns[0]:
     #     st.slider(label=tr("video segment min length"), min_value=5.0, value=5.0, max_value=10.0, step=1.0,
@@ -240,6 +245,13 @@ with video_generator:
               key="videos_count")
     st.button(label=tr("Generate Video Button"), type="primary", on_click=generate_video_for_merge,
               args=(video_generator,))
+    llm_columns = st.columns(2)
+    with llm_columns[0]:
+        st.checkbox(label=tr("Proxy preview"), key="video_proxy_preview", value=False,
+                    help=tr("Proxy preview help"))
+    with llm_columns[1]:
+        st.button(label=tr("Conform final video"), on_click=main_conform_video, args=(video_generator,),
+                  disabled=not st.session_state.get("result_edl_file"))
 result_video_file = st.session_state.get("result_video_file")
 if result_video_file:
     st.video(result_video_file)
\ No newline at end of file
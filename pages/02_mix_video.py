@@ -25,9 +25,10 @@ import os
 
 import streamlit as st
 
-from config.config import transition_types, fade_list, audio_languages, audio_types, load_session_state_from_yaml, \
+from config.config import transition_types, fade_list, encode_profile_options, get_encode_profile_index, audio_languages, audio_types, load_session_state_from_yaml, \
     save_session_state_to_yaml, app_title, GPT_soVITS_languages, CosyVoice_voice, my_config
-from main import main_generate_ai_video_for_mix, main_try_test_audio, get_audio_voices, main_try_test_local_audio
+from main import main_generate_ai_video_for_mix, main_try_test_audio, get_audio_voices, main_try_test_local_audio, \
+    main_conform_video, main_warm_tts_cache_for_mix
 from pages.common import common_ui
 from tools.tr_utils import tr
 from tools.utils import get_file_map_from_dir
@@ -115,13 +116,16 @@ with mix_video_container:
                       help=tr("One Line Text For One Scene,UTF-8 encoding. If empty, audio will be extracted from video files."),
                       key="video_scene_text_" + str(1))
     more_scene_fragment(video_scene_container)
-    st_columns = st.columns(2)
+    st_columns = st.columns(3)
     with st_columns[0]:
         st.button(label=tr("Add More Scene"), type="primary", on_click=add_more_scene_for_mix,
                   args=(video_scene_container,))
     with st_columns[1]:
         st.button(label=tr("Delete Extra Scene"), type="primary", on_click=delete_scene_for_mix,
                   args=(video_scene_container,))
+    with st_columns[2]:
+        st.button(label=tr("Warm TTS cache"), on_click=main_warm_tts_cache_for_mix,
+                  help=tr("Warm TTS cache help"))
 
 # 配音区域
 captioning_container = st.container(border=True)
@@ -302,7 +306,7 @@ with bg_music_container:
 video_container = st.container(border=True)
 with video_container:
     st.subheader(tr("Video Config"))
-    llm_columns = st.columns(3)
+    llm_columns = st.columns(4)
     with llm_columns[0]:
         layout_options = {"portrait": "竖屏", "landscape": "横屏", "square": "方形"}
         st.selectbox(label=tr("video layout"), key="video_layout", options=layout_options,
@@ -321,6 +325,10 @@ with video_container:
                                   "240x240": "240p"}
         st.selectbox(label=tr("video size"), key="video_size", options=video_size_options,
                      format_func=lambda x: video_size_options[x])
+    with llm_columns[3]:
+        st.selectbox(label=tr("video encode profile"), key="video_encode_profile",
+                     options=encode_profile_options, index=get_encode_profile_index(),
+                     format_func=lambda x: tr(encode_profile_options[x]))
     llm_columns = st.columns(2)
     with llm_columns[0]:
         st.slider(label=tr("video segment min length"), min_value=5, value=5, max_value=10, step=1,
@@ -394,6 +402,13 @@ with video_generator:
               key="videos_count")
     st.button(label=tr("Generate Video Button"), type="primary", on_click=generate_video_for_mix,
               args=(video_generator,))
+    llm_columns = st.columns(2)
+    with llm_columns[0]:
+        st.checkbox(label=tr("Proxy preview"), key="video_proxy_preview", value=False,
+                    help=tr("Proxy preview help"))
+    with llm_columns[1]:
+        st.button(label=tr("Conform final video"), on_click=main_conform_video, args=(video_generator,),
+                  disabled=not st.session_state.get("result_edl_file"))
 result_video_file = st.session_state.get("result_video_file")
 if result_video_file:
     st.video(result_video_file)
\ No newline at end of file
@@ -156,6 +156,10 @@ class NlsCore:
                 print('send {}'.format(msg))
                 self.__ws.send(msg)
     
+    def is_connected(self):
+        with self.__lock:
+            return self.__connection_status == NlsConnectionStatus.Connected
+
     def shutdown(self):
         self.__ws.close()
 
@@ -3,7 +3,7 @@ import json
 from typing import List
 
 from config.config import my_config
-from services.alinls.token import getToken
+from services.alinls.token import getCachedToken
 from tools.utils import must_have_value
 
 
@@ -22,13 +22,15 @@ class AliRecognitionService:
         must_have_value(self.ALI_ACCESS_AKID, "请设置Ali access key id")
         must_have_value(self.ALI_ACCESS_AKKEY, "请设置Ali access key secret")
         must_have_value(self.ALI_APP_KEY, "请设置Ali app key")
-        self.token = getToken(self.ALI_ACCESS_AKID, self.ALI_ACCESS_AKKEY)
+        self.token = getCachedToken(self.ALI_ACCESS_AKID, self.ALI_ACCESS_AKKEY)
         self.format = "wav"
         self.sampleRate = 16000
         self.url = 'https://nls-gateway-cn-shanghai.aliyuncs.com/stream/v1/FlashRecognizer'
 
     def process(self, audioFile) -> List[AliRecognitionResult]:
         result_list = []
+        # 服务对象可能用了很久，token快过期时重新获取
+        self.token = getCachedToken(self.ALI_ACCESS_AKID, self.ALI_ACCESS_AKKEY)
         # 设置RESTful请求参数
         request = self.url + '?appkey=' + self.ALI_APP_KEY
         request = request + '&token=' + self.token
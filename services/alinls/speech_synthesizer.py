@@ -39,7 +39,8 @@ class NlsSpeechSynthesizer:
                  on_completed=None,
                  on_error=None, 
                  on_close=None,
-                 callback_args=[]):
+                 callback_args=[],
+                 keep_alive=False):
         """
         NlsSpeechSynthesizer initialization
 
@@ -82,6 +83,9 @@ class NlsSpeechSynthesizer:
             The 1st argument is *args which is callback_args.
         callback_args: list
             callback_args will return in callbacks above for *args.
+        keep_alive: bool
+            keep the websocket connection open after synthesis completed, the
+            next start call sends its request on the same connection.
         """
         if not token or not appkey:
             raise InvalidParameter('Must provide token and appkey')
@@ -102,6 +106,8 @@ class NlsSpeechSynthesizer:
         self.__on_completed = on_completed
         self.__on_error = on_error
         self.__on_close = on_close
+        self.__keep_alive = keep_alive
+        self.__nls = None
         self.__allow_aformat = (
             'pcm', 'wav', 'mp3'
                 )
@@ -158,8 +164,9 @@ class NlsSpeechSynthesizer:
 
     def __synthesis_completed(self, message):
         print('__synthesis_completed')
-        self.__nls.shutdown()
-        print('__synthesis_completed shutdown done')
+        if not self.__keep_alive:
+            self.__nls.shutdown()
+            print('__synthesis_completed shutdown done')
         if self.__on_completed:
             self.__on_completed(message, *self.__callback_args)
         with self.__start_cond:
@@ -185,7 +192,8 @@ class NlsSpeechSynthesizer:
               wait_complete=True,
               start_timeout=10,
               completed_timeout=60,
-              ex:dict=None):
+              ex:dict=None,
+              callback_args=None):
         """
         Synthesis start 
 
@@ -214,19 +222,18 @@ class NlsSpeechSynthesizer:
             timeout for waiting synthesis completed from connection established
         ex: dict
             dict which will merge into 'payload' field in request
+        callback_args: list
+            replace callback_args of this synthesizer, used when a kept alive
+            synthesizer is reused for another output
         """
         if text is None:
             raise InvalidParameter('Text cannot be None')
-        
-        self.__nls = NlsCore(
-            url=self.__url,
-            token=self.__token,
-            on_open=self.__syn_core_on_open,
-            on_message=self.__syn_core_on_msg,
-            on_data=self.__syn_core_on_data,
-            on_close=self.__syn_core_on_close,
-            on_error=self.__syn_core_on_error,
-            callback_args=[])
+        if callback_args is not None:
+            self.__callback_args = callback_args
+
+        reuse = self.__keep_alive and self.__nls is not None and self.__nls.is_connected()
+        if not reuse:
+            self.__nls = self.__create_core()
 
         if aformat not in self.__allow_aformat:
             raise InvalidParameter('format {} not support'.format(aformat))
@@ -272,7 +279,18 @@ class NlsSpeechSynthesizer:
             if self.__start_flag:
                 print('already start...')
                 return
-            self.__nls.start(__jmsg, ping_interval=0, ping_timeout=None)
+            if reuse:
+                # connection is already open, on_open will not be called again
+                try:
+                    self.__start_flag = True
+                    self.__nls.start(__jmsg, ping_interval=0, ping_timeout=None)
+                except Exception as e:
+                    print('reuse connection failed:{}'.format(e))
+                    self.__start_flag = False
+                    reuse = False
+                    self.__nls = self.__create_core()
+            if not reuse:
+                self.__nls.start(__jmsg, ping_interval=0, ping_timeout=None)
             if self.__start_flag == False:
                 if not self.__start_cond.wait(start_timeout):
                     print('syn start timeout')
@@ -281,8 +299,20 @@ class NlsSpeechSynthesizer:
                 if not self.__start_cond.wait(completed_timeout):
                     raise CompleteTimeoutException(f'Waiting Complete over {completed_timeout}s')
 
+    def __create_core(self):
+        return NlsCore(
+            url=self.__url,
+            token=self.__token,
+            on_open=self.__syn_core_on_open,
+            on_message=self.__syn_core_on_msg,
+            on_data=self.__syn_core_on_data,
+            on_close=self.__syn_core_on_close,
+            on_error=self.__syn_core_on_error,
+            callback_args=[])
+
     def shutdown(self):
         """
         Shutdown connection immediately
         """
-        self.__nls.shutdown()
+        if self.__nls is not None:
+            self.__nls.shutdown()
@@ -0,0 +1,77 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import threading
+
+from services.alinls.speech_synthesizer import NlsSpeechSynthesizer
+
+
+class NlsSynthesizerPool:
+    """
+    复用阿里云语音合成的websocket连接，批量合成时只需要建立一次TLS连接和握手
+    空闲的连接被服务端关闭后，下次使用时会自动重新连接
+    """
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, token, appkey, long_tts, fresh=False, **callbacks):
+        """
+        取一个空闲的合成器，没有的话新建一个
+        :param fresh: 为True时不使用空闲的连接，总是新建
+        :param callbacks: on_metainfo, on_data等回调，只在新建时使用，回调参数通过start的callback_args传入
+        """
+        key = (appkey, long_tts)
+        if fresh:
+            return NlsSpeechSynthesizer(token=token, appkey=appkey, long_tts=long_tts, keep_alive=self.max_idle > 0,
+                                        **callbacks)
+        with self._lock:
+            idle = self._idle.get(key, [])
+            # token刷新之后旧token的连接不再使用
+            for idle_token, synthesizer in [item for item in idle if item[0] != token]:
+                synthesizer.shutdown()
+            idle = [item for item in idle if item[0] == token]
+            self._idle[key] = idle
+            if idle:
+                return idle.pop()[1]
+        return NlsSpeechSynthesizer(token=token, appkey=appkey, long_tts=long_tts, keep_alive=self.max_idle > 0,
+                                    **callbacks)
+
+    def release(self, token, appkey, long_tts, synthesizer):
+        # 合成成功之后放回连接池，超过max_idle的直接关闭
+        key = (appkey, long_tts)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((token, synthesizer))
+                return
+        synthesizer.shutdown()
+
+    def discard(self, synthesizer):
+        # 合成失败的连接状态不确定，直接关闭
+        try:
+            synthesizer.shutdown()
+        except Exception as e:
+            print("shutdown synthesizer failed:", e)
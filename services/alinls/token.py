@@ -5,8 +5,16 @@ from aliyunsdkcore.request import CommonRequest
 from .exception import GetTokenFailed
 
 import json
+import threading
+import time
 
-__all__ = ['getToken']
+__all__ = ['getToken', 'createToken', 'getCachedToken']
+
+# refresh cached tokens this many seconds before they expire
+__REFRESH_AHEAD__ = 600
+
+__token_cache = {}
+__token_cache_lock = threading.Lock()
 
 def getToken(akid, aksecret, domain='cn-shanghai',
              version='2019-02-28',
@@ -15,6 +23,16 @@ def getToken(akid, aksecret, domain='cn-shanghai',
     Help methods to get token from aliyun by giving access id and access secret
     key
 
+    Parameters are the same as createToken, only the token id is returned
+    """
+    return createToken(akid, aksecret, domain, version, url)[0]
+
+def createToken(akid, aksecret, domain='cn-shanghai',
+                version='2019-02-28',
+                url='nls-meta.cn-shanghai.aliyuncs.com'):
+    """
+    Create a new token, returns (token id, expire time in unix seconds)
+
     Parameters:
     -----------
     akid: str
@@ -42,8 +60,29 @@ def getToken(akid, aksecret, domain='cn-shanghai',
     if 'Token' in response_json:
         token = response_json['Token']
         if 'Id' in token:
-            return token['Id']
+            return token['Id'], int(token.get('ExpireTime') or 0)
         else:
             raise GetTokenFailed(f'Missing id field in token:{token}') 
     else:
         raise GetTokenFailed(f'Token not in response:{response_json}')
+
+def getCachedToken(akid, aksecret, domain='cn-shanghai',
+                   version='2019-02-28',
+                   url='nls-meta.cn-shanghai.aliyuncs.com',
+                   refresh_ahead=__REFRESH_AHEAD__):
+    """
+    Process-wide token cache, one token per access id. The token is refreshed
+    refresh_ahead seconds before its expire time, so callers never get a
+    token which expires during a request.
+    """
+    key = (akid, domain, url)
+    with __token_cache_lock:
+        cached = __token_cache.get(key)
+        if cached is not None and cached[1] - refresh_ahead > time.time():
+            return cached[0]
+        token_id, expire_time = createToken(akid, aksecret, domain, version, url)
+        if not expire_time:
+            # no expire time in response, try again next time
+            expire_time = time.time() + refresh_ahead * 2
+        __token_cache[key] = (token_id, expire_time)
+        return token_id
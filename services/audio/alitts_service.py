@@ -21,15 +21,19 @@
 #
 #
 
+import json
 import os
+import threading
 
 from pydub import AudioSegment
 from pydub.playback import play
 
 from config.config import my_config
-from services.alinls.speech_synthesizer import NlsSpeechSynthesizer
-from services.alinls.token import getToken
+from services.alinls.synthesizer_pool import NlsSynthesizerPool
+from services.alinls.token import getCachedToken
 from services.audio.audio_service import AudioService
+from services.audio.tts_cache import cached_tts
+from services.audio.tts_timing import build_phrase_timings, remove_tts_timings, save_tts_timings
 from tools.utils import must_have_value
 
 # 获取当前脚本的绝对路径
@@ -43,6 +47,19 @@ script_dir = os.path.dirname(script_path)
 audio_output_dir = os.path.join(script_dir, "../../work")
 audio_output_dir = os.path.abspath(audio_output_dir)
 
+_synthesizer_pool = None
+_synthesizer_pool_lock = threading.Lock()
+
+
+def get_synthesizer_pool():
+    # 进程内共享的合成连接池，audio.Ali.max_idle_sessions为0时每次合成都新建连接
+    global _synthesizer_pool
+    with _synthesizer_pool_lock:
+        if _synthesizer_pool is None:
+            max_idle = my_config['audio']['Ali'].get('max_idle_sessions', 4)
+            _synthesizer_pool = NlsSynthesizerPool(int(max_idle))
+        return _synthesizer_pool
+
 
 class AliAudioService(AudioService):
 
@@ -54,49 +71,97 @@ class AliAudioService(AudioService):
         must_have_value(self.ALI_ACCESS_AKID, "请设置Ali access key id")
         must_have_value(self.ALI_ACCESS_AKKEY, "请设置Ali access key secret")
         must_have_value(self.ALI_APP_KEY, "请设置Ali app key")
-        self.token = getToken(self.ALI_ACCESS_AKID, self.ALI_ACCESS_AKKEY)
+        self.token = getCachedToken(self.ALI_ACCESS_AKID, self.ALI_ACCESS_AKKEY)
 
+    # 回调的args[0]是这次合成的输出文件，args[1]记录合成是否完成和字级时间，每次合成使用自己的文件，可以多个线程同时合成
     def on_metainfo(self, message, *args):
         print("on_metainfo message=>{}".format(message))
+        # 开启enable_subtitle后返回每个字的时间，end_index不包含，时间单位毫秒
+        try:
+            subtitles = json.loads(message).get('payload', {}).get('subtitles') or []
+        except ValueError as e:
+            print("parse metainfo failed:", e)
+            return
+        for subtitle in subtitles:
+            args[1]["subtitles"][(subtitle['begin_index'], subtitle['end_index'])] = (
+                subtitle['begin_time'] / 1000, subtitle['end_time'] / 1000)
 
     def on_error(self, message, *args):
-        print("on_error args=>{}".format(args))
+        print("on_error message=>{}".format(message))
 
     def on_close(self, *args):
-        print("on_close: args=>{}".format(args))
+        print("on_close")
         try:
-            self.__f.close()
+            args[0].close()
         except Exception as e:
             print("close file failed since:", e)
 
     def on_data(self, data, *args):
         try:
-            self.__f.write(data)
+            args[0].write(data)
         except Exception as e:
             print("write data failed:", e)
 
     def on_completed(self, message, *args):
-        print("on_completed:args=>{} message=>{}".format(args, message))
-
-    def save_with_ssml(self, text, file_name, voice, rate="0"):
-        self.__f = open(file_name, "wb")
+        print("on_completed: message=>{}".format(message))
+        args[1]["completed"] = True
+
+    def synthesize_once(self, text, file_name, voice, rate, fresh=False):
+        """
+        合成一次，返回是否完成
+        连接被服务端关闭时start也会正常返回，只有收到on_completed才说明音频是完整的
+        :param fresh: 为True时新建连接，不使用连接池里空闲的连接
+        """
+        output_file = open(file_name, "wb")
+        result = {"completed": False, "subtitles": {}}
         # 阿里tts支持一次性合成300字符以内的文字，如果大于300字，需要开通长文本tts功能。
         long_tts = False
         if len(text) > 300:
             long_tts = True
-        nls_speech_synthesizer = NlsSpeechSynthesizer(
-            token=self.token,
-            appkey=self.ALI_APP_KEY,
-            long_tts=long_tts,
-            on_metainfo=self.on_metainfo,
-            on_data=self.on_data,
-            on_completed=self.on_completed,
-            on_error=self.on_error,
-            on_close=self.on_close,
-            callback_args=[""]
-        )
-        r = nls_speech_synthesizer.start(text, voice=voice, aformat='wav', wait_complete=True, speech_rate=int(rate))
-        print("ali tts done with result:{}".format(r))
+        # token快过期时会自动刷新
+        token = getCachedToken(self.ALI_ACCESS_AKID, self.ALI_ACCESS_AKKEY)
+        pool = get_synthesizer_pool()
+        nls_speech_synthesizer = pool.acquire(token, self.ALI_APP_KEY, long_tts, fresh,
+                                              on_metainfo=self.on_metainfo,
+                                              on_data=self.on_data,
+                                              on_completed=self.on_completed,
+                                              on_error=self.on_error,
+                                              on_close=self.on_close)
+        try:
+            r = nls_speech_synthesizer.start(text, voice=voice, aformat='wav', wait_complete=True,
+                                             speech_rate=int(rate), ex={'enable_subtitle': True},
+                                             callback_args=[output_file, result])
+            print("ali tts done with result:{}".format(r))
+        except Exception as e:
+            print("ali tts failed:", e)
+        finally:
+            # 复用连接时合成完成不会触发on_close，连接异常时on_close也可能没有被调用
+            if not output_file.closed:
+                output_file.close()
+            if result["completed"]:
+                pool.release(token, self.ALI_APP_KEY, long_tts, nls_speech_synthesizer)
+            else:
+                pool.discard(nls_speech_synthesizer)
+        # 字级时间合并成短句，保存下来生成字幕时使用
+        if result["completed"] and result["subtitles"]:
+            spans = [(begin_index, end_index, start, end)
+                     for (begin_index, end_index), (start, end) in sorted(result["subtitles"].items())]
+            save_tts_timings(file_name, build_phrase_timings(text, spans))
+        else:
+            remove_tts_timings(file_name)
+        return result["completed"]
+
+    @cached_tts("Ali")
+    def save_with_ssml(self, text, file_name, voice, rate="0"):
+        if self.synthesize_once(text, file_name, voice, rate):
+            return
+        # 复用的连接可能已经被服务端关闭，音频不完整，新建连接重试一次
+        print("ali tts not completed, retry with a new connection")
+        if self.synthesize_once(text, file_name, voice, rate, fresh=True):
+            return
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        raise Exception(f"阿里云语音合成没有完成: {text[:20]}")
 
     def read_with_ssml(self, text, voice, rate="0"):
         temp_file = os.path.join(audio_output_dir, "temp.wav")
@@ -25,6 +25,8 @@ import os
 
 from config.config import my_config
 from services.audio.audio_service import AudioService
+from services.audio.tts_cache import cached_tts
+from services.audio.tts_timing import build_phrase_timings, remove_tts_timings, save_tts_timings
 from tools.utils import must_have_value
 
 try:
@@ -69,12 +71,25 @@ class AzureAudioService(AudioService):
             if cancellation_details.reason == speechsdk.CancellationReason.Error:
                 print("Error details: {}".format(cancellation_details.error_details))
 
-    def my_speech_synthesis_to_wave_file_ssml(self, text, file_name):
+    def my_speech_synthesis_to_wave_file_ssml(self, text, file_name, word_boundaries=None):
+        """
+        :param word_boundaries: 不为空时收集每个词的时间 (ssml中的起始位置, 长度, 开始秒数, 结束秒数)
+        """
         speech_config = speechsdk.SpeechConfig(subscription=self.speech_key, region=self.service_region)
         print(file_name)
         file_config = speechsdk.audio.AudioOutputConfig(filename=file_name)
         # speech_config.speech_synthesis_voice_name = voice
         speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=file_config)
+        if word_boundaries is not None:
+            def on_word_boundary(evt):
+                # audio_offset的单位是100纳秒，text_offset是在ssml中的位置，标点等没有位置时为-1
+                if evt.text_offset < 0:
+                    return
+                start = evt.audio_offset / 10000000
+                word_boundaries.append((evt.text_offset, evt.word_length, start,
+                                        start + evt.duration.total_seconds()))
+
+            speech_synthesizer.synthesis_word_boundary.connect(on_word_boundary)
 
         # Receives a text from console input and synthesizes it to wave file.
         result = speech_synthesizer.speak_ssml_async(text).get()
@@ -132,6 +147,7 @@ class AzureAudioService(AudioService):
                 print("Error details: {}".format(cancellation_details.error_details))
 
     # save to file
+    @cached_tts("Azure")
     def save_with_ssml(self, text, file_name, voice, rate="0.00"):
         ssml = f"""
         <speak xmlns="http://www.w3.org/2001/10/synthesis" xmlns:mstts="http://www.w3.org/2001/mstts" xmlns:emo="http://www.w3.org/2009/10/emotionml" version="1.0" xml:lang="en-US">
@@ -142,11 +158,21 @@ class AzureAudioService(AudioService):
         </voice>
         </speak>
         """
-        result = self.my_speech_synthesis_to_wave_file_ssml(ssml, file_name)
+        word_boundaries = []
+        result = self.my_speech_synthesis_to_wave_file_ssml(ssml, file_name, word_boundaries)
         # 如果出现异常，重试一次
         if not result:
             os.remove(file_name)
-            self.my_speech_synthesis_to_wave_file_ssml(ssml, file_name)
+            word_boundaries.clear()
+            result = self.my_speech_synthesis_to_wave_file_ssml(ssml, file_name, word_boundaries)
+        # 词的时间换算成在文案中的位置，保存下来生成字幕时使用
+        text_begin = ssml.find(text)
+        if result and word_boundaries and text_begin >= 0:
+            spans = [(offset - text_begin, offset - text_begin + length, start, end)
+                     for offset, length, start, end in word_boundaries]
+            save_tts_timings(file_name, build_phrase_timings(text, spans))
+        else:
+            remove_tts_timings(file_name)
 
     def read_with_ssml(self, text, voice, rate="0.00"):
         ssml = f"""
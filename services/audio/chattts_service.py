@@ -24,17 +24,21 @@
 import datetime
 import lzma
 import os
+import re
+import threading
 import zipfile
 from io import BytesIO
 
 import numpy as np
 import requests
-import torch
 from pydub import AudioSegment
 from pydub.playback import play
 
 from config.config import my_config
-from tools.file_utils import read_file, convert_mp3_to_wav
+from services.audio.local_tts_client import post_for_content
+from services.audio.tts_cache import cached_tts, cached_tts_batch
+from tools.cache_utils import cache_root_dir, file_content_hash
+from tools.file_utils import read_file, convert_audio_bytes_to_wav
 from tools.utils import must_have_value, random_with_system_time
 import streamlit as st
 import pybase16384 as b14
@@ -51,8 +55,14 @@ script_dir = os.path.dirname(script_path)
 audio_output_dir = os.path.join(script_dir, "../../work")
 audio_output_dir = os.path.abspath(audio_output_dir)
 
+# 编码后的音色缓存，key是.pt文件内容的hash
+spk_emb_cache_dir = os.path.join(cache_root_dir, "spk_emb")
+_spk_emb_memo = {}
+_spk_emb_lock = threading.Lock()
 
-def encode_spk_emb(spk_emb: torch.Tensor) -> str:
+
+def encode_spk_emb(spk_emb: "torch.Tensor") -> str:
+    import torch
     arr: np.ndarray = spk_emb.to(dtype=torch.float16, device="cpu").detach().numpy()
     s = b14.encode_to_string(
         lzma.compress(
@@ -64,6 +74,38 @@ def encode_spk_emb(spk_emb: torch.Tensor) -> str:
     del arr
     return s
 
+
+def load_spk_emb(voice_file):
+    """
+    读取.pt音色文件并编码，编码结果按文件内容的hash缓存在内存和磁盘上
+    有缓存时不需要导入torch，也不需要重新做很慢的LZMA压缩
+    """
+    file_hash = file_content_hash(voice_file)
+    with _spk_emb_lock:
+        if file_hash in _spk_emb_memo:
+            return _spk_emb_memo[file_hash]
+    cache_file = os.path.join(spk_emb_cache_dir, file_hash + ".txt")
+    if os.path.exists(cache_file):
+        spk_emb = read_file(cache_file)
+    else:
+        import torch
+        spk_emb = encode_spk_emb(torch.load(voice_file, map_location=torch.device('cpu')))
+        os.makedirs(spk_emb_cache_dir, exist_ok=True)
+        temp_file = cache_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(spk_emb)
+        os.replace(temp_file, cache_file)
+    with _spk_emb_lock:
+        _spk_emb_memo[file_hash] = spk_emb
+    return spk_emb
+
+
+def zip_entry_order(file_name):
+    # 按文件名里的数字排序，10.mp3排在9.mp3后面
+    match = re.search(r'\d+', os.path.basename(file_name))
+    return (int(match.group()) if match else float('inf'), file_name)
+
+
 class ChatTTSAudioService:
     def __init__(self):
         super().__init__()
@@ -91,7 +133,7 @@ class ChatTTSAudioService:
             self.audio_seed = None
             if os.path.exists(st.session_state.get('audio_voice')):
                 if st.session_state.get('audio_voice').endswith('.pt'):
-                    self.audio_content = encode_spk_emb(torch.load(st.session_state.get('audio_voice'), map_location=torch.device('cpu')))
+                    self.audio_content = load_spk_emb(st.session_state.get('audio_voice'))
                 if st.session_state.get('audio_voice').endswith('.txt'):
                     self.audio_content = read_file(st.session_state.get('audio_voice'))
 
@@ -114,6 +156,12 @@ class ChatTTSAudioService:
 
         self.chats_url = f"{self.service_location}/generate_voice"
 
+    def tts_cache_params(self):
+        # 除了文案以外影响合成结果的参数
+        return (self.audio_seed, self.text_seed, self.audio_speed, self.skip_refine_text, self.refine_text_prompt,
+                self.audio_temperature, self.audio_top_p, self.audio_top_k,
+                None if self.audio_seed else getattr(self, 'audio_content', None))
+
     def read_with_content(self, content):
         wav_file = os.path.join(audio_output_dir, str(random_with_system_time()) + ".wav")
         temp_file = self.chat_with_content(content, wav_file)
@@ -121,10 +169,10 @@ class ChatTTSAudioService:
         audio = AudioSegment.from_file(temp_file)
         play(audio)
 
-    def chat_with_content(self, content, audio_output_file):
+    def build_request_body(self, texts):
         # main infer params
         body = {
-            "text": [content],
+            "text": texts,
             "stream": False,
             "lang": None,
             "skip_refine_text": self.skip_refine_text,
@@ -166,20 +214,50 @@ class ChatTTSAudioService:
             "spk_emb": self.audio_content if not self.audio_seed else None,
         }
         body["params_infer_code"] = params_infer_code
+        return body
+
+    def save_zip_audio(self, content, audio_output_files):
+        """
+        压缩包直接在内存里解析，音频通过管道交给ffmpeg，不需要解压到磁盘
+        服务端按文本的顺序把音频命名为0.mp3、1.mp3...，按文件名里的序号对应到输出文件
+        """
+        with zipfile.ZipFile(BytesIO(content), "r") as zip_ref:
+            file_names = sorted(zip_ref.namelist(), key=zip_entry_order)
+            if len(file_names) != len(audio_output_files):
+                raise Exception(f"ChatTTS返回了{len(file_names)}个音频，需要{len(audio_output_files)}个")
+            for file_name, audio_output_file in zip(file_names, audio_output_files):
+                audio_data = zip_ref.read(file_name)
+                if file_name.lower().endswith('.wav'):
+                    with open(audio_output_file, "wb") as f:
+                        f.write(audio_data)
+                else:
+                    convert_audio_bytes_to_wav(audio_data, audio_output_file)
+                print("Extracted files into", audio_output_file)
+        return audio_output_files
 
+    @cached_tts("chatTTS")
+    def chat_with_content(self, content, audio_output_file):
+        body = self.build_request_body([content])
         print(body)
 
         try:
-            response = requests.post(self.service_location, json=body)
-            response.raise_for_status()
-            with zipfile.ZipFile(BytesIO(response.content), "r") as zip_ref:
-                zip_ref.extractall(audio_output_dir)
-                file_names = zip_ref.namelist()
-                output_file = os.path.join(audio_output_dir, file_names[0])
-
-                convert_mp3_to_wav(output_file, audio_output_file)
-                print("Extracted files into", audio_output_file)
-                return audio_output_file
+            content = post_for_content(self.service_location, body)
+            self.save_zip_audio(content, [audio_output_file])
+            return audio_output_file
 
         except requests.exceptions.RequestException as e:
             print(f"Request Error: {e}")
+
+    @cached_tts_batch("chatTTS")
+    def chat_with_content_list(self, contents, audio_output_files):
+        """
+        一次请求合成多段文案，服务端可以批量推理，只需要加载一次模型
+        按audio.local_tts.chatTTS.batch_size分批请求，失败时抛出异常
+        """
+        batch_size = max(int(my_config['audio']['local_tts']['chatTTS'].get('batch_size', 8)), 1)
+        for i in range(0, len(contents), batch_size):
+            body = self.build_request_body(contents[i:i + batch_size])
+            print(body)
+            content = post_for_content(self.service_location, body)
+            self.save_zip_audio(content, audio_output_files[i:i + batch_size])
+        return audio_output_files
@@ -0,0 +1,121 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import os
+
+from config.config import my_config
+from services.audio.tts_timing import load_tts_timings, remove_tts_timings, save_tts_timings, shift_timings, \
+    save_sentence_timings
+from services.video.parallel_service import run_in_pool
+from tools.audio_engine import AudioTrack, concat, find_trim_range, load_audio, pad, write_wav
+from tools.file_utils import split_sentences
+
+# 没有配置audio.tts_concurrency时每个TTS服务的默认并发数
+DEFAULT_TTS_CONCURRENCY = {
+    "Azure": 4,
+    "Ali": 2,
+    "Tencent": 4,
+    "chatTTS": 1,
+    "GPTSoVITS": 1,
+    "CosyVoice": 1,
+}
+
+
+def get_tts_concurrency(provider):
+    # 每个TTS服务同时发出的请求数，本地服务一般只能同时处理一个请求
+    tts_concurrency = my_config['audio'].get('tts_concurrency') or {}
+    concurrency = tts_concurrency.get(provider, DEFAULT_TTS_CONCURRENCY.get(provider, 1))
+    return max(int(concurrency), 1)
+
+
+def get_long_tts_config():
+    return my_config['audio'].get('long_tts') or {}
+
+
+def is_long_text(text):
+    # 腾讯超过150字、阿里超过300字会切换到很慢的长文本接口，默认超过150字就分句合成
+    long_tts_config = get_long_tts_config()
+    if not long_tts_config.get('enable', True):
+        return False
+    return len(text) > int(long_tts_config.get('min_length', 150))
+
+
+def synthesize_chunked(synthesize, text, output_file, provider):
+    """
+    长文本按句子拆分，并发合成每一段，再按顺序拼接，句子之间插入固定长度的静音
+    :param synthesize: 合成函数 synthesize(text, audio_output_file)
+    :param provider: TTS服务名，用来确定并发数
+    :return: 每段的时间 [{"text", "start", "end"}]，单位秒，同时保存在输出文件旁边的.sentences.json里，用来生成字幕
+    """
+    long_tts_config = get_long_tts_config()
+    chunks = split_sentences(text, int(long_tts_config.get('max_chunk_length', 100)))
+    silence = float(long_tts_config.get('sentence_silence', 0.3))
+    base_name = os.path.splitext(output_file)[0]
+    chunk_jobs = [(chunk, f"{base_name}.part{idx}.wav") for idx, chunk in enumerate(chunks)]
+
+    def synthesize_one(chunk_job):
+        chunk, chunk_file = chunk_job
+        synthesize(chunk, chunk_file)
+        if not os.path.exists(chunk_file) or os.path.getsize(chunk_file) == 0:
+            raise Exception(f"分段配音失败: {chunk}")
+        return chunk_file
+
+    concurrency = get_tts_concurrency(provider)
+    print(f"synthesize {len(chunks)} chunks with {provider}, concurrency {concurrency}")
+    try:
+        chunk_files = run_in_pool(synthesize_one, chunk_jobs, min(concurrency, max(len(chunk_jobs), 1)))
+
+        # 以第一段的格式为准，每段去掉首尾的静音，再统一补上句间静音
+        first = load_audio(chunk_files[0])
+        tracks = []
+        chunk_timings = []
+        # 字幕使用的时间，所有分段都有TTS返回的短句时间时才保存，否则生成字幕时再对齐或者识别
+        caption_timings = []
+        position = 0.0
+        for idx, (chunk, chunk_file) in enumerate(zip(chunks, chunk_files)):
+            track = load_audio(chunk_file, first.sample_rate, first.channels)
+            trim_start, trim_end = find_trim_range(track)
+            track = AudioTrack(track.samples[trim_start:trim_end], track.sample_rate)
+            chunk_timing = {"text": chunk, "start": round(position, 3), "end": round(position + track.duration, 3)}
+            chunk_timings.append(chunk_timing)
+            phrase_timings = load_tts_timings(chunk_file)
+            if phrase_timings and caption_timings is not None:
+                caption_timings.extend(shift_timings(phrase_timings, position - trim_start / track.sample_rate,
+                                                     (chunk_timing["start"], chunk_timing["end"])))
+            else:
+                caption_timings = None
+            if idx < len(chunk_files) - 1:
+                track = pad(track, silence)
+            tracks.append(track)
+            position += track.duration
+        write_wav(concat(tracks), output_file)
+        save_tts_timings(output_file, caption_timings)
+        # 每一句的时间总是保存，TTS服务没有返回短句时间时生成字幕使用
+        save_sentence_timings(output_file, chunk_timings)
+    finally:
+        # 有分段合成失败时也要删除已经合成的分段
+        for chunk, chunk_file in chunk_jobs:
+            if os.path.exists(chunk_file):
+                os.remove(chunk_file)
+            remove_tts_timings(chunk_file)
+    return chunk_timings
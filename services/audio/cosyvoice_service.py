@@ -28,6 +28,8 @@ from pydub import AudioSegment
 from pydub.playback import play
 
 from config.config import my_config
+from services.audio.local_tts_client import post_to_file
+from services.audio.tts_cache import cached_tts, file_identity
 from tools.file_utils import save_uploaded_file
 from tools.utils import must_have_value, random_with_system_time
 import streamlit as st
@@ -78,6 +80,15 @@ class CosyVoiceAudioService:
 
         self.reference_audio_language = st.session_state.get("reference_audio_language")
 
+    def tts_cache_params(self):
+        # 除了文案以外影响合成结果的参数，参考音频按内容区分
+        refer_wav_path = getattr(self, 'refer_wav_path', None)
+        if refer_wav_path:
+            reference = (file_identity(refer_wav_path), self.prompt_text)
+        else:
+            reference = (self.reference_audio_language,)
+        return (self.audio_seed, self.audio_speed, *reference)
+
     def read_with_content(self, content):
         wav_file = os.path.join(audio_output_dir, str(random_with_system_time()) + ".wav")
         temp_file = self.chat_with_content(content, wav_file)
@@ -85,6 +96,7 @@ class CosyVoiceAudioService:
         audio = AudioSegment.from_file(temp_file)
         play(audio)
 
+    @cached_tts("CosyVoice")
     def chat_with_content(self, content, audio_output_file):
         # main infer params
         if hasattr(self, 'refer_wav_path') and self.refer_wav_path:
@@ -116,13 +128,8 @@ class CosyVoiceAudioService:
         print(body)
 
         try:
-            response = requests.post(self.service_location, json=body)
-            response.raise_for_status()
-            # 读取响应内容
-            content = response.content
-            # 打开一个文件用于写入二进制数据
-            with open(audio_output_file, 'wb') as file:
-                file.write(content)  # 将响应内容写入文件
+            # 响应内容边下载边写入文件
+            post_to_file(self.service_location, body, audio_output_file)
             print(f"文件已保存到 {audio_output_file}")
             return audio_output_file
 
@@ -22,9 +22,13 @@
 #
 
 import os
+import threading
+from collections import OrderedDict
 from typing import List
 
 from config.config import my_config
+from services.video.parallel_service import run_in_pool
+from tools.audio_engine import load_audio
 from tools.utils import must_have_value
 from faster_whisper import WhisperModel
 
@@ -47,6 +51,56 @@ def convert_module_to_path(module_name):
     return return_path
 
 
+class WhisperModelPool:
+    """
+    进程内常驻的WhisperModel，按 (模型名, 设备, 计算类型, worker数) 区分
+    最多保留max_models个模型，超过时释放最久没有使用的模型
+    """
+
+    def __init__(self, max_models=1):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        # 同一个模型只加载一次，加载时不阻塞其他模型的读取
+        self._load_locks = {}
+
+    def get(self, model_name, device_type, compute_type, num_workers=1):
+        key = (model_name, device_type, compute_type, num_workers)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+            print(f"load whisper model {key}")
+            model = WhisperModel(convert_module_to_path(model_name), device=device_type, compute_type=compute_type,
+                                 num_workers=num_workers, local_files_only=True)
+            with self._lock:
+                self._models[key] = model
+                while len(self._models) > max(self.max_models, 1):
+                    evicted_key, _ = self._models.popitem(last=False)
+                    print(f"release whisper model {evicted_key}")
+            return model
+
+
+_model_pool = None
+_model_pool_lock = threading.Lock()
+
+
+def get_whisper_model_pool():
+    global _model_pool
+    with _model_pool_lock:
+        if _model_pool is None:
+            max_models = my_config['audio'].get('local_recognition', {}).get('fasterwhisper', {}).get(
+                'max_loaded_models', 1)
+            _model_pool = WhisperModelPool(int(max_models))
+        return _model_pool
+
+
 class FasterWhisperRecognitionResult:
     def __init__(self, text, begin_time, end_time):
         self.text = text
@@ -66,19 +120,41 @@ class FasterWhisperRecognitionService:
         self.compute_type = my_config['audio'].get('local_recognition', {}).get('fasterwhisper', {}).get('compute_type')
         must_have_value(self.device_type, "请设置语音识别device_type")
         must_have_value(self.compute_type, "请设置语音识别compute_type")
+        # 同一个模型同时处理的识别任务数
+        self.num_workers = int(my_config['audio'].get('local_recognition', {}).get('fasterwhisper', {}).get(
+            'num_workers', 1))
+
+    def get_model(self):
+        # 模型常驻内存，不需要每次识别都重新加载
+        return get_whisper_model_pool().get(self.model_name, self.device_type, self.compute_type, self.num_workers)
 
     def process(self, audioFile, language) -> List[FasterWhisperRecognitionResult]:
+        return self.transcribe(self.get_model(), audioFile)
+
+    def process_batch(self, audio_files, language) -> List[List[FasterWhisperRecognitionResult]]:
+        """
+        用同一个模型识别多个音频，num_workers大于1时并发识别
+        :return: 每个音频的识别结果，顺序和audio_files一致
+        """
+        model = self.get_model()
+        return run_in_pool(lambda audio_file: self.transcribe(model, audio_file), audio_files, self.num_workers)
+
+    def process_parts(self, audio_files, language) -> List[FasterWhisperRecognitionResult]:
+        """
+        识别按顺序拼接成一段配音的多个音频，结果按每段在拼接后的位置平移时间
+        """
+        result_lists = self.process_batch(audio_files, language)
+        results = []
+        position = 0.0
+        for audio_file, result_list in zip(audio_files, result_lists):
+            results.extend(FasterWhisperRecognitionResult(result.text, result.begin_time + position,
+                                                          result.end_time + position) for result in result_list)
+            position += load_audio(audio_file).duration
+        return results
+
+    def transcribe(self, model, audioFile):
         result_list = []
 
-        # Run on GPU with FP16
-        model = WhisperModel(convert_module_to_path(self.model_name), device=self.device_type, compute_type=self.compute_type,
-                             local_files_only=True)
-
-        # or run on GPU with INT8
-        # model = WhisperModel(model_size, device="cuda", compute_type="int8_float16")
-        # or run on CPU with INT8
-        # model = WhisperModel(model_size, device="cpu", compute_type="int8")
-
         segments, info = model.transcribe(audioFile, beam_size=5)
 
         print("Detected language '%s' with probability %f" % (info.language, info.language_probability))
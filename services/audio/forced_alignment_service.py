@@ -0,0 +1,286 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import difflib
+import threading
+
+import numpy as np
+
+from config.config import my_config
+from services.audio.tts_timing import TtsTimingResult, build_phrase_timings, is_tts_timing_enabled, \
+    save_tts_timings
+from tools.audio_engine import load_audio
+
+# 能量对齐使用的采样率和帧长(秒)
+ALIGN_SAMPLE_RATE = 16000
+ENERGY_FRAME_SECONDS = 0.02
+# 标点和停顿相差不超过这个秒数时，把标点对到停顿上
+MAX_PAUSE_SNAP = 1.0
+# 对齐只在cpu上运行，不占用识别服务配置的显卡
+ALIGN_DEVICE = "cpu"
+ALIGN_COMPUTE_TYPE = "int8"
+# whisper的initial_prompt有长度限制，只用文案开头的部分
+MAX_PROMPT_LENGTH = 200
+
+_align_model_pool = None
+_align_model_pool_lock = threading.Lock()
+
+
+def get_align_model_pool():
+    """
+    对齐使用的cpu模型单独常驻，不放在识别的模型池里
+    否则识别配置了显卡时，对齐和识别会互相把对方的模型淘汰掉，每次生成字幕都要重新加载
+    """
+    # 没有安装faster-whisper时导入失败，字幕改用语音识别
+    from services.audio.faster_whisper_recognition_service import WhisperModelPool
+
+    global _align_model_pool
+    with _align_model_pool_lock:
+        if _align_model_pool is None:
+            _align_model_pool = WhisperModelPool(1)
+        return _align_model_pool
+
+
+def get_alignment_config():
+    return (my_config.get('captioning') or {}).get('alignment') or {}
+
+
+def is_alignment_enabled():
+    # 字幕不使用配音时间时，不需要对齐
+    return is_tts_timing_enabled() and get_alignment_config().get('enable', True)
+
+
+def alignable_chars(text):
+    """
+    文案中参与对齐的字符，忽略标点和空白
+    :return: [(在文案中的位置, 小写字符)]
+    """
+    return [(idx, char.lower()) for idx, char in enumerate(text) if char.isalnum()]
+
+
+def fill_char_timings(count, anchors, total_duration):
+    """
+    按已经确定时间的字符，给其余字符插值时间
+    :param anchors: {字符序号: (开始, 结束)}
+    :return: [(开始, 结束)]，长度为count
+    """
+    anchor_indexes = sorted(anchors)
+    char_duration = sum(anchors[idx][1] - anchors[idx][0] for idx in anchor_indexes) / len(anchor_indexes)
+    timings = [None] * count
+    for idx in anchor_indexes:
+        timings[idx] = anchors[idx]
+    idx = 0
+    while idx < count:
+        if timings[idx] is not None:
+            idx += 1
+            continue
+        run_end = idx
+        while run_end < count and timings[run_end] is None:
+            run_end += 1
+        # 前后都有时间的用两边之间的空隙，开头和结尾按平均字长往外推
+        if idx > 0:
+            run_start_time = timings[idx - 1][1]
+        else:
+            run_start_time = max(timings[run_end][0] - char_duration * run_end, 0.0)
+        if run_end < count:
+            run_end_time = max(timings[run_end][0], run_start_time)
+        else:
+            run_end_time = max(min(run_start_time + char_duration * (run_end - idx), total_duration), run_start_time)
+        step = (run_end_time - run_start_time) / (run_end - idx)
+        for offset in range(run_end - idx):
+            timings[idx + offset] = (run_start_time + step * offset, run_start_time + step * (offset + 1))
+        idx = run_end
+    return timings
+
+
+def whisper_char_timings(audio_file, text, total_duration):
+    """
+    faster-whisper识别出带时间的词，再和文案逐字比对，漏识别的字按前后的字插值
+    :return: 每个参与对齐字符的 (开始, 结束)，和文案差别太大时返回None
+    """
+    model_name = my_config['audio'].get('local_recognition', {}).get('fasterwhisper', {}).get('model_name')
+    if not model_name:
+        return None
+    script_chars = [char for _, char in alignable_chars(text)]
+    model = get_align_model_pool().get(model_name, ALIGN_DEVICE, ALIGN_COMPUTE_TYPE)
+    # 用文案做提示，识别结果更接近文案
+    segments, _ = model.transcribe(audio_file, beam_size=5, word_timestamps=True,
+                                   initial_prompt=text[:MAX_PROMPT_LENGTH])
+    recognized_chars = []
+    recognized_timings = []
+    for segment in segments:
+        for word in segment.words or []:
+            word_chars = [char for _, char in alignable_chars(word.word)]
+            if not word_chars:
+                continue
+            # 一个词的时间平均分给其中的字
+            step = (word.end - word.start) / len(word_chars)
+            for offset, char in enumerate(word_chars):
+                recognized_chars.append(char)
+                recognized_timings.append((word.start + step * offset, word.start + step * (offset + 1)))
+    if not recognized_chars:
+        return None
+    matcher = difflib.SequenceMatcher(None, script_chars, recognized_chars, autojunk=False)
+    anchors = {}
+    matched = 0
+    for tag, script_begin, script_end, recognized_begin, recognized_end in matcher.get_opcodes():
+        if tag == 'equal':
+            matched += script_end - script_begin
+        elif tag != 'replace':
+            # 多识别或者漏识别的字，漏掉的字后面按前后的字插值
+            continue
+        if script_end - script_begin == recognized_end - recognized_begin:
+            # 字数相同(包括识别错的同音字)逐字使用识别出来的时间
+            for offset in range(script_end - script_begin):
+                anchors[script_begin + offset] = recognized_timings[recognized_begin + offset]
+            continue
+        # 字数不同时把识别出来的那段时间平均分给文案里对应的字
+        start = recognized_timings[recognized_begin][0]
+        step = (recognized_timings[recognized_end - 1][1] - start) / (script_end - script_begin)
+        for offset in range(script_end - script_begin):
+            anchors[script_begin + offset] = (start + step * offset, start + step * (offset + 1))
+    min_match_ratio = float(get_alignment_config().get('min_match_ratio', 0.5))
+    if not anchors or matched < len(script_chars) * min_match_ratio:
+        print(f"识别结果和文案差别太大，匹配 {matched}/{len(script_chars)}")
+        return None
+    return fill_char_timings(len(script_chars), anchors, total_duration)
+
+
+def voiced_frames(samples, frame_size, min_pause_frames):
+    # 按帧能量判断是否有声音，短于min_pause_frames的停顿算作说话中
+    frame_count = len(samples) // frame_size
+    frames = samples[:frame_count * frame_size].reshape(frame_count, frame_size)
+    energy = np.sqrt((frames ** 2).mean(axis=1))
+    if frame_count == 0 or energy.max() <= 0:
+        return np.zeros(frame_count, dtype=bool)
+    voiced = energy > max(energy.max() * 0.05, 1e-4)
+    voiced_idx = np.nonzero(voiced)[0]
+    if len(voiced_idx) == 0:
+        return voiced
+    gaps = np.diff(voiced_idx)
+    for gap_start, gap in zip(voiced_idx[:-1], gaps):
+        if 1 < gap <= min_pause_frames:
+            voiced[gap_start + 1:gap_start + gap] = True
+    return voiced
+
+
+def spread_chars(voiced_idx, count):
+    # 把说话的帧平均分给count个字
+    frames_per_char = len(voiced_idx) / count
+    timings = []
+    for idx in range(count):
+        first = voiced_idx[min(int(idx * frames_per_char), len(voiced_idx) - 1)]
+        last = voiced_idx[max(min(int((idx + 1) * frames_per_char), len(voiced_idx)) - 1, 0)]
+        timings.append((first * ENERGY_FRAME_SECONDS, (last + 1) * ENERGY_FRAME_SECONDS))
+    return timings
+
+
+def phrase_boundaries(text, chars):
+    # 前面有标点的字的序号，这些位置一般对应音频里的停顿
+    return [idx for idx in range(1, len(chars))
+            if any(not char.isalnum() and not char.isspace() for char in text[chars[idx - 1][0] + 1:chars[idx][0]])]
+
+
+def energy_char_timings(audio_file, text):
+    """
+    没有识别模型时的对齐：去掉停顿后按说话的时长平均分给每个字，再把标点的位置对到最近的停顿上
+    :return: 每个参与对齐字符的 (开始, 结束)，没有声音时返回None
+    """
+    chars = alignable_chars(text)
+    track = load_audio(audio_file, ALIGN_SAMPLE_RATE, 1)
+    frame_size = int(ALIGN_SAMPLE_RATE * ENERGY_FRAME_SECONDS)
+    min_pause = float(get_alignment_config().get('min_pause', 0.15))
+    voiced = voiced_frames(track.samples[:, 0], frame_size, int(min_pause / ENERGY_FRAME_SECONDS))
+    voiced_idx = np.nonzero(voiced)[0]
+    if not chars or len(voiced_idx) == 0:
+        return None
+    timings = spread_chars(voiced_idx, len(chars))
+    # 停顿 (开始帧, 结束帧)
+    pauses = [(int(voiced_idx[k]) + 1, int(voiced_idx[k + 1])) for k in np.nonzero(np.diff(voiced_idx) > 1)[0]]
+    cuts = []
+    next_pause = 0
+    for boundary in phrase_boundaries(text, chars):
+        estimate = timings[boundary][0] / ENERGY_FRAME_SECONDS
+        candidates = range(next_pause, len(pauses))
+        if not candidates:
+            break
+        nearest = min(candidates, key=lambda k: abs((pauses[k][0] + pauses[k][1]) / 2 - estimate))
+        if abs((pauses[nearest][0] + pauses[nearest][1]) / 2 - estimate) * ENERGY_FRAME_SECONDS <= MAX_PAUSE_SNAP:
+            cuts.append((boundary, pauses[nearest][1]))
+            next_pause = nearest + 1
+    if not cuts:
+        return timings
+    # 按对上的停顿分组，每组的字只分配组内说话的帧
+    result = []
+    group_start_char, group_start_frame = 0, 0
+    for cut_char, cut_frame in cuts + [(len(chars), voiced_idx[-1] + 1)]:
+        group_idx = voiced_idx[(voiced_idx >= group_start_frame) & (voiced_idx < cut_frame)]
+        if len(group_idx) == 0:
+            return timings
+        result.extend(spread_chars(group_idx, cut_char - group_start_char))
+        group_start_char, group_start_frame = cut_char, cut_frame
+    return result
+
+
+def align_text(audio_file, text):
+    """
+    把已知的文案和音频对齐
+    method为whisper时使用faster-whisper的词时间，失败时返回None，由字幕改用配置的语音识别服务
+    method为energy时只按音量对齐，不需要模型，但是准确度较低
+    :return: 按标点切分的短句时间 [{"text", "start", "end"}]，对齐失败返回None
+    """
+    chars = alignable_chars(text)
+    if not chars:
+        return None
+    if get_alignment_config().get('method', 'whisper') == 'energy':
+        char_timings = energy_char_timings(audio_file, text)
+    else:
+        try:
+            char_timings = whisper_char_timings(audio_file, text, load_audio(audio_file).duration)
+        except Exception as e:
+            print(f"whisper对齐失败: {e}")
+            return None
+    if char_timings is None:
+        return None
+    spans = [(idx, idx + 1, start, end) for (idx, _), (start, end) in zip(chars, char_timings)]
+    return build_phrase_timings(text, spans)
+
+
+def get_aligned_timing_results(audio_file, text):
+    """
+    生成字幕时，TTS服务没有返回时间的话，把已知的文案和配音对齐
+    对齐结果保存在音频旁边，重新生成字幕时直接使用
+    :return: 字幕使用的TtsTimingResult列表，不能对齐时返回None
+    """
+    if not text or not is_alignment_enabled():
+        return None
+    try:
+        timings = align_text(audio_file, text)
+    except Exception as e:
+        print(f"文案对齐失败: {e}")
+        return None
+    if not timings:
+        return None
+    print(f"aligned {len(timings)} phrases for {audio_file}")
+    save_tts_timings(audio_file, timings)
+    return [TtsTimingResult(timing["text"], timing["start"], timing["end"]) for timing in timings]
@@ -0,0 +1,77 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.config import my_config
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_local_tts_timeout():
+    # (连接超时, 读取超时)，本地模型合成长文本比较慢，读取超时要长一些
+    local_tts_config = my_config['audio'].get('local_tts') or {}
+    return local_tts_config.get('connect_timeout', 10), local_tts_config.get('read_timeout', 600)
+
+
+def get_http_session():
+    """
+    所有本地TTS服务共用一个keep-alive的session，每次请求不需要重新建立连接
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # 连接池大小要能容纳并发合成的请求数
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def post_to_file(url, body, output_file, chunk_size=64 * 1024):
+    """
+    发送请求，响应内容边下载边写入output_file，不需要把整个音频放在内存里
+    先写临时文件，失败时不会留下不完整的输出文件
+    """
+    temp_file = output_file + ".part"
+    with get_http_session().post(url, json=body, stream=True, timeout=get_local_tts_timeout()) as response:
+        response.raise_for_status()
+        with open(temp_file, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    os.replace(temp_file, output_file)
+    return output_file
+
+
+def post_for_content(url, body):
+    # 需要完整内容才能解析的响应，比如zip压缩包
+    response = get_http_session().post(url, json=body, timeout=get_local_tts_timeout())
+    response.raise_for_status()
+    return response.content
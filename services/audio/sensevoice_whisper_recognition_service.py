@@ -1,10 +1,20 @@
+import os
 import subprocess
+import threading
 import numpy as np
 from typing import List
 import sherpa_onnx
 
+from config.config import my_config
 from tools.utils import must_have_value
 
+SAMPLE_RATE = 16000
+# 每次从ffmpeg读取10秒的PCM
+FRAMES_PER_READ = SAMPLE_RATE * 10
+
+_recognizer_cache = {}
+_recognizer_lock = threading.Lock()
+
 class SenseVoiceRecognitionResult:
     def __init__(self, text, begin_time, end_time):
         self.text = text
@@ -18,50 +28,118 @@ class SenseVoiceRecognitionResult:
 class SenseVoiceRecognitionService:
     def __init__(self):
         super().__init__()
-        self.model_path = "sensevoice/sherpa-onnx-sense-voice-zh-en-ja-ko-yue-2024-07-17/model.onnx"
+        sensevoice_config = my_config['audio'].get('local_recognition', {}).get('sensevoice') or {}
+        self.model_path = sensevoice_config.get(
+            'model_path', "sensevoice/sherpa-onnx-sense-voice-zh-en-ja-ko-yue-2024-07-17/model.onnx")
         must_have_value(self.model_path, "请设置 SenseVoice 模型路径")
-        self.tokens_path = "sensevoice/sherpa-onnx-sense-voice-zh-en-ja-ko-yue-2024-07-17/tokens.txt"
+        self.tokens_path = sensevoice_config.get(
+            'tokens_path', "sensevoice/sherpa-onnx-sense-voice-zh-en-ja-ko-yue-2024-07-17/tokens.txt")
         must_have_value(self.tokens_path, "请设置 SenseVoice tokens 路径")
+        self.num_threads = int(sensevoice_config.get('num_threads', 2))
+        # silero VAD模型，不存在时整段音频作为一个结果识别
+        self.vad_model_path = sensevoice_config.get('vad_model_path', "sensevoice/silero_vad.onnx")
+        self.max_speech_duration = float(sensevoice_config.get('max_speech_duration', 5))
 
-    def process(self, audioFile, language) -> List[SenseVoiceRecognitionResult]:
-        result_list = []
+    def get_recognizer(self):
+        # 识别器加载模型很慢，进程内按模型和线程数缓存
+        key = (self.model_path, self.tokens_path, self.num_threads)
+        with _recognizer_lock:
+            if key not in _recognizer_cache:
+                _recognizer_cache[key] = sherpa_onnx.OfflineRecognizer.from_sense_voice(
+                    model=self.model_path,
+                    tokens=self.tokens_path,
+                    num_threads=self.num_threads,
+                    use_itn=True,
+                    debug=False,
+                )
+            return _recognizer_cache[key]
+
+    def create_vad(self):
+        config = sherpa_onnx.VadModelConfig()
+        config.silero_vad.model = self.vad_model_path
+        config.silero_vad.threshold = 0.5
+        config.silero_vad.min_silence_duration = 0.25  # seconds
+        config.silero_vad.min_speech_duration = 0.25  # seconds
+        # 超过这个时长的语音段会提高阈值尽快切分，字幕不会太长
+        config.silero_vad.max_speech_duration = self.max_speech_duration
+        config.sample_rate = SAMPLE_RATE
+        vad = sherpa_onnx.VoiceActivityDetector(config, buffer_size_in_seconds=100)
+        return vad, config.silero_vad.window_size
 
-        # 创建 SenseVoice 识别器
-        recognizer = sherpa_onnx.OfflineRecognizer.from_sense_voice(
-            model=self.model_path,
-            tokens=self.tokens_path,
-            num_threads=2,  # 可以根据需要调整线程数
-            use_itn=True,
-            debug=False,
-        )
+    def process(self, audioFile, language) -> List[SenseVoiceRecognitionResult]:
+        recognizer = self.get_recognizer()
 
-        # 使用 ffmpeg 将音频文件转换为 16kHz 16bit 单声道 PCM 格式
+        # 使用 ffmpeg 将音频文件转换为 16kHz 16bit 单声道 PCM 格式，边解码边识别
         ffmpeg_cmd = [
             "ffmpeg",
             "-i", audioFile,
             "-f", "s16le",
             "-acodec", "pcm_s16le",
             "-ac", "1",
-            "-ar", "16000",
+            "-ar", str(SAMPLE_RATE),
             "-",
         ]
-
         process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        data = process.stdout.read()
+        try:
+            if os.path.exists(self.vad_model_path):
+                return self.process_with_vad(recognizer, process.stdout)
+            print(f"SenseVoice VAD模型不存在: {self.vad_model_path}，整段音频一起识别")
+            return self.process_whole(recognizer, process.stdout)
+        finally:
+            process.stdout.close()
+            process.wait()
+
+    def process_with_vad(self, recognizer, pcm_pipe):
+        """
+        VAD切分出语音段，每读一块PCM就把已经结束的语音段一起批量识别，每段都有自己的起止时间
+        """
+        result_list = []
+        vad, window_size = self.create_vad()
+        buffer = np.zeros(0, dtype=np.float32)
+        is_eof = False
+        while not is_eof:
+            # int16是两个字节
+            data = pcm_pipe.read(FRAMES_PER_READ * 2)
+            if not data:
+                vad.flush()
+                is_eof = True
+            else:
+                samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
+                buffer = np.concatenate([buffer, samples])
+                while len(buffer) > window_size:
+                    vad.accept_waveform(buffer[:window_size])
+                    buffer = buffer[window_size:]
 
-        # 将音频数据转换为 float32 格式
-        samples = np.frombuffer(data, dtype=np.int16)
-        samples = samples.astype(np.float32) / 32768
+            streams = []
+            segments = []
+            while not vad.empty():
+                begin_time = vad.front.start / SAMPLE_RATE
+                segments.append((begin_time, begin_time + len(vad.front.samples) / SAMPLE_RATE))
+                stream = recognizer.create_stream()
+                stream.accept_waveform(SAMPLE_RATE, vad.front.samples)
+                streams.append(stream)
+                vad.pop()
+            if streams:
+                recognizer.decode_streams(streams)
+            for (begin_time, end_time), stream in zip(segments, streams):
+                text = stream.result.text.strip()
+                if text:
+                    result_list.append(SenseVoiceRecognitionResult(text, begin_time, end_time))
+        return result_list
+
+    def process_whole(self, recognizer, pcm_pipe):
+        chunks = []
+        while True:
+            data = pcm_pipe.read(FRAMES_PER_READ * 2)
+            if not data:
+                break
+            chunks.append(np.frombuffer(data, dtype=np.int16))
+        samples = np.concatenate(chunks).astype(np.float32) / 32768 if chunks else np.zeros(0, dtype=np.float32)
 
         # 创建识别流并处理音频数据
         stream = recognizer.create_stream()
-        stream.accept_waveform(16000, samples)
+        stream.accept_waveform(SAMPLE_RATE, samples)
         recognizer.decode_stream(stream)
 
-        # 获取识别结果
-        result = stream.result.text
-
-        # 假设整个音频的起止时间为 0 到音频长度
-        result_list.append(SenseVoiceRecognitionResult(result, 0, len(samples) / 16000))
-
-        return result_list
\ No newline at end of file
+        # 整个音频的起止时间为 0 到音频长度
+        return [SenseVoiceRecognitionResult(stream.result.text, 0, len(samples) / SAMPLE_RATE)]
@@ -36,6 +36,7 @@ from tencentcloud.tts.v20190823 import tts_client, models
 
 from config.config import my_config
 from services.audio.audio_service import AudioService
+from services.audio.tts_cache import cached_tts
 from tools.file_utils import download_file_from_url
 from tools.utils import must_have_value, random_with_system_time
 
@@ -60,6 +61,7 @@ class TencentAudioService(AudioService):
         must_have_value(self.TENCENT_ACCESS_AKKEY, "请设置Tencent access key secret")
         self.endpoint = "tts.tencentcloudapi.com"
 
+    @cached_tts("Tencent")
     def save_with_ssml(self, text, file_name, voice, rate="0.00"):
         cred = credential.Credential(self.TENCENT_ACCESS_AKID, self.TENCENT_ACCESS_AKKEY)
         # 实例化一个http选项，可选的，没有特殊需求可以跳过
@@ -0,0 +1,209 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import functools
+import inspect
+import os
+import re
+import threading
+
+from config.config import my_config
+from services.audio.tts_timing import get_timing_file, remove_tts_timings
+from services.video.parallel_service import run_in_pool
+from tools.cache_utils import FileLruCache, file_content_hash, hash_key
+
+# 获取当前脚本的绝对路径
+script_path = os.path.abspath(__file__)
+
+# 脚本所在的目录
+script_dir = os.path.dirname(script_path)
+
+# 音频输出目录
+audio_output_dir = os.path.join(script_dir, "../../work")
+audio_output_dir = os.path.abspath(audio_output_dir)
+
+_tts_cache = None
+_tts_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """
+    获取配音结果的缓存，没有开启时返回None
+    """
+    global _tts_cache
+    cache_config = (my_config.get('audio') or {}).get('tts_cache') or {}
+    if not cache_config.get('enable', True):
+        return None
+    with _tts_cache_lock:
+        if _tts_cache is None:
+            _tts_cache = FileLruCache("tts", cache_config.get('max_size_mb', 2048))
+        return _tts_cache
+
+
+def normalize_tts_text(text):
+    # 首尾空白和连续的空白不影响合成结果
+    return re.sub(r"\s+", " ", str(text or "")).strip()
+
+
+def file_identity(file_path):
+    # 参考音频等文件按内容区分，文件名是随机生成的
+    if file_path and os.path.isfile(file_path):
+        return file_content_hash(file_path)
+    return file_path
+
+
+def build_tts_cache_key(service, provider, normalized_text, output_file, call_params=()):
+    service_params = service.tts_cache_params() if hasattr(service, 'tts_cache_params') else ()
+    return hash_key(provider, normalized_text, os.path.splitext(output_file)[1], *call_params, *service_params)
+
+
+def get_timing_key(key):
+    # 配音时间和音频使用相关的key分别缓存
+    return key + "_timings"
+
+
+def fetch_or_clear(cache, key, output_file):
+    # 命中时把缓存放到输出文件；没有命中时删除输出文件，它可能是上次从缓存链接过来的，防止写坏缓存
+    remove_tts_timings(output_file)
+    if cache.fetch(key, output_file):
+        cache.fetch(get_timing_key(key), get_timing_file(output_file))
+        return True
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    return False
+
+
+def put_if_exists(cache, key, output_file):
+    if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+        cache.put(key, output_file)
+        timing_file = get_timing_file(output_file)
+        if os.path.exists(timing_file):
+            cache.put(get_timing_key(key), timing_file, ".json")
+
+
+def cached_tts(provider):
+    """
+    配音方法的缓存装饰器，被装饰的方法签名是 (self, text, output_file, ...)
+    缓存key由服务名、文案、输出格式、其余参数(voice, rate等)以及服务的tts_cache_params()组成
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(self, text, output_file, *args, **kwargs):
+            cache = get_tts_cache()
+            normalized_text = normalize_tts_text(text)
+            if cache is None or not normalized_text:
+                return func(self, text, output_file, *args, **kwargs)
+            bound = signature.bind(self, text, output_file, *args, **kwargs)
+            bound.apply_defaults()
+            call_params = [f"{name}={value}" for name, value in list(bound.arguments.items())[3:]]
+            key = build_tts_cache_key(self, provider, normalized_text, output_file, call_params)
+            if fetch_or_clear(cache, key, output_file):
+                print(f"tts cache hit: {provider} {normalized_text[:20]} -> {output_file}")
+                return output_file
+            result = func(self, text, output_file, *args, **kwargs)
+            put_if_exists(cache, key, output_file)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def cached_tts_batch(provider):
+    """
+    批量配音方法的缓存装饰器，被装饰的方法签名是 (self, texts, output_files)
+    和单条合成使用相同的缓存key，只把没有命中的文案交给被装饰的方法
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, texts, output_files):
+            cache = get_tts_cache()
+            if cache is None:
+                return func(self, texts, output_files)
+            missing = []
+            for text, output_file in zip(texts, output_files):
+                normalized_text = normalize_tts_text(text)
+                key = build_tts_cache_key(self, provider, normalized_text, output_file)
+                if normalized_text and fetch_or_clear(cache, key, output_file):
+                    print(f"tts cache hit: {provider} {normalized_text[:20]} -> {output_file}")
+                    continue
+                missing.append((text, output_file, key if normalized_text else None))
+            if missing:
+                try:
+                    func(self, [item[0] for item in missing], [item[1] for item in missing])
+                finally:
+                    # 后面的批次失败时，已经合成好的文件也放进缓存，重试时不用再合成
+                    # 没有命中的输出文件在fetch_or_clear里已经删除，这里存在的都是这次合成的
+                    for _, output_file, key in missing:
+                        if key is not None:
+                            put_if_exists(cache, key, output_file)
+            return output_files
+
+        return wrapper
+
+    return decorator
+
+
+def read_tts_corpus(corpus_file):
+    """
+    读取文案库，一行一条文案，和混剪场景的文案文件格式一致
+    """
+    with open(corpus_file, 'r', encoding='utf-8') as f:
+        texts = [normalize_tts_text(line) for line in f]
+    # 去掉空行和重复的文案，保持原来的顺序
+    return list(dict.fromkeys(text for text in texts if text))
+
+
+def warm_tts_cache(synthesize, texts, concurrency=1):
+    """
+    提前把文案库里的文案合成好放进缓存，已经缓存的文案直接命中，不会重复合成
+    :param synthesize: 带缓存的合成函数 synthesize(text, audio_output_file)
+    :param texts: 文案列表
+    :param concurrency: 同时合成的数量
+    :return: 成功的数量
+    """
+    os.makedirs(audio_output_dir, exist_ok=True)
+
+    def warm_one(job):
+        idx, text = job
+        temp_file = os.path.join(audio_output_dir, f"tts_warm_{os.getpid()}_{idx}.wav")
+        try:
+            synthesize(text, temp_file)
+            return os.path.exists(temp_file) and os.path.getsize(temp_file) > 0
+        except Exception as e:
+            print(f"预热配音缓存失败: {text[:20]} {e}")
+            return False
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            remove_tts_timings(temp_file)
+
+    results = run_in_pool(warm_one, list(enumerate(texts)), min(concurrency, max(len(texts), 1)))
+    cache = get_tts_cache()
+    if cache is not None:
+        print("tts cache stats:", cache.stats())
+    return sum(1 for result in results if result)
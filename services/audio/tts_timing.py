@@ -0,0 +1,223 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import json
+import os
+import re
+
+from config.config import my_config
+from tools.audio_engine import load_audio
+
+# 按标点把文案切成字幕短句，标点留在前一句里
+PHRASE_PATTERN = re.compile(r'(?<=[，,。！？!?；;：:、\n])|(?<=\.)(?=\s)')
+
+
+class TtsTimingResult:
+    """
+    配音时TTS服务返回的一句话的时间，单位秒
+    """
+
+    def __init__(self, text, begin_time, end_time):
+        self.text = text
+        self.begin_time = begin_time
+        self.end_time = end_time
+
+    def __str__(self):
+        return f"{self.begin_time}-{self.end_time}: {self.text}"
+
+
+def is_tts_timing_enabled():
+    # captioning.source为tts_timing时优先使用配音时的时间生成字幕，recognition表示总是语音识别
+    captioning_config = my_config.get('captioning') or {}
+    return captioning_config.get('source', 'tts_timing') == 'tts_timing'
+
+
+def get_timing_file(audio_file):
+    # 时间信息保存在音频旁边的json文件里，跟着音频一起复制、缓存和拼接
+    return audio_file + ".timings.json"
+
+
+def save_tts_timings(audio_file, timings):
+    """
+    :param timings: [{"text", "start", "end"}]，单位秒
+    """
+    timing_file = get_timing_file(audio_file)
+    if not timings:
+        remove_tts_timings(audio_file)
+        return None
+    temp_file = timing_file + ".tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(timings, f, ensure_ascii=False)
+    os.replace(temp_file, timing_file)
+    return timing_file
+
+
+def load_tts_timings(audio_file):
+    """
+    读取音频的时间信息，没有时返回None
+    """
+    timing_file = get_timing_file(audio_file)
+    if not os.path.exists(timing_file) or not os.path.exists(audio_file):
+        return None
+    try:
+        with open(timing_file, 'r', encoding='utf-8') as f:
+            timings = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"读取配音时间失败: {timing_file} {e}")
+        return None
+    return timings or None
+
+
+def remove_tts_timings(audio_file):
+    timing_file = get_timing_file(audio_file)
+    if os.path.exists(timing_file):
+        os.remove(timing_file)
+
+
+def get_sentence_timing_file(audio_file):
+    # 分句合成时每一句的时间，TTS服务没有返回短句时间时，生成字幕可以按句子的时间
+    return audio_file + ".sentences.json"
+
+
+def save_sentence_timings(audio_file, timings):
+    """
+    :param timings: [{"text", "start", "end"}]，单位秒，每一项是分句合成的一段
+    """
+    timing_file = get_sentence_timing_file(audio_file)
+    if not timings:
+        remove_sentence_timings(audio_file)
+        return None
+    temp_file = timing_file + ".tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(timings, f, ensure_ascii=False)
+    os.replace(temp_file, timing_file)
+    return timing_file
+
+
+def load_sentence_timings(audio_file):
+    """
+    读取分句合成时每一句的时间，没有时返回None
+    """
+    timing_file = get_sentence_timing_file(audio_file)
+    if not os.path.exists(timing_file) or not os.path.exists(audio_file):
+        return None
+    try:
+        with open(timing_file, 'r', encoding='utf-8') as f:
+            timings = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"读取分句时间失败: {timing_file} {e}")
+        return None
+    return timings or None
+
+
+def remove_sentence_timings(audio_file):
+    timing_file = get_sentence_timing_file(audio_file)
+    if os.path.exists(timing_file):
+        os.remove(timing_file)
+
+
+def shift_timings(timings, offset, bounds=None):
+    # 整体平移时间，bounds不为空时截断到(开始, 结束)的范围内
+    shifted = []
+    for timing in timings:
+        start = timing["start"] + offset
+        end = timing["end"] + offset
+        if bounds is not None:
+            start = min(max(start, bounds[0]), bounds[1])
+            end = min(max(end, start), bounds[1])
+        shifted.append({"text": timing["text"], "start": round(start, 3), "end": round(end, 3)})
+    return shifted
+
+
+def build_phrase_timings(text, spans):
+    """
+    把TTS返回的字/词级时间合并成按标点切分的短句
+    :param spans: [(char_begin, char_end, start, end)]，char_end不包含，时间单位秒
+    :return: [{"text", "start", "end"}]
+    """
+    if not spans:
+        return []
+    timings = []
+    pending = ""
+    position = 0
+    for phrase in PHRASE_PATTERN.split(text):
+        phrase_begin = position
+        position += len(phrase)
+        phrase_text = phrase.strip()
+        if not phrase_text:
+            continue
+        covered = [span for span in spans if span[0] < position and span[1] > phrase_begin]
+        if not covered:
+            # 没有时间的短句(比如只有标点)并到前一句，开头的并到下一句
+            if timings:
+                timings[-1]["text"] += phrase_text
+            else:
+                pending += phrase_text
+            continue
+        timings.append({"text": pending + phrase_text,
+                        "start": round(min(span[2] for span in covered), 3),
+                        "end": round(max(span[3] for span in covered), 3)})
+        pending = ""
+    return timings
+
+
+def concat_tts_timings(audio_files, output_file):
+    """
+    按拼接顺序合并每个音频的时间，只有所有音频都有时间信息时才生成
+    """
+    all_timings = [load_tts_timings(audio_file) for audio_file in audio_files]
+    if not all_timings or any(timings is None for timings in all_timings):
+        remove_tts_timings(output_file)
+        return None
+    result = []
+    position = 0.0
+    for audio_file, timings in zip(audio_files, all_timings):
+        result.extend(shift_timings(timings, position))
+        position += load_audio(audio_file).duration
+    save_tts_timings(output_file, result)
+    return result
+
+
+def get_tts_timing_results(audio_file):
+    """
+    :return: 字幕使用的TtsTimingResult列表，没有时间信息时返回None
+    """
+    if not is_tts_timing_enabled():
+        return None
+    timings = load_tts_timings(audio_file)
+    if timings is None:
+        return None
+    return [TtsTimingResult(timing["text"], timing["start"], timing["end"]) for timing in timings]
+
+
+def get_sentence_timing_results(audio_file):
+    """
+    分句合成时保存的每一句的时间，句子太长时生成字幕会按字数比例拆分成多行
+    :return: 字幕使用的TtsTimingResult列表，没有时返回None
+    """
+    if not is_tts_timing_enabled():
+        return None
+    timings = load_sentence_timings(audio_file)
+    if timings is None:
+        return None
+    return [TtsTimingResult(timing["text"], timing["start"], timing["end"]) for timing in timings]
@@ -12,6 +12,7 @@ import azure.cognitiveservices.speech as speechsdk
 from services.audio.faster_whisper_recognition_service import FasterWhisperRecognitionResult
 from services.audio.sensevoice_whisper_recognition_service import SenseVoiceRecognitionResult
 from services.audio.tencent_recognition_service import TencentRecognitionResult
+from services.audio.tts_timing import TtsTimingResult
 from services.captioning import helper
 
 
@@ -154,6 +155,10 @@ class CaptionHelper(object):
             begin = helper.time_from_seconds(result.begin_time)
             end = helper.time_from_seconds(result.end_time)
             return begin, end
+        if isinstance(result, TtsTimingResult):
+            begin = helper.time_from_seconds(result.begin_time)
+            end = helper.time_from_seconds(result.end_time)
+            return begin, end
 
     def get_partial_result_caption_timing(self, result: object, text: str, caption_text: str,
                                           caption_starts_at: int, caption_length: int) -> Tuple[time, time]:
@@ -168,7 +173,7 @@ class CaptionHelper(object):
     def is_final_result(self, result: object) -> bool:
         if isinstance(result, speechsdk.RecognitionResult):
             return speechsdk.ResultReason.RecognizedSpeech == result.reason or speechsdk.ResultReason.RecognizedIntent == result.reason or speechsdk.ResultReason.TranslatedSpeech == result.reason
-        if isinstance(result, AliRecognitionResult) or isinstance(result, TencentRecognitionResult) or isinstance(result, FasterWhisperRecognitionResult) or isinstance(result, SenseVoiceRecognitionResult):
+        if isinstance(result, AliRecognitionResult) or isinstance(result, TencentRecognitionResult) or isinstance(result, FasterWhisperRecognitionResult) or isinstance(result, SenseVoiceRecognitionResult) or isinstance(result, TtsTimingResult):
             return True
 
     def lines_from_text(self, text: str) -> List[str]:
@@ -29,9 +29,13 @@ from typing import Optional
 from config.config import my_config
 from services.alinls.speech_process import AliRecognitionService
 from services.audio.faster_whisper_recognition_service import FasterWhisperRecognitionService
+from services.audio.forced_alignment_service import get_aligned_timing_results
 from services.audio.sensevoice_whisper_recognition_service import SenseVoiceRecognitionService
 from services.audio.tencent_recognition_service import TencentRecognitionService
+from services.audio.tts_timing import get_tts_timing_results, get_sentence_timing_results
 from services.captioning.common_captioning_service import Captioning
+from services.video.chunked_render_service import is_chunked_render, render_chunked
+from services.video.encode_profile import get_encode_profile
 import subprocess
 
 from tools.file_utils import generate_temp_filename
@@ -56,10 +60,36 @@ if platform.system() == "Windows":
     font_dir = font_dir.replace(":", "\\\\:")
 
 
+def get_caption_audio_parts(audio_file):
+    """
+    配音是由多段音频拼接成的话，返回拼接前的音频列表，只在拼接结果就是当前配音时使用
+    """
+    caption_audio_parts = st.session_state.get("caption_audio_parts")
+    if not caption_audio_parts or caption_audio_parts[0] != audio_file:
+        return None
+    audio_parts = caption_audio_parts[1]
+    if len(audio_parts) < 2 or not all(os.path.exists(audio_part) for audio_part in audio_parts):
+        return None
+    return audio_parts
+
+
 # 生成字幕
 def generate_caption():
     captioning = Captioning()
     captioning.initialize()
+    # 配音时TTS服务返回了时间的话直接使用，没有时间时把已知的文案和配音对齐，
+    # 还不行时使用分句合成时每一句的时间，都没有时再做语音识别
+    audio_output_file = get_session_option("audio_output_file")
+    tts_timing_results = get_tts_timing_results(audio_output_file)
+    if not tts_timing_results:
+        tts_timing_results = get_aligned_timing_results(audio_output_file, get_session_option("caption_script"))
+    if not tts_timing_results:
+        tts_timing_results = get_sentence_timing_results(audio_output_file)
+    if tts_timing_results:
+        print("generate caption from tts timing")
+        captioning._offline_results = tts_timing_results
+        captioning.finish()
+        return
     speech_recognizer_data = captioning.speech_recognizer_from_user_config()
     # print(speech_recognizer_data)
     recognition_type = st.session_state.get('recognition_audio_type')
@@ -89,8 +119,13 @@ def generate_caption():
         if selected_audio_provider =='fasterwhisper':
             print("selected_audio_provider: fasterwhisper")
             fasterwhisper_service = FasterWhisperRecognitionService()
-            result_list = fasterwhisper_service.process(get_session_option("audio_output_file"),
-                                                  get_session_option("audio_language"))
+            audio_parts = get_caption_audio_parts(audio_output_file)
+            if audio_parts:
+                # 混剪的每个场景配音用同一个模型分别识别，num_workers大于1时并发
+                result_list = fasterwhisper_service.process_parts(audio_parts, get_session_option("audio_language"))
+            else:
+                result_list = fasterwhisper_service.process(get_session_option("audio_output_file"),
+                                                            get_session_option("audio_language"))
             print(result_list)
             if result_list is None:
                 return
@@ -109,11 +144,10 @@ def generate_caption():
     captioning.finish()
 
 
-# 添加字幕
-def add_subtitles(video_file, subtitle_file, font_name='Songti TC Bold', font_size=12, primary_colour='#FFFFFF',
-                  outline_colour='#FFFFFF', margin_v=16, margin_l=4, margin_r=4, border_style=1, outline=0, alignment=2,
-                  shadow=0, spacing=2):
-    output_file = generate_temp_filename(video_file)
+# 生成字幕滤镜
+def build_subtitle_filter(subtitle_file, font_name='Songti TC Bold', font_size=12, primary_colour='#FFFFFF',
+                          outline_colour='#FFFFFF', margin_v=16, margin_l=4, margin_r=4, border_style=1, outline=0,
+                          alignment=2, shadow=0, spacing=2):
     # 添加透明度通道（AA），默认00表示不透明，并确保颜色值为6位
     # 将HEX颜色转换为BGRA格式（AARRGGBB -> BBGGRRAA）
     def hex_to_bgra(hex_color):
@@ -129,18 +163,38 @@ def add_subtitles(video_file, subtitle_file, font_name='Songti TC Bold', font_si
     if platform.system() == "Windows":
         subtitle_file = subtitle_file.replace("\\", "\\\\\\\\")
         subtitle_file = subtitle_file.replace(":", "\\\\:")
-    vf_text = f"subtitles={subtitle_file}:fontsdir={font_dir}:force_style='Fontname={font_name},Fontsize={font_size},Alignment={alignment},MarginV={margin_v},MarginL={margin_l},MarginR={margin_r},BorderStyle={border_style},Outline={outline},Shadow={shadow},PrimaryColour={primary_colour},OutlineColour={outline_colour},Spacing={spacing}'"
+    return f"subtitles={subtitle_file}:fontsdir={font_dir}:force_style='Fontname={font_name},Fontsize={font_size},Alignment={alignment},MarginV={margin_v},MarginL={margin_l},MarginR={margin_r},BorderStyle={border_style},Outline={outline},Shadow={shadow},PrimaryColour={primary_colour},OutlineColour={outline_colour},Spacing={spacing}'"
+
+
+# 添加字幕
+def add_subtitles(video_file, subtitle_file, font_name='Songti TC Bold', font_size=12, primary_colour='#FFFFFF',
+                  outline_colour='#FFFFFF', margin_v=16, margin_l=4, margin_r=4, border_style=1, outline=0, alignment=2,
+                  shadow=0, spacing=2, encode_profile=None, keep_keyframes=False):
+    if encode_profile is None:
+        encode_profile = get_encode_profile()
+    output_file = generate_temp_filename(video_file)
+    vf_text = build_subtitle_filter(subtitle_file, font_name=font_name, font_size=font_size,
+                                    primary_colour=primary_colour, outline_colour=outline_colour,
+                                    margin_v=margin_v, margin_l=margin_l, margin_r=margin_r,
+                                    border_style=border_style, outline=outline, alignment=alignment,
+                                    shadow=shadow, spacing=spacing)
     # 构建FFmpeg命令
     ffmpeg_cmd = [
         'ffmpeg',
         '-i', video_file,  # 输入视频文件
         '-vf', vf_text,  # 输入字幕文件
+        *encode_profile.video_args(),
+        *(['-force_key_frames', 'source'] if keep_keyframes else []),  # 保留原视频的关键帧位置
+        '-c:a', 'copy',  # 声音不需要重新编码
         '-y',
         output_file  # 输出文件
     ]
-    print(" ".join(ffmpeg_cmd))
-    # 调用ffmpeg
-    subprocess.run(ffmpeg_cmd, check=True)
+    # 长视频按关键帧分段并行烧录字幕，不能分段时使用一个ffmpeg
+    if not is_chunked_render(video_file) or render_chunked(video_file, output_file, vf_text,
+                                                           encode_profile) is None:
+        print(" ".join(ffmpeg_cmd))
+        # 调用ffmpeg
+        subprocess.run(ffmpeg_cmd, check=True)
     # 重命名最终的文件
     if os.path.exists(output_file):
         os.remove(video_file)
@@ -29,8 +29,14 @@ import tempfile
 import streamlit as st
 import requests
 
+from config.config import my_config
+from services.audio.chunked_tts_service import get_tts_concurrency
+from services.audio.tts_cache import read_tts_corpus, warm_tts_cache
+from services.audio.tts_timing import concat_tts_timings
+from services.video.parallel_service import run_in_pool
+from tools.audio_engine import concat_audio_files
 from tools.file_utils import random_line_from_text_file, download_file_from_url
-from tools.utils import get_must_session_option, random_with_system_time, extent_audio, run_ffmpeg_command
+from tools.utils import get_must_session_option, random_with_system_time, extent_audio
 
 # 获取当前脚本的绝对路径
 script_path = os.path.abspath(__file__)
@@ -253,140 +259,162 @@ def extract_audio_from_video_dir(video_path, output_audio_file):
     return False
 
 
-def get_audio_and_video_list(audio_service, audio_rate):
-    audio_output_file_list = []
+def synthesize_scene_audio(synthesize, scene_jobs, concurrency, synthesize_batch=None):
+    """
+    并发合成每个场景的配音，结果的顺序和scene_jobs一致
+    工作线程里不能调用streamlit，错误信息返回给主线程处理
+    :param synthesize: 合成函数 synthesize(text, audio_output_file)
+    :param scene_jobs: [(场景序号, 文案, 输出文件)]
+    :param synthesize_batch: 批量合成函数 synthesize_batch(texts, audio_output_files)，先一次请求合成所有场景
+    :return: 每个场景的错误信息，成功为None
+    """
+    if synthesize_batch is not None and len(scene_jobs) > 1:
+        try:
+            synthesize_batch([scene_job[1] for scene_job in scene_jobs], [scene_job[2] for scene_job in scene_jobs])
+        except Exception as e:
+            # 批量合成失败的场景，下面再逐个合成
+            print(f"批量合成配音失败，改为逐个合成: {e}")
+
+    def synthesize_one(scene_job):
+        idx, video_scene_text, audio_output_file = scene_job
+        print(f"场景 {idx + 1}: 尝试使用文案生成音频")
+        try:
+            # 输出文件名是新生成的，已经存在说明批量合成已经完成
+            if not os.path.exists(audio_output_file) or os.path.getsize(audio_output_file) == 0:
+                synthesize(video_scene_text, audio_output_file)
+            if os.path.exists(audio_output_file) and os.path.getsize(audio_output_file) > 0:
+                extent_audio(audio_output_file, 1)
+                print(f"场景 {idx + 1}: 文案生成音频成功")
+                return None
+            raise Exception("生成的音频文件为空或不存在")
+        except Exception as e:
+            # TTS服务失败
+            print(f"场景 {idx + 1}: 文案生成音频失败: {e}")
+            return str(e)
+
+    return run_in_pool(synthesize_one, scene_jobs, min(concurrency, max(len(scene_jobs), 1)))
+
+
+def get_scene_audio_list(synthesize, provider, synthesize_batch=None):
     video_dir_list, video_text_list = get_session_video_scene_text()
     video_scene_text_list = get_video_scene_text_list(video_text_list)
-    audio_voice = get_must_session_option("audio_voice", "请先设置配音语音")
-    i = 0
-    for idx, (video_scene_text, video_dir) in enumerate(zip(video_scene_text_list, video_dir_list)):
-        temp_file_name = str(random_with_system_time()) + str(i)
-        i = i + 1
+    scene_audio_files = []
+    scene_jobs = []
+    for idx, video_scene_text in enumerate(video_scene_text_list[:len(video_dir_list)]):
+        temp_file_name = str(random_with_system_time()) + str(idx)
         audio_output_file = os.path.join(audio_output_dir, str(temp_file_name) + ".wav")
-        
+        scene_audio_files.append(audio_output_file)
         if video_scene_text is not None and video_scene_text != "":
             # 如果提供了文案，尝试使用文案生成音频
-            print(f"场景 {idx + 1}: 尝试使用文案生成音频")
-            try:
-                audio_service.save_with_ssml(video_scene_text,
-                                             audio_output_file,
-                                             audio_voice,
-                                             audio_rate)
-                if os.path.exists(audio_output_file) and os.path.getsize(audio_output_file) > 0:
-                    extent_audio(audio_output_file, 1)
-                    audio_output_file_list.append(audio_output_file)
-                    print(f"场景 {idx + 1}: 文案生成音频成功")
-                else:
-                    raise Exception("生成的音频文件为空或不存在")
-            except Exception as e:
-                # TTS服务失败
-                error_msg = str(e)
-                print(f"场景 {idx + 1}: 文案生成音频失败: {error_msg}")
-                
-                # 检查视频目录是否是图片文件
-                if is_image_file(video_dir):
-                    # 如果提供了文案但视频目录是图片，TTS失败时无法回退
-                    error_msg = f"场景 {idx + 1} TTS服务失败（{error_msg}），且视频目录是图片文件无法提取音频。\n请修复TTS服务配置（如开通腾讯云TTS服务或更换其他TTS服务），或提供视频文件/URL而不是图片文件"
-                    st.error(error_msg)
-                    st.stop()
-                else:
-                    # 如果视频目录不是图片，可以尝试从视频提取音频作为回退
-                    print(f"场景 {idx + 1}: 回退到从视频提取音频")
-                    st.warning(f"场景 {idx + 1} TTS服务失败（{error_msg}），已自动切换到从视频提取音频")
-                    
-                    if extract_audio_from_video_dir(video_dir, audio_output_file):
-                        extent_audio(audio_output_file, 1)
-                        audio_output_file_list.append(audio_output_file)
-                    else:
-                        error_msg = f"场景 {idx + 1} 无法提取音频，请确保视频目录中有视频文件或提供视频文件/URL"
-                        st.error(error_msg)
-                        st.stop()
-        else:
-            # 如果没有提供文案，从视频目录中提取音频
-            print(f"场景 {idx + 1}: 从视频目录提取音频")
-            
-            # 先检查是否是图片文件，如果是图片且没有文案，无法提取音频
+            scene_jobs.append((idx, video_scene_text, audio_output_file))
+    concurrency = get_tts_concurrency(provider)
+    print(f"synthesize {len(scene_jobs)} scenes with {provider}, concurrency {concurrency}")
+    scene_errors = dict(zip([scene_job[0] for scene_job in scene_jobs],
+                            synthesize_scene_audio(synthesize, scene_jobs, concurrency, synthesize_batch)))
+
+    audio_output_file_list = []
+    # 每个场景配音的文案，从视频提取的音频没有文案
+    caption_text_list = []
+    for idx, (audio_output_file, video_dir) in enumerate(zip(scene_audio_files, video_dir_list)):
+        if idx in scene_errors:
+            error_msg = scene_errors[idx]
+            if error_msg is None:
+                audio_output_file_list.append(audio_output_file)
+                caption_text_list.append(video_scene_text_list[idx])
+                continue
+            # 检查视频目录是否是图片文件
             if is_image_file(video_dir):
-                error_msg = f"场景 {idx + 1} 的视频目录是图片文件，无法提取音频。\n请提供视频片段文案路径，系统将使用文案生成音频；或者提供视频文件/URL而不是图片文件"
+                # 如果提供了文案但视频目录是图片，TTS失败时无法回退
+                error_msg = f"场景 {idx + 1} TTS服务失败（{error_msg}），且视频目录是图片文件无法提取音频。\n请修复TTS服务配置（如开通腾讯云TTS服务或更换其他TTS服务），或提供视频文件/URL而不是图片文件"
                 st.error(error_msg)
                 st.stop()
-            
-            if extract_audio_from_video_dir(video_dir, audio_output_file):
-                extent_audio(audio_output_file, 1)
-                audio_output_file_list.append(audio_output_file)
             else:
-                error_msg = f"场景 {idx + 1} 无法提取音频，请提供视频文案或确保视频目录中有视频文件或提供视频文件/URL"
-                st.error(error_msg)
-                st.stop()
-
-    return audio_output_file_list, video_dir_list
-
+                # 如果视频目录不是图片，可以尝试从视频提取音频作为回退
+                print(f"场景 {idx + 1}: 回退到从视频提取音频")
+                st.warning(f"场景 {idx + 1} TTS服务失败（{error_msg}），已自动切换到从视频提取音频")
 
-def get_audio_and_video_list_local(audio_service):
-    audio_output_file_list = []
-    video_dir_list, video_text_list = get_session_video_scene_text()
-    video_scene_text_list = get_video_scene_text_list(video_text_list)
-    i = 0
-    for idx, (video_scene_text, video_dir) in enumerate(zip(video_scene_text_list, video_dir_list)):
-        temp_file_name = str(random_with_system_time()) + str(i)
-        i = i + 1
-        audio_output_file = os.path.join(audio_output_dir, str(temp_file_name) + ".wav")
-        
-        if video_scene_text is not None and video_scene_text != "":
-            # 如果提供了文案，尝试使用文案生成音频
-            print(f"场景 {idx + 1}: 尝试使用文案生成音频")
-            try:
-                audio_service.chat_with_content(video_scene_text, audio_output_file)
-                if os.path.exists(audio_output_file) and os.path.getsize(audio_output_file) > 0:
+                if extract_audio_from_video_dir(video_dir, audio_output_file):
                     extent_audio(audio_output_file, 1)
                     audio_output_file_list.append(audio_output_file)
-                    print(f"场景 {idx + 1}: 文案生成音频成功")
+                    caption_text_list.append(None)
                 else:
-                    raise Exception("生成的音频文件为空或不存在")
-            except Exception as e:
-                # TTS服务失败
-                error_msg = str(e)
-                print(f"场景 {idx + 1}: 文案生成音频失败: {error_msg}")
-                
-                # 检查视频目录是否是图片文件
-                if is_image_file(video_dir):
-                    # 如果提供了文案但视频目录是图片，TTS失败时无法回退
-                    error_msg = f"场景 {idx + 1} TTS服务失败（{error_msg}），且视频目录是图片文件无法提取音频。\n请修复TTS服务配置（如开通腾讯云TTS服务或更换其他TTS服务），或提供视频文件/URL而不是图片文件"
+                    error_msg = f"场景 {idx + 1} 无法提取音频，请确保视频目录中有视频文件或提供视频文件/URL"
                     st.error(error_msg)
                     st.stop()
-                else:
-                    # 如果视频目录不是图片，可以尝试从视频提取音频作为回退
-                    print(f"场景 {idx + 1}: 回退到从视频提取音频")
-                    st.warning(f"场景 {idx + 1} TTS服务失败（{error_msg}），已自动切换到从视频提取音频")
-                    
-                    if extract_audio_from_video_dir(video_dir, audio_output_file):
-                        extent_audio(audio_output_file, 1)
-                        audio_output_file_list.append(audio_output_file)
-                    else:
-                        error_msg = f"场景 {idx + 1} 无法提取音频，请确保视频目录中有视频文件或提供视频文件/URL"
-                        st.error(error_msg)
-                        st.stop()
         else:
             # 如果没有提供文案，从视频目录中提取音频
             print(f"场景 {idx + 1}: 从视频目录提取音频")
-            
+
             # 先检查是否是图片文件，如果是图片且没有文案，无法提取音频
             if is_image_file(video_dir):
                 error_msg = f"场景 {idx + 1} 的视频目录是图片文件，无法提取音频。\n请提供视频片段文案路径，系统将使用文案生成音频；或者提供视频文件/URL而不是图片文件"
                 st.error(error_msg)
                 st.stop()
-            
+
             if extract_audio_from_video_dir(video_dir, audio_output_file):
                 extent_audio(audio_output_file, 1)
                 audio_output_file_list.append(audio_output_file)
+                caption_text_list.append(None)
             else:
                 error_msg = f"场景 {idx + 1} 无法提取音频，请提供视频文案或确保视频目录中有视频文件或提供视频文件/URL"
                 st.error(error_msg)
                 st.stop()
-    
+
+    # 所有场景都是文案配音时，生成字幕时可以把拼接后的文案和配音对齐，每个场景一行
+    if caption_text_list and all(caption_text_list):
+        st.session_state["caption_script"] = "\n".join(caption_text_list)
+    else:
+        st.session_state["caption_script"] = None
     return audio_output_file_list, video_dir_list
 
 
+def get_audio_and_video_list(audio_service, audio_rate):
+    audio_voice = get_must_session_option("audio_voice", "请先设置配音语音")
+    return get_scene_audio_list(lambda text, audio_output_file: audio_service.save_with_ssml(text,
+                                                                                          audio_output_file,
+                                                                                          audio_voice,
+                                                                                          audio_rate),
+                                my_config['audio']['provider'])
+
+
+def get_audio_and_video_list_local(audio_service):
+    # 支持批量合成的服务(ChatTTS)一次请求合成所有场景
+    return get_scene_audio_list(audio_service.chat_with_content,
+                                my_config['audio'].get('local_tts', {}).get('provider'),
+                                getattr(audio_service, 'chat_with_content_list', None))
+
+
+def warm_scene_audio_cache(synthesize, provider):
+    """
+    把所有场景文案文件里的每一行都提前合成放进配音缓存，生成视频时随机选中的文案直接命中
+    :return: (成功的数量, 文案总数)
+    """
+    _, video_text_list = get_session_video_scene_text()
+    texts = []
+    for video_text in video_text_list:
+        # 只预热本地的文案文件
+        if video_text and os.path.isfile(video_text):
+            texts.extend(read_tts_corpus(video_text))
+    texts = list(dict.fromkeys(texts))
+    concurrency = get_tts_concurrency(provider)
+    print(f"warm tts cache with {len(texts)} texts, {provider}, concurrency {concurrency}")
+    return warm_tts_cache(synthesize, texts, concurrency), len(texts)
+
+
+def warm_audio_cache(audio_service, audio_rate):
+    audio_voice = get_must_session_option("audio_voice", "请先设置配音语音")
+    return warm_scene_audio_cache(lambda text, audio_output_file: audio_service.save_with_ssml(text,
+                                                                                            audio_output_file,
+                                                                                            audio_voice,
+                                                                                            audio_rate),
+                                  my_config['audio']['provider'])
+
+
+def warm_audio_cache_local(audio_service):
+    return warm_scene_audio_cache(audio_service.chat_with_content,
+                                  my_config['audio'].get('local_tts', {}).get('provider'))
+
+
 def get_video_text():
     video_dir_list, video_text_list = get_session_video_scene_text()
     video_scene_text_list = get_video_scene_text_list(video_text_list)
@@ -395,22 +423,9 @@ def get_video_text():
 
 def concat_audio_list(audio_output_file_list):
     temp_output_file_name = os.path.join(audio_output_dir, str(random_with_system_time()) + ".wav")
-    concat_audio_file = os.path.join(audio_output_dir, "concat_audio_file.txt")
-    with open(concat_audio_file, 'w', encoding='utf-8') as f:
-        for audio_file in audio_output_file_list:
-            f.write("file '{}'\n".format(os.path.abspath(audio_file)))
-    # 调用ffmpeg来合并音频
-    # 注意：这里假设ffmpeg在你的PATH中，否则你需要提供ffmpeg的完整路径
-    command = [
-        'ffmpeg',
-        '-f', 'concat',
-        '-safe', '0',
-        '-i', concat_audio_file,
-        '-c', 'copy',  # 如果可能，直接复制流而不是重新编码
-        temp_output_file_name
-    ]
-    run_ffmpeg_command(command)
-    # 完成后，删除临时文件（如果你不再需要它）
-    os.remove(concat_audio_file)
+    # 在内存中直接拼接PCM数据，不需要concat列表文件和ffmpeg
+    concat_audio_files(audio_output_file_list, temp_output_file_name)
+    # 每个场景都有配音时间时，合并成整段配音的时间用来生成字幕
+    concat_tts_timings(audio_output_file_list, temp_output_file_name)
     print(f"Audio files have been merged into {temp_output_file_name}")
     return temp_output_file_name
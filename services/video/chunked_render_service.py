@@ -0,0 +1,129 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import os
+import subprocess
+import time
+
+from services.video.parallel_service import get_video_config, get_normalize_workers, get_ffmpeg_threads, run_in_pool
+from services.video.probe_service import get_keyframe_times, probe_media
+
+
+def get_chunked_render_config():
+    return get_video_config().get('chunked_render') or {}
+
+
+def is_chunked_render(video_file):
+    # 只有比较长的视频才值得分段，分段太多反而会增加启动ffmpeg的开销
+    chunked_config = get_chunked_render_config()
+    if not chunked_config.get('enable', False):
+        return False
+    # ffprobe失败时不分段，使用原来的一次渲染
+    media_info = probe_media(video_file)
+    if media_info is None or media_info.duration is None:
+        return False
+    return media_info.duration >= float(chunked_config.get('min_duration', 60))
+
+
+def plan_chunks(keyframe_times, duration, chunk_seconds):
+    """
+    按关键帧切分视频，每段大约chunk_seconds秒，分段点都在关键帧上
+    :return: [(start, end)]
+    """
+    boundaries = [0.0]
+    for keyframe_time in keyframe_times:
+        if keyframe_time - boundaries[-1] >= chunk_seconds and duration - keyframe_time >= chunk_seconds / 2:
+            boundaries.append(keyframe_time)
+    boundaries.append(duration)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def render_chunk(video_file, chunk_file, start, end, video_filter, encode_profile, threads):
+    # -copyts保留原始时间戳，字幕滤镜才能按原视频的时间显示，最后再把时间戳归零
+    chunk_filter = "setpts=PTS-STARTPTS"
+    if video_filter:
+        chunk_filter = f"{video_filter},{chunk_filter}"
+    command = ['ffmpeg',
+               '-ss', str(start),
+               '-t', str(end - start),
+               '-copyts',
+               '-i', video_file,
+               '-vf', chunk_filter,
+               '-an',
+               *encode_profile.video_args(threads),
+               '-y', chunk_file]
+    print(" ".join(command))
+    begin = time.time()
+    subprocess.run(command, check=True, capture_output=True)
+    return time.time() - begin
+
+
+def render_chunked(video_file, output_file, video_filter, encode_profile):
+    """
+    把视频按关键帧分成多段，并行编码后用concat demuxer直接拼接，声音直接复制原视频的
+    :param video_filter: 每段都要使用的视频滤镜，比如字幕
+    :return: 输出文件，无法分段时返回None
+    """
+    media_info = probe_media(video_file)
+    duration = media_info.duration if media_info is not None else None
+    keyframe_times = get_keyframe_times(video_file)
+    if not duration or not keyframe_times:
+        return None
+    chunk_seconds = float(get_chunked_render_config().get('chunk_seconds', 30))
+    chunks = plan_chunks(keyframe_times, duration, chunk_seconds)
+    if len(chunks) < 2:
+        return None
+
+    base_name = os.path.splitext(output_file)[0]
+    chunk_files = [f"{base_name}.chunk{i}.mp4" for i in range(len(chunks))]
+    workers = get_normalize_workers(len(chunks))
+    threads = get_ffmpeg_threads(workers)
+    print(f"chunked render {len(chunks)} chunks with {workers} workers, {threads} threads per ffmpeg")
+    begin = time.time()
+    timings = run_in_pool(lambda i: render_chunk(video_file, chunk_files[i], chunks[i][0], chunks[i][1],
+                                                 video_filter, encode_profile, threads),
+                          range(len(chunks)), workers)
+    for i, ((start, end), elapsed) in enumerate(zip(chunks, timings)):
+        print(f"chunk {i}: {start:.3f}-{end:.3f} encoded in {elapsed:.2f}s")
+
+    # 拼接视频段，同时把原视频的声音复制过来
+    chunk_list_file = f"{base_name}.chunks.txt"
+    with open(chunk_list_file, 'w') as f:
+        for chunk_file in chunk_files:
+            f.write(f"file '{chunk_file}'\n")
+    command = ['ffmpeg',
+               '-f', 'concat',
+               '-safe', '0',
+               '-i', chunk_list_file,
+               '-i', video_file,
+               '-map', '0:v',
+               '-map', '1:a?',
+               '-c', 'copy',
+               '-y', output_file]
+    print(" ".join(command))
+    subprocess.run(command, check=True, capture_output=True)
+    for chunk_file in chunk_files:
+        os.remove(chunk_file)
+    os.remove(chunk_list_file)
+    print(f"chunked render finished in {time.time() - begin:.2f}s")
+    return output_file
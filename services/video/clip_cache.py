@@ -0,0 +1,71 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import os
+import threading
+
+from services.video.parallel_service import get_video_config
+from tools.cache_utils import FileLruCache, file_content_hash, hash_key
+
+_clip_cache = None
+_clip_cache_lock = threading.Lock()
+
+
+def get_clip_cache():
+    """
+    获取归一化视频片段的缓存，没有开启时返回None
+    """
+    global _clip_cache
+    cache_config = get_video_config().get('clip_cache') or {}
+    if not cache_config.get('enable', True):
+        return None
+    with _clip_cache_lock:
+        if _clip_cache is None:
+            _clip_cache = FileLruCache("clips", cache_config.get('max_size_mb', 10240))
+        return _clip_cache
+
+
+def normalize_with_cache(media_file, output_name, params, normalize_func):
+    """
+    先从缓存里取归一化的结果，没有命中再调用normalize_func编码，并把结果放进缓存
+    :param media_file: 源文件
+    :param output_name: 归一化的输出文件
+    :param params: 影响输出结果的参数，比如宽高、帧率、时长
+    :param normalize_func: 真正执行归一化的函数，返回输出文件
+    :return: 输出文件
+    """
+    cache = get_clip_cache()
+    is_url = media_file.startswith('http://') or media_file.startswith('https://')
+    if cache is None or is_url or not os.path.exists(media_file):
+        return normalize_func()
+    key = hash_key(file_content_hash(media_file), *params)
+    if cache.fetch(key, output_name):
+        print(f"clip cache hit: {media_file} -> {output_name}")
+        return output_name
+    # 输出文件可能是上次从缓存链接过来的，先删除，防止ffmpeg覆盖写坏缓存
+    if os.path.exists(output_name):
+        os.remove(output_name)
+    result = normalize_func()
+    if result and os.path.exists(result):
+        cache.put(key, result)
+    return result
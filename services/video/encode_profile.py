@@ -0,0 +1,78 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import streamlit as st
+
+from services.video.parallel_service import get_video_config
+
+
+class EncodeProfile:
+    """
+    一组编码参数，所有需要重新编码视频的ffmpeg命令都使用同一个profile
+    """
+
+    def __init__(self, name, preset, crf, resolution_scale=1.0, audio_bitrate='128k'):
+        self.name = name
+        self.preset = preset
+        self.crf = crf
+        self.resolution_scale = resolution_scale
+        self.audio_bitrate = audio_bitrate
+
+    def scale_size(self, width, height):
+        # 按比例缩小分辨率，libx264要求宽高都是偶数
+        if self.resolution_scale == 1.0:
+            return width, height
+        return (int(width * self.resolution_scale) // 2 * 2,
+                int(height * self.resolution_scale) // 2 * 2)
+
+    def video_args(self, threads=None):
+        args = ['-c:v', 'libx264', '-preset', self.preset, '-crf', str(self.crf), '-pix_fmt', 'yuv420p']
+        if threads is not None:
+            args += ['-threads', str(threads)]
+        return args
+
+    def audio_args(self):
+        return ['-c:a', 'aac', '-b:a', self.audio_bitrate]
+
+    def __str__(self):
+        return f"{self.name} preset={self.preset} crf={self.crf} scale={self.resolution_scale}"
+
+
+# draft: 快速预览确认效果; standard: 日常使用，和之前不指定参数时libx264的默认值(medium, crf 23)一致; final: 确认后的高质量成片
+ENCODE_PROFILES = {
+    'draft': EncodeProfile('draft', 'ultrafast', 32, resolution_scale=0.5, audio_bitrate='96k'),
+    'standard': EncodeProfile('standard', 'medium', 23),
+    'final': EncodeProfile('final', 'slow', 18, audio_bitrate='192k'),
+}
+
+DEFAULT_ENCODE_PROFILE = 'standard'
+
+
+def get_encode_profile(name=None):
+    """
+    获取编码profile，没有指定时依次使用页面上的选择和配置文件里的video.encode_profile
+    需要在主线程里调用
+    """
+    if name is None:
+        name = st.session_state.get('video_encode_profile') or get_video_config().get('encode_profile')
+    return ENCODE_PROFILES.get(name or DEFAULT_ENCODE_PROFILE, ENCODE_PROFILES[DEFAULT_ENCODE_PROFILE])
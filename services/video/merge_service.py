@@ -21,7 +21,6 @@
 #
 #
 
-import itertools
 import os
 import random
 import subprocess
@@ -31,9 +30,16 @@ import streamlit as st
 
 from services.captioning.captioning_service import add_subtitles
 from services.hunjian.hunjian_service import get_session_video_scene_text, get_video_scene_text_list
-from services.video.texiao_service import gen_filter
+from services.video.clip_cache import get_clip_cache, normalize_with_cache
+from services.video.encode_profile import get_encode_profile
+from services.video.parallel_service import get_normalize_workers, get_ffmpeg_threads, run_in_pool, get_video_config
+from services.video.probe_service import can_stream_copy_all
+from services.video.proxy_service import get_proxy_files, save_edl
+from services.video.transition_service import is_overlap_transition, get_transition_keyframe_args, \
+    render_overlap_transitions, get_transition_group_size, render_grouped_transitions, build_transition_command
 from services.video.video_service import DEFAULT_DURATION, get_image_info, get_video_duration, get_video_info, \
     get_video_length_list, add_background_music
+from tools.cache_utils import hash_key
 from tools.file_utils import generate_temp_filename
 from tools.tr_utils import tr
 from tools.utils import run_ffmpeg_command, random_with_system_time
@@ -52,16 +58,16 @@ work_output_dir = os.path.join(script_dir, "../../work")
 work_output_dir = os.path.abspath(work_output_dir)
 
 
-def merge_generate_subtitle(video_scene_video_list, video_scene_text_list):
+def merge_generate_subtitle(video_scene_video_list, video_scene_text_list, encode_profile=None):
     enable_subtitles = st.session_state.get("enable_subtitles")
     if enable_subtitles and video_scene_text_list is not None:
         st.write(tr("Add Subtitles..."))
         for video_file, scene_text in zip(video_scene_video_list, video_scene_text_list):
             if scene_text is not None and scene_text != "":
-                generate_subtitles(video_file, scene_text)
+                generate_subtitles(video_file, scene_text, encode_profile, keep_keyframes=is_overlap_transition())
 
 
-def generate_subtitles(video_file, scene_text):
+def generate_subtitles(video_file, scene_text, encode_profile=None, keep_keyframes=False):
     # 获取视频时长
     video_duration = get_video_duration(video_file)
     # 生成字幕文件
@@ -84,7 +90,9 @@ def generate_subtitles(video_file, scene_text):
                   primary_colour=primary_colour,
                   outline_colour=outline_colour,
                   outline=outline,
-                  alignment=alignment)
+                  alignment=alignment,
+                  encode_profile=encode_profile,
+                  keep_keyframes=keep_keyframes)
     print("file with subtitle:", video_file)
 
 
@@ -149,12 +157,16 @@ def random_video_from_dir(video_dir):
 
 
 class VideoMergeService:
-    def __init__(self, video_list):
+    def __init__(self, video_list, proxy=False):
         self.video_list = video_list
+        # 预览模式使用代理素材和draft编码
+        self.proxy = proxy
+        self.source_video_list = list(video_list)
         self.fps = st.session_state["video_fps"]
         self.target_width, self.target_height = st.session_state["video_size"].split('x')
-        self.target_width = int(self.target_width)
-        self.target_height = int(self.target_height)
+        self.encode_profile = get_encode_profile('draft' if proxy else None)
+        self.target_width, self.target_height = self.encode_profile.scale_size(int(self.target_width),
+                                                                               int(self.target_height))
 
         self.enable_background_music = st.session_state["enable_background_music"]
         self.background_music = st.session_state["background_music"]
@@ -164,79 +176,159 @@ class VideoMergeService:
         self.video_transition_effect_duration = st.session_state["video_transition_effect_duration"]
         self.video_transition_effect_type = st.session_state["video_transition_effect_type"]
         self.video_transition_effect_value = st.session_state["video_transition_effect_value"]
+        # 只重新编码转场重叠部分时，归一化需要在转场边界插入关键帧
+        self.overlap_transition = self.enable_video_transition_effect and is_overlap_transition()
+        # 所有素材都能直接复制时才复制，在normalize_video中确定
+        self.stream_copy = False
         self.default_duration = DEFAULT_DURATION
 
     def normalize_video(self):
-        return_video_list = []
-        for media_file in self.video_list:
-            # 如果当前文件是图片，添加转换为视频的命令
-            if media_file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                output_name = generate_temp_filename(media_file, ".mp4", work_output_dir)
-                # 判断图片的纵横比和
-                img_width, img_height = get_image_info(media_file)
-                if img_width / img_height > self.target_width / self.target_height:
-                    # 转换图片为视频片段 图片的视频帧率必须要跟视频的帧率一样，否则可能在最后的合并过程中导致 合并过后的视频过长
-                    ffmpeg_cmd = [
-                        'ffmpeg',
-                        '-loop', '1',
-                        '-i', media_file,
-                        '-c:v', 'h264',
-                        '-t', str(self.default_duration),
-                        '-r', str(self.fps),
-                        '-vf',
-                        f'scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2'
-                        '-y', output_name]
-                else:
-                    ffmpeg_cmd = [
-                        'ffmpeg',
-                        '-loop', '1',
-                        '-i', media_file,
-                        '-c:v', 'h264',
-                        '-t', str(self.default_duration),
-                        '-r', str(self.fps),
-                        '-vf',
-                        f'scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2'
-                        '-y', output_name]
-                print(" ".join(ffmpeg_cmd))
-                subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
-                return_video_list.append(output_name)
+        if self.proxy:
+            proxy_map = get_proxy_files(self.video_list)
+            self.video_list = [proxy_map[media_file] for media_file in self.video_list]
+        # 同一个文件对应同一个输出文件，只需要编码一次，也避免多个ffmpeg同时写同一个文件
+        unique_media_files = list(dict.fromkeys(self.video_list))
+        self.stream_copy = self.can_stream_copy(unique_media_files)
+        workers = get_normalize_workers(len(unique_media_files))
+        threads = get_ffmpeg_threads(workers)
+        print(f"normalize video with {workers} workers, {threads} threads per ffmpeg")
+        output_names = run_in_pool(lambda media_file: self.normalize_one_cached(media_file, threads),
+                                   unique_media_files, workers)
+        output_map = dict(zip(unique_media_files, output_names))
+        return_video_list = [output_map[media_file] for media_file in self.video_list]
+        clip_cache = get_clip_cache()
+        if clip_cache is not None:
+            print("clip cache stats:", clip_cache.stats())
+        self.video_list = return_video_list
+        return return_video_list
 
+    def get_output_name(self, media_file):
+        # 不同目录下的同名素材对应不同的文件，文件名里带上素材路径的hash
+        path_hash = "." + hash_key(media_file)[:10]
+        if media_file.lower().endswith(('.jpg', '.jpeg', '.png')):
+            return generate_temp_filename(media_file, path_hash + ".mp4", work_output_dir)
+        return generate_temp_filename(media_file, path_hash + os.path.splitext(media_file)[1], work_output_dir)
+
+    def normalize_one_cached(self, media_file, threads=1):
+        # 影响归一化结果的参数都要放到缓存key里
+        params = ('merge', self.target_width, self.target_height, self.fps, str(self.encode_profile),
+                  self.default_duration)
+        if self.stream_copy:
+            params += ('copy',)
+        if self.overlap_transition:
+            params += ('keyframes', self.video_transition_effect_duration)
+        return normalize_with_cache(media_file, self.get_output_name(media_file), params,
+                                    lambda: self.normalize_one(media_file, threads))
+
+    def get_keyframe_args(self, duration):
+        if not self.overlap_transition:
+            return []
+        return get_transition_keyframe_args(duration, self.video_transition_effect_duration)
+
+    def can_stream_copy(self, media_files):
+        """
+        直接复制的片段和重新编码的片段不能拼接在一起，所有素材都能直接复制时才复制
+        """
+        if self.overlap_transition:
+            # 直接复制的片段没有转场需要的关键帧
+            return False
+        if not get_video_config().get('stream_copy', True):
+            return False
+        # 合并的时候保留了声音，声音也需要能直接拼接
+        return can_stream_copy_all(media_files, self.target_width, self.target_height, self.fps, with_audio=True)
+
+    def normalize_one(self, media_file, threads=1):
+        # 如果当前文件是图片，添加转换为视频的命令
+        if media_file.lower().endswith(('.jpg', '.jpeg', '.png')):
+            output_name = self.get_output_name(media_file)
+            # 判断图片的纵横比和
+            img_width, img_height = get_image_info(media_file)
+            if img_width / img_height > self.target_width / self.target_height:
+                # 转换图片为视频片段 图片的视频帧率必须要跟视频的帧率一样，否则可能在最后的合并过程中导致 合并过后的视频过长
+                ffmpeg_cmd = [
+                    'ffmpeg',
+                    '-loop', '1',
+                    '-i', media_file,
+                    *self.encode_profile.video_args(threads),
+                    '-t', str(self.default_duration),
+                    '-r', str(self.fps),
+                    '-vf',
+                    f'scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
+                    *self.get_keyframe_args(self.default_duration),
+                    '-y', output_name]
             else:
-                # 当前文件是视频文件
-                video_duration = get_video_duration(media_file)
-                video_width, video_height = get_video_info(media_file)
-                output_name = generate_temp_filename(media_file, new_directory=work_output_dir)
-                # 不需要拉伸也不需要裁剪，只需要调整分辨率和fps
-                if video_width / video_height > self.target_width / self.target_height:
-                    command = [
-                        'ffmpeg',
-                        '-i', media_file,  # 输入文件
-                        '-r', str(self.fps),  # 设置帧率
-                        '-vf',
-                        f"scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
-                        # 设置视频滤镜来调整分辨率
-                        # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                        '-y',
-                        output_name  # 输出文件
-                    ]
-                else:
-                    command = [
-                        'ffmpeg',
-                        '-i', media_file,  # 输入文件
-                        '-r', str(self.fps),  # 设置帧率
-                        '-vf',
-                        f"scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
-                        # 设置视频滤镜来调整分辨率
-                        # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                        '-y',
-                        output_name  # 输出文件
-                    ]
-                # 执行FFmpeg命令
+                ffmpeg_cmd = [
+                    'ffmpeg',
+                    '-loop', '1',
+                    '-i', media_file,
+                    *self.encode_profile.video_args(threads),
+                    '-t', str(self.default_duration),
+                    '-r', str(self.fps),
+                    '-vf',
+                    f'scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
+                    *self.get_keyframe_args(self.default_duration),
+                    '-y', output_name]
+            print(" ".join(ffmpeg_cmd))
+            subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+            return output_name
+
+        else:
+            # 当前文件是视频文件
+            output_name = self.get_output_name(media_file)
+            if self.stream_copy:
+                # 素材已经是目标格式，直接复制，不需要重新编码，只保留第一路视频和音频
+                command = ['ffmpeg', '-i', media_file, '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-y',
+                           output_name]
                 print(" ".join(command))
                 run_ffmpeg_command(command)
-                return_video_list.append(output_name)
-        self.video_list = return_video_list
-        return return_video_list
+                return output_name
+            video_info = get_video_info(media_file)
+            if video_info is None:
+                raise Exception(f"无法获取视频分辨率，请检查素材文件: {media_file}")
+            video_width, video_height = video_info
+            # 不需要拉伸也不需要裁剪，只需要调整分辨率和fps
+            if video_width / video_height > self.target_width / self.target_height:
+                command = [
+                    'ffmpeg',
+                    '-i', media_file,  # 输入文件
+                    '-r', str(self.fps),  # 设置帧率
+                    '-vf',
+                    f"scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
+                    # 设置视频滤镜来调整分辨率
+                    # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
+                    *self.encode_profile.video_args(threads),
+                    *self.encode_profile.audio_args(),
+                    *self.get_keyframe_args(get_video_duration(media_file)),
+                    '-y',
+                    output_name  # 输出文件
+                ]
+            else:
+                command = [
+                    'ffmpeg',
+                    '-i', media_file,  # 输入文件
+                    '-r', str(self.fps),  # 设置帧率
+                    '-vf',
+                    f"scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
+                    # 设置视频滤镜来调整分辨率
+                    # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
+                    *self.encode_profile.video_args(threads),
+                    *self.encode_profile.audio_args(),
+                    *self.get_keyframe_args(get_video_duration(media_file)),
+                    '-y',
+                    output_name  # 输出文件
+                ]
+            # 执行FFmpeg命令
+            print(" ".join(command))
+            run_ffmpeg_command(command)
+            return output_name
+
+    def save_edl(self, video_file, video_scene_text_list=None):
+        # 保存剪辑决定，正式生成时使用同样的原始素材和字幕
+        return save_edl(video_file, {
+            "type": "merge",
+            "video_list": self.source_video_list,
+            "text_list": video_scene_text_list,
+        })
 
     def generate_video_with_bg_music(self):
         # 生成视频和音频的代码
@@ -261,29 +353,36 @@ class VideoMergeService:
                              merge_video]
 
         # 是否需要转场特效
-        if self.enable_video_transition_effect and len(self.video_list) > 1:
-            video_length_list = get_video_length_list(self.video_list)
+        if self.overlap_transition and len(self.video_list) > 1 and render_overlap_transitions(
+                self.video_list, self.video_transition_effect_type, self.video_transition_effect_value,
+                self.video_transition_effect_duration, self.encode_profile, merge_video,
+                with_audio=True) is not None:
+            print("启动转场特效，只编码转场部分")
+            ffmpeg_concat_cmd = None
+        elif self.enable_video_transition_effect and len(self.video_list) > 1:
             print("启动转场特效")
-            zhuanchang_txt = gen_filter(video_length_list, None, None,
-                                        self.video_transition_effect_type,
-                                        self.video_transition_effect_value,
-                                        self.video_transition_effect_duration,
-                                        True)
-
-            # File inputs from the list
-            files_input = [['-i', f] for f in self.video_list]
-            ffmpeg_concat_cmd = ['ffmpeg', *itertools.chain(*files_input),
-                                 '-filter_complex', zhuanchang_txt,
-                                 '-map', '[video]',
-                                 '-map', '[audio]',
-                                 '-y',
-                                 merge_video]
-
-        subprocess.run(ffmpeg_concat_cmd)
+            group_size = get_transition_group_size()
+            # 片段很多时分组并行渲染，避免一个ffmpeg打开太多文件，有片段获取不到时长时一次渲染所有片段
+            if group_size and len(self.video_list) > group_size and render_grouped_transitions(
+                    self.video_list, self.video_transition_effect_type, self.video_transition_effect_value,
+                    self.video_transition_effect_duration, self.encode_profile, merge_video, with_audio=True,
+                    group_size=group_size) is not None:
+                ffmpeg_concat_cmd = None
+            else:
+                video_length_list = get_video_length_list(self.video_list)
+                ffmpeg_concat_cmd = build_transition_command(self.video_list, video_length_list,
+                                                             self.video_transition_effect_type,
+                                                             self.video_transition_effect_value,
+                                                             self.video_transition_effect_duration,
+                                                             self.encode_profile, merge_video, with_audio=True)
+
+        if ffmpeg_concat_cmd is not None:
+            subprocess.run(ffmpeg_concat_cmd)
         # 删除临时文件
         os.remove(temp_video_filelist_path)
 
         # 添加背景音乐
         if self.enable_background_music:
-            add_background_music(merge_video, self.background_music, self.background_music_volume)
+            add_background_music(merge_video, self.background_music, self.background_music_volume,
+                                 self.encode_profile)
         return merge_video
@@ -0,0 +1,68 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from config.config import my_config
+
+
+def get_video_config():
+    # config.yml 里的 video 节点可能为空
+    return my_config.get('video') or {}
+
+
+def get_normalize_workers(job_count):
+    """
+    计算视频归一化时同时运行的ffmpeg进程数
+    :param job_count: 需要处理的片段数量
+    :return: 并发数，至少为1
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = int(get_video_config().get('normalize_workers') or 0)
+    if workers <= 0:
+        # 默认每个ffmpeg至少分到2个核
+        workers = max(1, cpu_count // 2)
+    return max(1, min(workers, job_count))
+
+
+def get_ffmpeg_threads(workers):
+    """
+    把cpu核数平均分配给同时运行的ffmpeg进程
+    :param workers: 同时运行的ffmpeg进程数
+    :return: 每个ffmpeg的 -threads 参数
+    """
+    cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count // max(1, workers))
+
+
+def run_in_pool(func, items, workers):
+    """
+    用线程池并发执行func，返回结果的顺序和items一致
+    ffmpeg本身在子进程里运行，所以线程池就足够了
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
@@ -0,0 +1,320 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+
+from tools.cache_utils import cache_root_dir
+
+# v2: 保存了视频流的profile、level和extradata(SPS/PPS)，旧的探测结果没有这些信息
+probe_db_file = os.path.join(cache_root_dir, "media_probe_v2.db")
+
+
+def parse_rate(rate):
+    # ffprobe的帧率是 30000/1001 这样的分数
+    if not rate or rate == '0/0':
+        return None
+    if '/' in rate:
+        numerator, denominator = map(float, rate.split('/'))
+        if denominator == 0:
+            return None
+        return numerator / denominator
+    return float(rate)
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def mp4_time_base(fps):
+    # 和ffmpeg的mp4 muxer一致：时间基的分母从帧率开始，不断乘2直到不小于10000
+    if fps is None or int(fps) != fps or fps <= 0:
+        return None
+    timescale = int(fps)
+    while timescale < 10000:
+        timescale *= 2
+    return f"1/{timescale}"
+
+
+class MediaInfo:
+    """
+    一次ffprobe得到的媒体信息
+    """
+
+    def __init__(self, path, probe_data):
+        self.path = path
+        self.probe_data = probe_data
+        format_info = probe_data.get('format', {})
+        streams = probe_data.get('streams', [])
+        video_stream = next((s for s in streams if s.get('codec_type') == 'video'), None)
+        audio_stream = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+        self.format_name = format_info.get('format_name')
+        self.bit_rate = to_int(format_info.get('bit_rate'))
+        self.duration = to_float(format_info.get('duration'))
+
+        self.has_video = video_stream is not None
+        self.video_codec = None
+        self.pix_fmt = None
+        self.width = None
+        self.height = None
+        self.fps = None
+        self.time_base = None
+        self.sample_aspect_ratio = None
+        self.profile = None
+        self.level = None
+        self.has_b_frames = None
+        self.extradata = None
+        if video_stream is not None:
+            self.video_codec = video_stream.get('codec_name')
+            self.pix_fmt = video_stream.get('pix_fmt')
+            self.width = to_int(video_stream.get('width'))
+            self.height = to_int(video_stream.get('height'))
+            self.fps = parse_rate(video_stream.get('r_frame_rate')) or parse_rate(video_stream.get('avg_frame_rate'))
+            self.time_base = video_stream.get('time_base')
+            self.sample_aspect_ratio = video_stream.get('sample_aspect_ratio')
+            self.profile = video_stream.get('profile')
+            self.level = video_stream.get('level')
+            self.has_b_frames = video_stream.get('has_b_frames')
+            # -show_data输出的extradata，h264是avcC里的SPS/PPS
+            self.extradata = video_stream.get('extradata')
+            if self.duration is None:
+                self.duration = to_float(video_stream.get('duration'))
+
+        self.has_audio = audio_stream is not None
+        self.audio_codec = None
+        self.sample_rate = None
+        self.channels = None
+        if audio_stream is not None:
+            self.audio_codec = audio_stream.get('codec_name')
+            self.sample_rate = to_int(audio_stream.get('sample_rate'))
+            self.channels = to_int(audio_stream.get('channels'))
+            if self.duration is None:
+                self.duration = to_float(audio_stream.get('duration'))
+
+    def matches_video_profile(self, width, height, fps, codec='h264', pix_fmt='yuv420p'):
+        """
+        视频流是否已经和目标参数完全一致，一致的话可以直接stream copy，不需要重新编码
+        """
+        if not self.has_video or self.video_codec != codec or self.pix_fmt != pix_fmt:
+            return False
+        if self.width != width or self.height != height:
+            return False
+        if self.fps is None or abs(self.fps - fps) > 0.01:
+            return False
+        if self.sample_aspect_ratio not in (None, '1:1', '0:1'):
+            return False
+        # 拼接时使用concat copy，时间基不一致会导致时间戳错乱
+        return self.time_base == mp4_time_base(fps)
+
+    def video_signature(self):
+        """
+        concat copy要求所有片段的解码参数一致，没有extradata时返回None
+        """
+        if not self.extradata:
+            return None
+        return self.video_codec, self.profile, self.level, self.has_b_frames, self.extradata
+
+    def audio_signature(self):
+        if not self.has_audio:
+            return None
+        return self.audio_codec, self.sample_rate, self.channels
+
+    def __str__(self):
+        return (f"{self.path} duration={self.duration} video={self.video_codec} {self.width}x{self.height}"
+                f"@{self.fps} audio={self.audio_codec} {self.sample_rate}Hz")
+
+
+class ProbeStore:
+    """
+    使用sqlite保存ffprobe结果，按 (路径, 大小, 修改时间) 判断是否需要重新探测
+    """
+    tables = ('probe', 'keyframes')
+
+    def __init__(self, db_file):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        for table in self.tables:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                               "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, data TEXT)")
+        self._conn.commit()
+
+    def get(self, path, size, mtime, table='probe'):
+        with self._lock:
+            row = self._conn.execute(f"SELECT data FROM {table} WHERE path=? AND size=? AND mtime=?",
+                                     (path, size, mtime)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, path, size, mtime, data, table='probe'):
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO {table} (path, size, mtime, data) VALUES (?, ?, ?, ?)",
+                               (path, size, mtime, json.dumps(data)))
+            self._conn.commit()
+
+
+_probe_store = None
+_probe_store_lock = threading.Lock()
+# URL等没有文件状态的资源只在当前进程内记忆
+_url_probe_memo = {}
+
+
+def get_probe_store():
+    global _probe_store
+    with _probe_store_lock:
+        if _probe_store is None:
+            _probe_store = ProbeStore(probe_db_file)
+        return _probe_store
+
+
+def run_ffprobe(media_file):
+    # -show_data输出视频流的extradata，用来判断片段能不能直接拼接
+    command = ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-show_data', '-of', 'json', media_file]
+    print(" ".join(command))
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        print(f"ffprobe failed: {result.stderr.decode('utf-8', errors='ignore')}")
+        return None
+    return json.loads(result.stdout.decode('utf-8', errors='ignore'))
+
+
+def probe_media(media_file):
+    """
+    获取媒体文件信息，同一个文件没有变化时直接使用缓存的结果
+    :param media_file: 文件路径或URL
+    :return: MediaInfo，失败返回None
+    """
+    is_url = media_file.startswith('http://') or media_file.startswith('https://')
+    if is_url or not os.path.exists(media_file):
+        if media_file not in _url_probe_memo:
+            probe_data = run_ffprobe(media_file)
+            if probe_data is None:
+                return None
+            _url_probe_memo[media_file] = probe_data
+        return MediaInfo(media_file, _url_probe_memo[media_file])
+
+    path = os.path.abspath(media_file)
+    stat = os.stat(path)
+    store = get_probe_store()
+    probe_data = store.get(path, stat.st_size, stat.st_mtime_ns)
+    if probe_data is None:
+        probe_data = run_ffprobe(path)
+        if probe_data is None:
+            return None
+        store.put(path, stat.st_size, stat.st_mtime_ns, probe_data)
+    return MediaInfo(media_file, probe_data)
+
+
+def get_media_duration(media_file):
+    # ffprobe失败或者没有时长时返回None
+    media_info = probe_media(media_file)
+    return media_info.duration if media_info is not None else None
+
+
+def run_keyframe_probe(media_file):
+    # 只读取数据包的关键帧标记，不需要解码
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+               '-of', 'csv=print_section=0', media_file]
+    print(" ".join(command))
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        print(f"ffprobe failed: {result.stderr.decode('utf-8', errors='ignore')}")
+        return None
+    keyframe_times = []
+    for line in result.stdout.decode('utf-8', errors='ignore').splitlines():
+        parts = line.strip().split(',')
+        if len(parts) >= 2 and 'K' in parts[1]:
+            pts_time = to_float(parts[0])
+            if pts_time is not None:
+                keyframe_times.append(pts_time)
+    return sorted(keyframe_times)
+
+
+def get_keyframe_times(media_file):
+    """
+    获取视频关键帧的时间点（秒），和probe_media一样会持久化缓存
+    :return: 关键帧时间列表，失败返回None
+    """
+    is_url = media_file.startswith('http://') or media_file.startswith('https://')
+    if is_url or not os.path.exists(media_file):
+        return None
+    path = os.path.abspath(media_file)
+    stat = os.stat(path)
+    store = get_probe_store()
+    keyframe_times = store.get(path, stat.st_size, stat.st_mtime_ns, table='keyframes')
+    if keyframe_times is None:
+        keyframe_times = run_keyframe_probe(path)
+        if keyframe_times is None:
+            return None
+        store.put(path, stat.st_size, stat.st_mtime_ns, keyframe_times, table='keyframes')
+    return keyframe_times
+
+
+def get_copy_start(media_file, start):
+    """
+    stream copy只能从关键帧开始，返回不晚于start的最近一个关键帧，获取不到关键帧时返回None
+    """
+    if start <= 0:
+        return 0.0
+    keyframe_times = get_keyframe_times(media_file)
+    if not keyframe_times:
+        return None
+    candidates = [t for t in keyframe_times if t <= start + 0.001]
+    return candidates[-1] if candidates else 0.0
+
+
+def can_stream_copy_all(media_files, width, height, fps, with_audio=False):
+    """
+    所有素材都和目标参数一致，并且profile、level、extradata也完全相同时，才可以全部直接复制
+    直接复制的片段和libx264重新编码的片段SPS/PPS不同，concat copy拼接后解码会花屏
+    :param with_audio: 音频也需要直接拼接时，要求都是aac并且采样率和声道数相同
+    """
+    video_signatures = set()
+    audio_signatures = set()
+    for media_file in dict.fromkeys(media_files):
+        media_info = probe_media(media_file)
+        if media_info is None or not media_info.matches_video_profile(width, height, fps):
+            return False
+        video_signature = media_info.video_signature()
+        if video_signature is None:
+            return False
+        video_signatures.add(video_signature)
+        if with_audio:
+            audio_signature = media_info.audio_signature()
+            if audio_signature is not None and audio_signature[0] != 'aac':
+                return False
+            audio_signatures.add(audio_signature)
+    return len(video_signatures) == 1 and len(audio_signatures) <= 1
@@ -0,0 +1,140 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import json
+import os
+import subprocess
+import threading
+
+import streamlit as st
+
+from services.video.parallel_service import get_video_config, get_normalize_workers, run_in_pool
+from services.video.timeline import is_image_media
+from tools.cache_utils import FileLruCache, file_content_hash, hash_key
+
+# 获取当前脚本的绝对路径
+script_path = os.path.abspath(__file__)
+
+# 脚本所在的目录
+script_dir = os.path.dirname(script_path)
+
+# work目录
+work_output_dir = os.path.join(script_dir, "../../work")
+work_output_dir = os.path.abspath(work_output_dir)
+
+# 保存到EDL里的页面配置，正式生成时恢复这些配置，保证和预览的剪辑完全一致
+EDL_SESSION_KEYS = ['video_fps', 'video_size', 'video_segment_min_length', 'video_segment_max_length',
+                    'enable_background_music', 'background_music', 'background_music_volume',
+                    'enable_video_transition_effect', 'video_transition_effect_duration',
+                    'video_transition_effect_type', 'video_transition_effect_value',
+                    'enable_subtitles', 'subtitle_font', 'subtitle_font_size', 'subtitle_color',
+                    'subtitle_border_color', 'subtitle_border_width', 'subtitle_position']
+
+_proxy_cache = None
+_proxy_cache_lock = threading.Lock()
+
+
+def is_proxy_preview():
+    # 预览模式：使用低分辨率代理素材和draft编码快速生成预览
+    return bool(st.session_state.get('video_proxy_preview', False))
+
+
+def get_proxy_cache():
+    global _proxy_cache
+    proxy_config = get_video_config().get('proxy') or {}
+    with _proxy_cache_lock:
+        if _proxy_cache is None:
+            _proxy_cache = FileLruCache("proxies", proxy_config.get('max_size_mb', 5120))
+        return _proxy_cache
+
+
+def get_proxy_file(media_file):
+    """
+    获取素材的低分辨率代理文件，代理文件的时长和帧率和原素材一致，只降低分辨率和码率
+    图片和网络素材直接返回原文件
+    """
+    is_url = media_file.startswith('http://') or media_file.startswith('https://')
+    if is_image_media(media_file) or is_url or not os.path.exists(media_file):
+        return media_file
+    proxy_height = int((get_video_config().get('proxy') or {}).get('height', 360))
+    cache = get_proxy_cache()
+    key = hash_key(file_content_hash(media_file), 'proxy', proxy_height)
+    cached_file = cache.get(key)
+    if cached_file is not None:
+        return cached_file
+    os.makedirs(work_output_dir, exist_ok=True)
+    temp_file = os.path.join(work_output_dir, key + ".proxy.mp4")
+    # 关键帧间隔小一些，预览时按-ss截取更快
+    command = ['ffmpeg', '-i', media_file,
+               '-vf', f"scale=-2:{proxy_height}",
+               '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '30', '-g', '15',
+               '-c:a', 'aac', '-b:a', '64k',
+               '-y', temp_file]
+    print(" ".join(command))
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        print(f"生成代理文件失败，使用原文件: {result.stderr.decode('utf-8', errors='ignore')}")
+        return media_file
+    cached_file = cache.put(key, temp_file)
+    os.remove(temp_file)
+    return cached_file or media_file
+
+
+def get_proxy_files(media_files):
+    """
+    并行生成代理文件
+    :return: 原文件到代理文件的映射
+    """
+    unique_media_files = list(dict.fromkeys(media_files))
+    workers = get_normalize_workers(len(unique_media_files))
+    proxy_files = run_in_pool(get_proxy_file, unique_media_files, workers)
+    return dict(zip(unique_media_files, proxy_files))
+
+
+def get_edl_file(video_file):
+    return os.path.splitext(video_file)[0] + ".edl.json"
+
+
+def save_edl(video_file, edl):
+    """
+    把预览视频的剪辑决定保存到视频旁边的json文件，edl里面保存的都是原始素材
+    """
+    edl = dict(edl)
+    edl['preview_file'] = video_file
+    edl['session'] = {key: st.session_state.get(key) for key in EDL_SESSION_KEYS}
+    edl_file = get_edl_file(video_file)
+    with open(edl_file, 'w', encoding='utf-8') as f:
+        json.dump(edl, f, ensure_ascii=False, indent=2)
+    print("edl file:", edl_file)
+    return edl_file
+
+
+def load_edl(edl_file):
+    """
+    读取EDL，并把预览时的页面配置恢复到session里
+    """
+    with open(edl_file, 'r', encoding='utf-8') as f:
+        edl = json.load(f)
+    for key, value in edl.get('session', {}).items():
+        st.session_state[key] = value
+    return edl
@@ -0,0 +1,124 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import itertools
+import subprocess
+
+from services.video.encode_profile import get_encode_profile
+from services.video.parallel_service import get_video_config
+from services.video.texiao_service import gen_filter
+
+
+def is_single_pass_render():
+    # multi_pass: 归一化、拼接、配音、背景音乐、字幕分多次处理; single_pass: 一次编码完成
+    return get_video_config().get('render_mode', 'multi_pass') == 'single_pass'
+
+
+def build_clip_input(clip_spec):
+    # 图片需要循环输入，视频在输入端seek，只解码需要的时长
+    if clip_spec.is_image:
+        return ['-loop', '1', '-t', str(clip_spec.duration), '-i', clip_spec.source]
+    seek = ['-ss', str(clip_spec.start)] if clip_spec.start > 0 else []
+    return [*seek, '-t', str(clip_spec.source_duration), '-i', clip_spec.source]
+
+
+def build_clip_filter(index, clip_spec, target_width, target_height, fps):
+    # 拉伸、缩放裁剪到目标分辨率、统一帧率并截取到准确的时长
+    # 重复的片段也各自使用一个输入，用split共享解码结果时，后面的位置要等前面的位置拼接完才读取，
+    # 这期间解码好的帧都要缓存在内存里，片段重复很多次时会占用大量内存
+    if clip_spec.stretch_factor != 1.0:
+        setpts = f"setpts={clip_spec.stretch_factor}*(PTS-STARTPTS)"
+    else:
+        setpts = "setpts=PTS-STARTPTS"
+    return (f"[{index}:v]{setpts},"
+            f"scale={target_width}:{target_height}:force_original_aspect_ratio=increase,"
+            f"crop={target_width}:{target_height},setsar=1,fps={fps},"
+            f"trim=duration={clip_spec.duration},setpts=PTS-STARTPTS,format=yuv420p[{index}v];")
+
+
+def build_render_graph(clip_specs, target_width, target_height, fps, transition=None, bgm_volume=None,
+                       subtitle_filter=None):
+    """
+    生成一次编码完成的filter_complex
+    :param clip_specs: 时间线上的片段
+    :param transition: 转场参数 (type, value, duration)，None表示直接拼接
+    :param bgm_volume: 背景音乐音量，None表示没有背景音乐
+    :param subtitle_filter: 字幕滤镜，None表示不加字幕
+    :return: filter_complex字符串，视频输出标签，音频输出标签
+    """
+    clip_count = len(clip_specs)
+    graph = "".join(build_clip_filter(i, clip_spec, target_width, target_height, fps)
+                    for i, clip_spec in enumerate(clip_specs))
+
+    if transition is not None and clip_count > 1:
+        transition_type, transition_value, transition_duration = transition
+        graph += gen_filter([clip_spec.duration for clip_spec in clip_specs], None, None,
+                            transition_type, transition_value, transition_duration, False)
+    elif clip_count > 1:
+        graph += "".join(f"[{i}v]" for i in range(clip_count)) + f"concat=n={clip_count}:v=1:a=0[video];"
+    else:
+        graph += "[0v]null[video];"
+
+    if subtitle_filter:
+        graph += f"[video]{subtitle_filter}[vout]"
+    else:
+        graph += "[video]null[vout]"
+
+    # 配音是第clip_count个输入，背景音乐紧随其后
+    audio_output = f"{clip_count}:a"
+    if bgm_volume is not None:
+        graph += (f";[{clip_count + 1}:a]volume={bgm_volume}[bgm_vol];"
+                  f"[{clip_count}:a][bgm_vol]amix=duration=first:dropout_transition=3:inputs=2[aout]")
+        audio_output = "[aout]"
+    return graph, "[vout]", audio_output
+
+
+def render_single_pass(clip_specs, audio_file, output_file, target_width, target_height, fps,
+                       transition=None, background_music=None, bgm_volume=0.5, subtitle_filter=None,
+                       encode_profile=None):
+    """
+    一个ffmpeg进程完成片段归一化、拼接/转场、配音、背景音乐和字幕，只在最后编码一次
+    """
+    if encode_profile is None:
+        encode_profile = get_encode_profile()
+    graph, video_output, audio_output = build_render_graph(clip_specs, target_width, target_height, fps,
+                                                           transition,
+                                                           bgm_volume if background_music else None,
+                                                           subtitle_filter)
+    inputs = list(itertools.chain(*[build_clip_input(clip_spec) for clip_spec in clip_specs]))
+    inputs += ['-i', audio_file]
+    if background_music:
+        # 背景音乐无限循环，由amix的duration=first决定长度
+        inputs += ['-stream_loop', '-1', '-i', background_music]
+    command = ['ffmpeg', *inputs,
+               '-filter_complex', graph,
+               '-map', video_output,
+               '-map', audio_output,
+               *encode_profile.video_args(),
+               *encode_profile.audio_args(),
+               '-shortest',
+               '-y',
+               output_file]
+    print(" ".join(command))
+    subprocess.run(command, check=True, capture_output=True)
+    return output_file
@@ -0,0 +1,85 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import random
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def is_image_media(media_file):
+    return media_file.lower().endswith(IMAGE_EXTENSIONS)
+
+
+class ClipSpec:
+    """
+    时间线上的一个片段：源文件、在源文件中的起点、输出时长以及拉伸比例
+    """
+
+    def __init__(self, source, duration, start=0.0, stretch_factor=1.0):
+        self.source = source
+        self.duration = float(duration)
+        self.start = float(start)
+        self.stretch_factor = float(stretch_factor)
+        self.is_image = is_image_media(source)
+
+    @property
+    def source_duration(self):
+        # 需要从源文件中读取的时长
+        return self.duration / self.stretch_factor
+
+    def key(self):
+        # 相同的key表示输出完全一样，只需要编码一次
+        return self.source, round(self.start, 3), round(self.duration, 3), round(self.stretch_factor, 6)
+
+    def to_dict(self):
+        return {"source": self.source, "duration": self.duration, "start": self.start,
+                "stretch_factor": self.stretch_factor}
+
+    @staticmethod
+    def from_dict(data):
+        return ClipSpec(data["source"], data["duration"], start=data.get("start", 0.0),
+                        stretch_factor=data.get("stretch_factor", 1.0))
+
+    def __str__(self):
+        return f"{self.source} start={self.start} duration={self.duration} stretch={self.stretch_factor}"
+
+
+def choose_window_start(source_duration, window, mode='random', keyframe_times=None, seed=None):
+    """
+    在较长的素材里选择需要截取的片段起点
+    :param source_duration: 素材总时长
+    :param window: 需要截取的时长
+    :param mode: head: 从头开始; random: 随机位置; keyframe: 随机选一个关键帧(通常是镜头切换的位置)作为起点
+    :param keyframe_times: 关键帧时间列表，mode为keyframe时使用
+    :param seed: 随机种子，同一个素材使用同一个种子时每次选中的位置相同，归一化的片段缓存才能命中
+    :return: 起点（秒）
+    """
+    latest_start = source_duration - window
+    if latest_start <= 0 or mode == 'head':
+        return 0.0
+    rng = random.Random(seed) if seed is not None else random
+    if mode == 'keyframe' and keyframe_times:
+        candidates = [t for t in keyframe_times if 0 <= t <= latest_start]
+        if candidates:
+            return float(rng.choice(candidates))
+    return round(rng.uniform(0, latest_start), 3)
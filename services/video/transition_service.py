@@ -0,0 +1,236 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import os
+import subprocess
+import time
+
+from services.video.parallel_service import get_video_config, get_normalize_workers, get_ffmpeg_threads, run_in_pool
+from services.video.probe_service import get_keyframe_times, get_media_duration
+from services.video.texiao_service import gen_filter
+
+
+def is_overlap_transition():
+    # full: 所有片段都经过xfade重新编码; overlap: 只重新编码转场的重叠部分，中间部分直接复制
+    return get_video_config().get('transition_mode', 'full') == 'overlap'
+
+
+def get_transition_group_size():
+    # 片段数超过这个值时分组渲染转场，0表示不分组(默认)
+    # 分组之后每一层合并都要重新编码一次，画质有损失，总的编码量也更多，只在片段很多、cpu核数也多时才值得开启
+    return int(get_video_config().get('transition_group_size', 0) or 0)
+
+
+def get_transition_keyframe_args(duration, transition_duration):
+    """
+    归一化时在转场的边界强制插入关键帧，片段中间部分才能直接复制
+    """
+    transition_duration = float(transition_duration)
+    if duration <= 2 * transition_duration:
+        return []
+    return ['-force_key_frames', f"0,{transition_duration},{duration - transition_duration}"]
+
+
+def has_keyframe_at(keyframe_times, position):
+    return position == 0 or any(abs(t - position) < 0.002 for t in keyframe_times or [])
+
+
+def build_middle_command(video_file, start, end, keyframe_times, encode_profile, threads, output_file):
+    # 中间部分从关键帧开始时直接复制，否则重新编码这一段
+    if has_keyframe_at(keyframe_times, start):
+        seek = ['-ss', str(start)] if start > 0 else []
+        return ['ffmpeg', *seek, '-i', video_file, '-t', str(end - start),
+                '-map', '0:v:0', '-c', 'copy', '-avoid_negative_ts', 'make_zero', '-y', output_file]
+    return ['ffmpeg', '-ss', str(start), '-t', str(end - start), '-i', video_file,
+            '-map', '0:v:0', *encode_profile.video_args(threads), '-y', output_file]
+
+
+def build_overlap_command(video_file, next_video_file, video_length, transition_type, transition_value,
+                          transition_duration, encode_profile, threads, output_file):
+    # 前一个片段的最后transition_duration秒和后一个片段的开头做转场
+    return ['ffmpeg',
+            '-ss', str(video_length - transition_duration), '-t', str(transition_duration), '-i', video_file,
+            '-t', str(transition_duration), '-i', next_video_file,
+            '-filter_complex',
+            f"[0:v][1:v]{transition_type}=transition={transition_value}:duration={transition_duration}"
+            f":offset=0,format=yuv420p[v]",
+            '-map', '[v]', *encode_profile.video_args(threads), '-y', output_file]
+
+
+def build_audio_crossfade_command(video_files, transition_duration, encode_profile, output_file):
+    # 声音很快，一次完成所有的acrossfade，和gen_filter里的处理一致
+    inputs = []
+    for video_file in video_files:
+        inputs += ['-i', video_file]
+    audio_fades = ""
+    last_audio_output = "0:a"
+    for i in range(1, len(video_files)):
+        next_audio_output = f"a{i}"
+        audio_fades += f"[{last_audio_output}][{i}:a]acrossfade=d={transition_duration}:c2=nofade[{next_audio_output}];"
+        last_audio_output = next_audio_output
+    return ['ffmpeg', *inputs, '-filter_complex', audio_fades.rstrip(';'),
+            '-map', f"[{last_audio_output}]", *encode_profile.audio_args(), '-y', output_file]
+
+
+def render_overlap_transitions(video_files, transition_type, transition_value, transition_duration,
+                               encode_profile, output_file, with_audio=False):
+    """
+    只重新编码转场的重叠部分，片段中间部分直接复制，最后用concat demuxer拼接
+    结果和gen_filter的xfade链一致：总时长是所有片段时长减去转场时长*(片段数-1)
+    :return: 输出文件，片段太短不能这样处理时返回None
+    """
+    transition_duration = float(transition_duration)
+    # 有文件ffprobe失败时返回None，使用完整的xfade渲染
+    video_lengths = [get_media_duration(video_file) for video_file in video_files]
+    if any(length is None or length <= 2 * transition_duration for length in video_lengths):
+        return None
+
+    base_name = os.path.splitext(output_file)[0]
+    last_index = len(video_files) - 1
+    piece_files = []
+    jobs = []
+    for i, (video_file, video_length) in enumerate(zip(video_files, video_lengths)):
+        start = transition_duration if i > 0 else 0.0
+        end = video_length - transition_duration if i < last_index else video_length
+        piece_file = f"{base_name}.piece{len(piece_files)}.mp4"
+        piece_files.append(piece_file)
+        jobs.append(('middle', video_file, start, end, piece_file))
+        if i < last_index:
+            piece_file = f"{base_name}.piece{len(piece_files)}.mp4"
+            piece_files.append(piece_file)
+            jobs.append(('overlap', video_file, video_files[i + 1], video_length, piece_file))
+
+    workers = get_normalize_workers(len(jobs))
+    threads = get_ffmpeg_threads(workers)
+
+    def run_job(job):
+        if job[0] == 'middle':
+            _, video_file, start, end, piece_file = job
+            command = build_middle_command(video_file, start, end, get_keyframe_times(video_file),
+                                           encode_profile, threads, piece_file)
+        else:
+            _, video_file, next_video_file, video_length, piece_file = job
+            command = build_overlap_command(video_file, next_video_file, video_length, transition_type,
+                                            transition_value, transition_duration, encode_profile, threads,
+                                            piece_file)
+        print(" ".join(command))
+        begin = time.time()
+        subprocess.run(command, check=True, capture_output=True)
+        return time.time() - begin
+
+    begin = time.time()
+    timings = run_in_pool(run_job, jobs, workers)
+    for job, elapsed in zip(jobs, timings):
+        print(f"transition piece {job[0]} {job[-1]}: {elapsed:.2f}s")
+
+    piece_list_file = f"{base_name}.pieces.txt"
+    with open(piece_list_file, 'w') as f:
+        for piece_file in piece_files:
+            f.write(f"file '{piece_file}'\n")
+    temp_files = piece_files + [piece_list_file]
+    command = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', piece_list_file]
+    if with_audio:
+        audio_file = f"{base_name}.crossfade.m4a"
+        audio_command = build_audio_crossfade_command(video_files, transition_duration, encode_profile, audio_file)
+        print(" ".join(audio_command))
+        subprocess.run(audio_command, check=True, capture_output=True)
+        temp_files.append(audio_file)
+        command += ['-i', audio_file, '-map', '0:v', '-map', '1:a']
+    command += ['-c', 'copy', '-y', output_file]
+    print(" ".join(command))
+    subprocess.run(command, check=True, capture_output=True)
+    for temp_file in temp_files:
+        os.remove(temp_file)
+    print(f"overlap transition render finished in {time.time() - begin:.2f}s")
+    return output_file
+
+
+def build_transition_command(video_files, video_lengths, transition_type, transition_value, transition_duration,
+                             encode_profile, output_file, with_audio=False, threads=None):
+    # 一个ffmpeg完成一组片段的xfade链
+    filter_txt = gen_filter(video_lengths, None, None, transition_type, transition_value, transition_duration,
+                            with_audio)
+    # 重复的文件也各自输入一次，用split共享时后面的位置读取前解码好的帧都要缓存在内存里
+    files_input = [['-i', video_file] for video_file in video_files]
+    if with_audio:
+        output_args = ['-map', '[video]', '-map', '[audio]', *encode_profile.video_args(threads),
+                       *encode_profile.audio_args()]
+    else:
+        output_args = ['-map', '[video]', *encode_profile.video_args(threads)]
+    return ['ffmpeg', *[arg for file_input in files_input for arg in file_input],
+            '-filter_complex', filter_txt, *output_args, '-y', output_file]
+
+
+def render_grouped_transitions(video_files, transition_type, transition_value, transition_duration,
+                               encode_profile, output_file, with_audio=False, group_size=None):
+    """
+    片段很多时，每group_size个片段一组并行渲染转场得到中间文件，再对中间文件做同样的处理，直到只剩一组
+    每个ffmpeg同时打开的文件和滤镜链长度都不超过group_size
+    中间文件的时长按 片段时长之和 - 转场时长*(片段数-1) 计算，和一次渲染所有片段的offset完全一致
+    :return: 输出文件，有片段获取不到时长时返回None
+    """
+    if group_size is None:
+        group_size = get_transition_group_size()
+    group_size = max(group_size, 2)
+    transition_duration = float(transition_duration)
+    video_lengths = [get_media_duration(video_file) for video_file in video_files]
+    if any(length is None for length in video_lengths):
+        return None
+    base_name = os.path.splitext(output_file)[0]
+    temp_files = []
+    level = 0
+    begin = time.time()
+    while len(video_files) > group_size:
+        groups = [(video_files[i:i + group_size], video_lengths[i:i + group_size])
+                  for i in range(0, len(video_files), group_size)]
+        group_files = [f"{base_name}.level{level}_{i}.mp4" for i in range(len(groups))]
+        workers = get_normalize_workers(len(groups))
+        threads = get_ffmpeg_threads(workers)
+
+        def render_group(i):
+            group_videos, group_lengths = groups[i]
+            if len(group_videos) == 1:
+                return group_videos[0]
+            command = build_transition_command(group_videos, group_lengths, transition_type, transition_value,
+                                               transition_duration, encode_profile, group_files[i], with_audio,
+                                               threads)
+            print(" ".join(command))
+            group_begin = time.time()
+            subprocess.run(command, check=True, capture_output=True)
+            print(f"transition group level {level} #{i}: {len(group_videos)} clips in {time.time() - group_begin:.2f}s")
+            return group_files[i]
+
+        video_files = run_in_pool(render_group, range(len(groups)), workers)
+        video_lengths = [sum(group_lengths) - transition_duration * (len(group_lengths) - 1)
+                         for _, group_lengths in groups]
+        temp_files += [group_file for group_file in group_files if group_file in video_files]
+        level += 1
+
+    command = build_transition_command(video_files, video_lengths, transition_type, transition_value,
+                                       transition_duration, encode_profile, output_file, with_audio)
+    print(" ".join(command))
+    subprocess.run(command, check=True, capture_output=True)
+    for temp_file in temp_files:
+        os.remove(temp_file)
+    print(f"grouped transition render finished in {time.time() - begin:.2f}s")
+    return output_file
@@ -21,11 +21,8 @@
 #
 #
 
-import itertools
-import math
 import os
 import random
-import re
 import subprocess
 import tempfile
 from typing import List
@@ -34,10 +31,21 @@ import requests
 
 from PIL import Image
 
-from services.video.texiao_service import gen_filter
+from services.video.clip_cache import get_clip_cache, normalize_with_cache
+from services.video.encode_profile import get_encode_profile
+from services.video.parallel_service import get_normalize_workers, get_ffmpeg_threads, run_in_pool, get_video_config
+from services.video.probe_service import probe_media, get_keyframe_times, get_copy_start, can_stream_copy_all
+from services.video.proxy_service import get_proxy_files, save_edl
+from services.video.render_graph_service import render_single_pass
+from services.video.timeline import ClipSpec, choose_window_start, is_image_media
+from services.video.transition_service import is_overlap_transition, get_transition_keyframe_args, \
+    render_overlap_transitions, get_transition_group_size, render_grouped_transitions, build_transition_command
+from tools.audio_engine import mix_background_music
+from tools.cache_utils import file_content_hash, hash_key
 from tools.file_utils import generate_temp_filename
 from tools.tr_utils import tr
 from tools.utils import random_with_system_time, run_ffmpeg_command, extent_audio
+from tools.wav_utils import get_wav_duration
 
 # 获取当前脚本的绝对路径
 script_path = os.path.abspath(__file__)
@@ -61,79 +69,37 @@ def get_audio_duration(audio_file):
     """
     获取音频文件的时长（秒）
     :param audio_file: 音频文件路径
-    :return: 音频时长（秒），如果失败则返回None
+    :return: 音频时长（秒，浮点数），如果失败则返回None
     """
-    # 使用ffmpeg命令获取音频信息
-    cmd = ['ffmpeg', '-i', audio_file]
-    print(" ".join(cmd))
-    result = subprocess.run(cmd, capture_output=True)
-
-    # 解析输出，找到时长信息
-    duration_search = re.search(
-        r'Duration: (?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+)\.(?P<milliseconds>\d+)',
-        result.stderr.decode('utf-8'))
-    if duration_search:
-        hours = int(duration_search.group('hours'))
-        minutes = int(duration_search.group('minutes'))
-        seconds = int(duration_search.group('seconds'))
-        total_seconds = hours * 3600 + minutes * 60 + seconds
-        print("音频时长:", total_seconds)
-        return total_seconds
-    else:
-        print(f"无法从输出中获取音频时长: {result.stderr.decode('utf-8')}")
-        return None
+    # wav直接解析文件头，得到精确到采样点的时长
+    total_seconds = get_wav_duration(audio_file) if os.path.exists(audio_file) else None
+    if total_seconds is None:
+        # 压缩格式使用ffprobe
+        media_info = probe_media(audio_file)
+        if media_info is None or media_info.duration is None:
+            print(f"无法获取音频时长: {audio_file}")
+            return None
+        total_seconds = media_info.duration
+    print("音频时长:", total_seconds)
+    return total_seconds
 
 
 def get_video_fps(video_path):
-    # ffprobe 命令，用于获取视频的帧率
-    ffprobe_cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-select_streams', 'v:0',
-        '-show_entries', 'stream=r_frame_rate',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        video_path
-    ]
-    print(" ".join(ffprobe_cmd))
-
-    try:
-        # 运行 ffprobe 命令并捕获输出
-        result = subprocess.run(ffprobe_cmd, capture_output=True)
-        stdout = result.stdout.decode('gbk', errors='ignore')
-        stderr = result.stderr.decode('gbk', errors='ignore')
-
-        # 检查命令是否成功执行
-        if result.returncode != 0:
-            print(f"Error running ffprobe: {result.stderr}")
-            return None
-
-        # 解析输出以获取帧率
-        output = result.stdout.strip()
-        if '/' in output:
-            numerator, denominator = map(int, output.split('/'))
-            fps = float(numerator) / float(denominator)
-        else:
-            fps = float(output)
-        print("视频fps:", fps)
-        return fps
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    media_info = probe_media(video_path)
+    if media_info is None or media_info.fps is None:
+        print(f"无法获取视频帧率: {video_path}")
         return None
+    print("视频fps:", media_info.fps)
+    return media_info.fps
 
 
 def get_video_info(video_file):
-    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height', '-of',
-               'default=noprint_wrappers=1:nokey=1', video_file]
-    print(" ".join(command))
-    result = subprocess.run(command, capture_output=True)
-
-    # 解析输出以获取宽度和高度
-    output = result.stdout.decode('utf-8')
-    # print("output is:",output)
-    width_height = output.split('\n')
-    width = int(width_height[0])
-    height = int(width_height[1])
-
+    media_info = probe_media(video_file)
+    if media_info is None or media_info.width is None or media_info.height is None:
+        print(f"无法获取视频分辨率: {video_file}")
+        return None
+    width = media_info.width
+    height = media_info.height
     print(f'Width: {width}, Height: {height}')
     return width, height
 
@@ -184,22 +150,12 @@ def get_image_info(image_file):
 
 
 def get_video_duration(video_file):
-    # 构建FFmpeg命令来获取视频时长
-    command = ['ffprobe', '-i', video_file, '-show_entries', 'format=duration']
-    # 执行命令并捕获输出
-    print(" ".join(command))
-    result = subprocess.run(command, capture_output=True)
-    output = result.stdout.decode('utf-8')
-
-    # 使用正则表达式从输出中提取时长
-    duration_match = re.search(r'duration=(\d+\.\d+)', output)
-    if duration_match:
-        duration = float(duration_match.group(1))
-        print("视频时长:", duration)
-        return duration
-    else:
-        print(f"无法从输出中提取视频时长: {output}")
+    media_info = probe_media(video_file)
+    if media_info is None or media_info.duration is None:
+        print(f"无法获取视频时长: {video_file}")
         return None
+    print("视频时长:", media_info.duration)
+    return media_info.duration
 
 
 def get_video_length_list(video_list):
@@ -210,7 +166,9 @@ def get_video_length_list(video_list):
     return video_length_list
 
 
-def add_music(video_file, audio_file):
+def add_music(video_file, audio_file, encode_profile=None):
+    if encode_profile is None:
+        encode_profile = get_encode_profile()
     output_file = generate_temp_filename(video_file)
     # 构造ffmpeg命令
     ffmpeg_cmd = [
@@ -218,8 +176,7 @@ def add_music(video_file, audio_file):
         '-i', video_file,  # 输入视频文件
         '-i', audio_file,  # 输入音频文件
         '-c:v', 'copy',  # 复制视频流编码
-        '-c:a', 'aac',  # 使用AAC编码音频流
-        '-strict', 'experimental',  # 有时可能需要这个选项来启用AAC编码
+        *encode_profile.audio_args(),  # 使用AAC编码音频流，码率和编码profile一致
         '-map', '0:v:0',  # 选择第一个输入文件的视频流
         '-map', '1:a:0',  # 选择第二个输入文件的音频流
         '-shortest',
@@ -236,7 +193,9 @@ def add_music(video_file, audio_file):
         os.renames(output_file, video_file)
 
 
-def add_background_music(video_file, audio_file, bgm_volume=0.5):
+def add_background_music(video_file, audio_file, bgm_volume=0.5, encode_profile=None):
+    if encode_profile is None:
+        encode_profile = get_encode_profile()
     output_file = generate_temp_filename(video_file)
     # 构建FFmpeg命令
     command = [
@@ -249,6 +208,7 @@ def add_background_music(video_file, audio_file, bgm_volume=0.5):
         '-map', '0:v',  # 选择视频流
         '-map', '[a]',  # 选择混合后的音频流
         '-c:v', 'copy',  # 复制视频流
+        *encode_profile.audio_args(),
         '-shortest',  # 输出时长与最短的输入流相同
         output_file  # 输出文件
     ]
@@ -318,7 +278,8 @@ class VideoMixService:
             # 如果总时长超过音频时长，需要调整音频
             if total_length > audio_duration:
                 extend_length = total_length - audio_duration
-                extend_length = int(math.ceil(extend_length))
+                # 精确补齐差值，避免取整后每个场景的音视频越差越多
+                extend_length = round(extend_length, 3)
                 if extend_length > 0:
                     extent_audio(audio_file, extend_length)
             
@@ -362,7 +323,8 @@ class VideoMixService:
             if total_length > audio_duration:
                 # 计算需要延长的时长（负数表示需要缩短，但这里我们延长音频来匹配）
                 extend_length = total_length - audio_duration
-                extend_length = int(math.ceil(extend_length))
+                # 精确补齐差值，避免取整后每个场景的音视频越差越多
+                extend_length = round(extend_length, 3)
                 if extend_length > 0:
                     extent_audio(audio_file, extend_length)
             
@@ -418,28 +380,32 @@ class VideoMixService:
                 matching_videos.append(video_file)
                 i = i + 1
             else:
-                extend_length = audio_duration - total_length
-                extend_length = int(math.ceil(extend_length))
-                if extend_length > 0:
-                    extent_audio(audio_file, extend_length)
                 break
         print("total length:", total_length, "audio length:", audio_duration)
         if total_length < audio_duration:
             st.toast(tr("You Need More Resource"), icon="⚠️")
             st.stop()
+        # 精确补齐差值，避免取整后每个场景的音视频越差越多
+        extend_length = round(total_length - audio_duration, 3)
+        if extend_length > 0:
+            extent_audio(audio_file, extend_length)
         return matching_videos, total_length
 
 
 class VideoService:
-    def __init__(self, video_list, audio_file):
+    def __init__(self, video_list, audio_file, proxy=False):
         self.video_list = video_list
         self.audio_file = audio_file
+        # 预览模式使用代理素材和draft编码
+        self.proxy = proxy
+        self.timeline = None
         self.fps = st.session_state["video_fps"]
         self.seg_min_duration = st.session_state["video_segment_min_length"]
         self.seg_max_duration = st.session_state["video_segment_max_length"]
         self.target_width, self.target_height = st.session_state["video_size"].split('x')
-        self.target_width = int(self.target_width)
-        self.target_height = int(self.target_height)
+        self.encode_profile = get_encode_profile('draft' if proxy else None)
+        self.target_width, self.target_height = self.encode_profile.scale_size(int(self.target_width),
+                                                                               int(self.target_height))
 
         self.enable_background_music = st.session_state["enable_background_music"]
         self.background_music = st.session_state["background_music"]
@@ -449,168 +415,148 @@ class VideoService:
         self.video_transition_effect_duration = st.session_state["video_transition_effect_duration"]
         self.video_transition_effect_type = st.session_state["video_transition_effect_type"]
         self.video_transition_effect_value = st.session_state["video_transition_effect_value"]
+        # 只重新编码转场重叠部分时，归一化需要在转场边界插入关键帧
+        self.overlap_transition = self.enable_video_transition_effect and is_overlap_transition()
+        # 时间线上所有片段都能直接复制时才复制，在normalize_video中确定
+        self.stream_copy = False
         self.default_duration = DEFAULT_DURATION
         if DEFAULT_DURATION < self.seg_min_duration:
             self.default_duration = self.seg_min_duration
 
     def normalize_video(self):
-        return_video_list = []
-        for media_file in self.video_list:
-            # 如果当前文件是图片，添加转换为视频的命令
-            if media_file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                output_name = generate_temp_filename(media_file, ".mp4", work_output_dir)
-                # 判断图片的纵横比和
-                img_width, img_height = get_image_info(media_file)
-                if img_width / img_height > self.target_width / self.target_height:
-                    # 转换图片为视频片段 图片的视频帧率必须要跟视频的帧率一样，否则可能在最后的合并过程中导致 合并过后的视频过长
-                    # ffmpeg_cmd = f"ffmpeg -loop 1 -i '{media_file}' -c:v h264 -t {self.default_duration} -r {self.fps} -vf 'scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2' -y {output_name}"
-                    ffmpeg_cmd = [
-                        'ffmpeg',
-                        '-loop', '1',
-                        '-i', media_file,
-                        '-c:v', 'h264',
-                        '-t', str(self.default_duration),
-                        '-r', str(self.fps),
-                        '-vf',
-                        f'scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                        '-y', output_name]
-                else:
-                    # ffmpeg_cmd = f"ffmpeg -loop 1 -i '{media_file}' -c:v h264 -t {self.default_duration} -r {self.fps} -vf 'scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2' -y {output_name}"
-                    ffmpeg_cmd = [
-                        'ffmpeg',
-                        '-loop', '1',
-                        '-i', media_file,
-                        '-c:v', 'h264',
-                        '-t', str(self.default_duration),
-                        '-r', str(self.fps),
-                        '-vf',
-                        f'scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                        '-y', output_name]
-                print(" ".join(ffmpeg_cmd))
-                subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
-                return_video_list.append(output_name)
-
-            else:
-                # 当前文件是视频文件
-                video_duration = get_video_duration(media_file)
-                video_width, video_height = get_video_info(media_file)
-                output_name = generate_temp_filename(media_file, new_directory=work_output_dir)
-                if self.seg_min_duration > video_duration:
-                    # 需要扩展视频
-                    stretch_factor = float(self.seg_min_duration) / float(video_duration)  # 拉长比例
-                    # 构建FFmpeg命令
-                    if video_width / video_height > self.target_width / self.target_height:
-                        command = [
-                            'ffmpeg',
-                            '-i', media_file,  # 输入文件
-                            '-r', str(self.fps),  # 设置帧率
-                            '-an',  # 去除音频
-                            '-vf',
-                            f"setpts={stretch_factor}*PTS,scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
-                            # 调整时间戳滤镜
-                            # '-vf', f'scale=-1:{self.target_height}:force_original_aspect_ratio=1',  # 设置视频滤镜来调整分辨率
-                            # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                            # '-af', f'atempo={1 / stretch_factor}',  # 调整音频速度以匹配视频
-                            '-y',
-                            output_name  # 输出文件
-                        ]
-                    else:
-                        command = [
-                            'ffmpeg',
-                            '-i', media_file,  # 输入文件
-                            '-r', str(self.fps),  # 设置帧率
-                            '-an',  # 去除音频
-                            '-vf',
-                            f"setpts={stretch_factor}*PTS,scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
-                            # 调整时间戳滤镜
-                            # '-vf', f'scale={self.target_width}:-1:force_original_aspect_ratio=1',  # 设置视频滤镜来调整分辨率
-                            # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                            # '-af', f'atempo={1 / stretch_factor}',  # 调整音频速度以匹配视频
-                            '-y',
-                            output_name  # 输出文件
-                        ]
-                    # 执行FFmpeg命令
-                    print(" ".join(command))
-                    run_ffmpeg_command(command)
-                elif self.seg_max_duration < video_duration:
-                    # 需要裁减视频
-                    if video_width / video_height > self.target_width / self.target_height:
-                        cmd = [
-                            'ffmpeg',
-                            '-i', media_file,
-                            '-r', str(self.fps),  # 设置帧率
-                            '-an',  # 去除音频
-                            # '-ss', '00:00:00',
-                            '-t', str(self.seg_max_duration),
-                            # '-c', 'copy',
-                            # '-vcodec', 'copy',
-                            # '-acodec', 'copy',
-                            '-vf',
-                            f"scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
-                            # 设置视频滤镜来调整分辨率
-                            # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                            '-y',
-                            output_name
-                        ]
-                    else:
-                        cmd = [
-                            'ffmpeg',
-                            '-i', media_file,
-                            '-r', str(self.fps),  # 设置帧率
-                            '-an',  # 去除音频
-                            # '-ss', '00:00:00',
-                            '-t', str(self.seg_max_duration),
-                            # '-c', 'copy',
-                            # '-vcodec', 'copy',
-                            # '-acodec', 'copy',
-                            '-vf',
-                            f"scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
-                            # 设置视频滤镜来调整分辨率
-                            # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                            '-y',
-                            output_name
-                        ]
-                    print(" ".join(cmd))
-                    run_ffmpeg_command(cmd)
-                else:
-                    # 不需要拉伸也不需要裁剪，只需要调整分辨率和fps
-                    if video_width / video_height > self.target_width / self.target_height:
-                        command = [
-                            'ffmpeg',
-                            '-i', media_file,  # 输入文件
-                            '-r', str(self.fps),  # 设置帧率
-                            '-an',  # 去除音频
-                            '-vf',
-                            f"scale=-1:{self.target_height}:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
-                            # 设置视频滤镜来调整分辨率
-                            # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                            '-y',
-                            output_name  # 输出文件
-                        ]
-                    else:
-                        command = [
-                            'ffmpeg',
-                            '-i', media_file,  # 输入文件
-                            '-r', str(self.fps),  # 设置帧率
-                            '-an',  # 去除音频
-                            '-vf',
-                            f"scale={self.target_width}:-1:force_original_aspect_ratio=1,crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2",
-                            # 设置视频滤镜来调整分辨率
-                            # '-vf', f'crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2',
-                            '-y',
-                            output_name  # 输出文件
-                        ]
-                    # 执行FFmpeg命令
-                    print(" ".join(command))
-                    run_ffmpeg_command(command)
-                # 重命名最终的文件
-                # if os.path.exists(output_name):
-                #     os.remove(media_file)
-                #     os.renames(output_name, media_file)
-                return_video_list.append(output_name)
+        # 同一个片段只需要编码一次，输出文件名由片段的key决定，不同片段不会同时写同一个文件
+        clip_specs = self.get_render_timeline()
+        unique_specs = list({clip_spec.key(): clip_spec for clip_spec in clip_specs}.values())
+        self.stream_copy = self.can_stream_copy(unique_specs)
+        workers = get_normalize_workers(len(unique_specs))
+        threads = get_ffmpeg_threads(workers)
+        print(f"normalize video with {workers} workers, {threads} threads per ffmpeg")
+        output_names = run_in_pool(lambda clip_spec: self.normalize_one_cached(clip_spec, threads),
+                                   unique_specs, workers)
+        output_map = {clip_spec.key(): output_name for clip_spec, output_name in zip(unique_specs, output_names)}
+        return_video_list = [output_map[clip_spec.key()] for clip_spec in clip_specs]
+        clip_cache = get_clip_cache()
+        if clip_cache is not None:
+            print("clip cache stats:", clip_cache.stats())
         self.video_list = return_video_list
         return return_video_list
 
+    def get_output_name(self, clip_spec):
+        # 不同目录下的同名素材、同一个素材的不同截取位置和时长都对应不同的文件，文件名里带上片段key的hash
+        clip_hash = "." + hash_key(*clip_spec.key())[:10]
+        if clip_spec.is_image:
+            return generate_temp_filename(clip_spec.source, clip_hash + ".mp4", work_output_dir)
+        ext = os.path.splitext(clip_spec.source)[1]
+        return generate_temp_filename(clip_spec.source, clip_hash + ext, work_output_dir)
+
+    def normalize_one_cached(self, clip_spec, threads=1):
+        # 影响归一化结果的参数都要放到缓存key里
+        params = ('mix', self.target_width, self.target_height, self.fps, str(self.encode_profile),
+                  clip_spec.start, clip_spec.duration, clip_spec.stretch_factor)
+        if self.stream_copy:
+            params += ('copy',)
+        if self.overlap_transition:
+            params += ('keyframes', self.video_transition_effect_duration)
+        return normalize_with_cache(clip_spec.source, self.get_output_name(clip_spec), params,
+                                    lambda: self.normalize_one(clip_spec, threads))
+
+    def get_keyframe_args(self, duration):
+        if not self.overlap_transition:
+            return []
+        return get_transition_keyframe_args(duration, self.video_transition_effect_duration)
+
+    def get_scale_filter(self, width, height):
+        # 按纵横比先缩放再居中裁剪到目标分辨率
+        if width / height > self.target_width / self.target_height:
+            scale = f"scale=-1:{self.target_height}:force_original_aspect_ratio=1"
+        else:
+            scale = f"scale={self.target_width}:-1:force_original_aspect_ratio=1"
+        return f"{scale},crop={self.target_width}:{self.target_height}:(ow-iw)/2:(oh-ih)/2"
+
+    def can_stream_copy(self, clip_specs):
+        """
+        直接复制的片段和重新编码的片段不能拼接在一起，所有片段都能直接复制时才复制
+        直接复制的片段没有转场需要的关键帧，重叠转场模式下重新编码
+        """
+        if not get_video_config().get('stream_copy', True) or self.overlap_transition:
+            return False
+        for clip_spec in clip_specs:
+            if clip_spec.is_image or clip_spec.stretch_factor != 1.0:
+                return False
+            if get_copy_start(clip_spec.source, clip_spec.start) is None:
+                return False
+        return can_stream_copy_all([clip_spec.source for clip_spec in clip_specs],
+                                   self.target_width, self.target_height, self.fps)
+
+    def normalize_one(self, clip_spec, threads=1):
+        output_name = self.get_output_name(clip_spec)
+        media_file = clip_spec.source
+        # 如果当前文件是图片，添加转换为视频的命令
+        if clip_spec.is_image:
+            img_width, img_height = get_image_info(media_file)
+            # 转换图片为视频片段 图片的视频帧率必须要跟视频的帧率一样，否则可能在最后的合并过程中导致 合并过后的视频过长
+            ffmpeg_cmd = [
+                'ffmpeg',
+                '-loop', '1',
+                '-i', media_file,
+                *self.encode_profile.video_args(threads),
+                '-t', str(clip_spec.duration),
+                '-r', str(self.fps),
+                '-vf', self.get_scale_filter(img_width, img_height),
+                *self.get_keyframe_args(clip_spec.duration),
+                '-y', output_name]
+            print(" ".join(ffmpeg_cmd))
+            subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+            return output_name
+
+        if self.stream_copy:
+            copy_start = get_copy_start(media_file, clip_spec.start)
+            if copy_start is not None:
+                # 素材已经是目标格式，从关键帧开始直接复制视频流
+                seek = ['-ss', str(copy_start)] if copy_start > 0 else []
+                command = [
+                    'ffmpeg',
+                    *seek,
+                    '-t', str(clip_spec.duration),
+                    '-i', media_file,
+                    '-map', '0:v:0',
+                    '-c', 'copy',
+                    '-an',
+                    '-avoid_negative_ts', 'make_zero',
+                    '-y',
+                    output_name
+                ]
+                print(" ".join(command))
+                run_ffmpeg_command(command)
+                return output_name
+
+        # 当前文件是视频文件，-ss和-t放在-i前面，只解码需要的那一段
+        video_info = get_video_info(media_file)
+        if video_info is None:
+            raise Exception(f"无法获取视频分辨率，请检查素材文件: {media_file}")
+        video_width, video_height = video_info
+        video_filter = self.get_scale_filter(video_width, video_height)
+        if clip_spec.stretch_factor != 1.0:
+            # 需要扩展视频
+            video_filter = f"setpts={clip_spec.stretch_factor}*PTS," + video_filter
+        seek = ['-ss', str(clip_spec.start)] if clip_spec.start > 0 else []
+        command = [
+            'ffmpeg',
+            *seek,
+            '-t', str(clip_spec.source_duration),
+            '-i', media_file,  # 输入文件
+            '-r', str(self.fps),  # 设置帧率
+            '-an',  # 去除音频
+            '-vf', video_filter,
+            *self.encode_profile.video_args(threads),
+            *self.get_keyframe_args(clip_spec.duration),
+            '-y',
+            output_name  # 输出文件
+        ]
+        print(" ".join(command))
+        run_ffmpeg_command(command)
+        return output_name
+
     def generate_video_with_audio(self):
         # 生成视频和音频的代码
         random_name = str(random_with_system_time())
@@ -634,32 +580,117 @@ class VideoService:
                              merge_video]
 
         # 是否需要转场特效
-        if self.enable_video_transition_effect and len(self.video_list) > 1:
-            video_length_list = get_video_length_list(self.video_list)
+        if self.overlap_transition and len(self.video_list) > 1 and render_overlap_transitions(
+                self.video_list, self.video_transition_effect_type, self.video_transition_effect_value,
+                self.video_transition_effect_duration, self.encode_profile, merge_video) is not None:
+            print("启动转场特效，只编码转场部分")
+            ffmpeg_concat_cmd = None
+        elif self.enable_video_transition_effect and len(self.video_list) > 1:
             print("启动转场特效")
-            zhuanchang_txt = gen_filter(video_length_list, None, None,
-                                        self.video_transition_effect_type,
-                                        self.video_transition_effect_value,
-                                        self.video_transition_effect_duration,
-                                        False)
-
-            # File inputs from the list
-            files_input = [['-i', f] for f in self.video_list]
-            ffmpeg_concat_cmd = ['ffmpeg', *itertools.chain(*files_input),
-                                 '-filter_complex', zhuanchang_txt,
-                                 '-map', '[video]',
-                                 # '-map', '[audio]',
-                                 '-y',
-                                 merge_video]
-
-        subprocess.run(ffmpeg_concat_cmd)
+            group_size = get_transition_group_size()
+            # 片段很多时分组并行渲染，避免一个ffmpeg打开太多文件，有片段获取不到时长时一次渲染所有片段
+            if group_size and len(self.video_list) > group_size and render_grouped_transitions(
+                    self.video_list, self.video_transition_effect_type, self.video_transition_effect_value,
+                    self.video_transition_effect_duration, self.encode_profile, merge_video,
+                    group_size=group_size) is not None:
+                ffmpeg_concat_cmd = None
+            else:
+                video_length_list = get_video_length_list(self.video_list)
+                ffmpeg_concat_cmd = build_transition_command(self.video_list, video_length_list,
+                                                             self.video_transition_effect_type,
+                                                             self.video_transition_effect_value,
+                                                             self.video_transition_effect_duration,
+                                                             self.encode_profile, merge_video)
+
+        if ffmpeg_concat_cmd is not None:
+            subprocess.run(ffmpeg_concat_cmd)
         # 删除临时文件
         os.remove(temp_video_filelist_path)
 
-        # 拼接音频
-        add_music(merge_video, self.audio_file)
-
-        # 添加背景音乐
+        # 添加背景音乐，在内存中和配音混合成一个音轨，只需要合并一次音视频
         if self.enable_background_music:
-            add_background_music(merge_video, self.background_music, self.background_music_volume)
+            mixed_audio_file = generate_temp_filename(self.audio_file, ".mix.wav", work_output_dir)
+            mix_background_music(self.audio_file, self.background_music, self.background_music_volume,
+                                 mixed_audio_file)
+            add_music(merge_video, mixed_audio_file, self.encode_profile)
+            os.remove(mixed_audio_file)
+        else:
+            # 拼接音频
+            add_music(merge_video, self.audio_file, self.encode_profile)
+        return merge_video
+
+    def plan_clip(self, media_file):
+        # 按照归一化的规则计算片段在时间线上的起点和时长
+        if is_image_media(media_file):
+            return ClipSpec(media_file, self.default_duration)
+        video_duration = get_video_duration(media_file)
+        if self.seg_min_duration > video_duration:
+            return ClipSpec(media_file, self.seg_min_duration,
+                            stretch_factor=float(self.seg_min_duration) / float(video_duration))
+        if self.seg_max_duration < video_duration:
+            # 长素材只截取其中的一段
+            mode = get_video_config().get('trim_window', 'random')
+            keyframe_times = get_keyframe_times(media_file) if mode == 'keyframe' else None
+            # 按素材内容确定截取位置，同一个素材每次截取同一段，可以命中归一化片段的缓存
+            seed = file_content_hash(media_file) if os.path.isfile(media_file) else media_file
+            start = choose_window_start(video_duration, self.seg_max_duration, mode, keyframe_times, seed)
+            return ClipSpec(media_file, self.seg_max_duration, start=start)
+        return ClipSpec(media_file, video_duration)
+
+    def plan_timeline(self):
+        """
+        生成时间线，video_list里可以直接放ClipSpec来指定入点和时长
+        同一个素材在一条时间线里只选一次截取位置
+        """
+        if self.timeline is not None:
+            return self.timeline
+        planned = {}
+        clip_specs = []
+        for item in self.video_list:
+            if isinstance(item, ClipSpec):
+                clip_specs.append(item)
+                continue
+            if item not in planned:
+                planned[item] = self.plan_clip(item)
+            clip_specs.append(planned[item])
+        self.timeline = clip_specs
+        return clip_specs
+
+    def get_render_timeline(self):
+        # 预览模式把时间线上的素材替换成代理文件，起点和时长不变
+        clip_specs = self.plan_timeline()
+        if not self.proxy:
+            return clip_specs
+        proxy_map = get_proxy_files([clip_spec.source for clip_spec in clip_specs])
+        return [ClipSpec(proxy_map[clip_spec.source], clip_spec.duration, start=clip_spec.start,
+                         stretch_factor=clip_spec.stretch_factor) for clip_spec in clip_specs]
+
+    def save_edl(self, video_file, subtitle_file=None):
+        # 保存剪辑决定，之后可以不重新配音、识别和选素材，直接用原始素材生成正式视频
+        return save_edl(video_file, {
+            "type": "video",
+            "clips": [clip_spec.to_dict() for clip_spec in self.plan_timeline()],
+            "audio_file": self.audio_file,
+            "subtitle_file": subtitle_file,
+        })
+
+    def generate_video_single_pass(self, subtitle_filter=None):
+        """
+        直接使用原始素材，一次编码生成带配音、背景音乐和字幕的最终视频，不需要先调用normalize_video
+        """
+        random_name = str(random_with_system_time())
+        merge_video = os.path.join(video_output_dir, "final-" + random_name + ".mp4")
+        clip_specs = self.get_render_timeline()
+        transition = None
+        if self.enable_video_transition_effect:
+            transition = (self.video_transition_effect_type,
+                          self.video_transition_effect_value,
+                          self.video_transition_effect_duration)
+        render_single_pass(clip_specs, self.audio_file, merge_video,
+                           self.target_width, self.target_height, self.fps,
+                           transition=transition,
+                           background_music=self.background_music if self.enable_background_music else None,
+                           bgm_volume=self.background_music_volume,
+                           subtitle_filter=subtitle_filter,
+                           encode_profile=self.encode_profile)
         return merge_video
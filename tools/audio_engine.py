@@ -0,0 +1,271 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import os
+import subprocess
+import wave
+
+import numpy as np
+
+from tools.wav_utils import read_wav_info, WAVE_FORMAT_IEEE_FLOAT
+
+
+class AudioTrack:
+    """
+    内存中的一段音频，samples是 (帧数, 声道数) 的float32数组，取值范围[-1, 1]
+    """
+
+    def __init__(self, samples, sample_rate):
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def frame_count(self):
+        return self.samples.shape[0]
+
+    @property
+    def duration(self):
+        return self.frame_count / float(self.sample_rate)
+
+    def __str__(self):
+        return f"channels={self.channels} sample_rate={self.sample_rate} duration={self.duration}"
+
+
+# 每次转换的采样数，转换时只需要额外一块的内存
+CONVERT_BLOCK_SAMPLES = 1 << 20
+
+
+def get_pcm_dtype(wav_info):
+    # 每个采样在文件里的类型和字节数，24bit按3个字节读取
+    bits = wav_info.bits_per_sample
+    if wav_info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        return ('<f4', 4) if bits == 32 else ('<f8', 8)
+    if bits == 8:
+        return np.uint8, 1
+    if bits == 16:
+        return '<i2', 2
+    if bits == 24:
+        return np.uint8, 3
+    if bits == 32:
+        return '<i4', 4
+    return None, 0
+
+
+def convert_pcm_block(raw, wav_info):
+    # 一块PCM数据转换成[-1, 1]的float32
+    bits = wav_info.bits_per_sample
+    if wav_info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        return raw.astype(np.float32)
+    if bits == 8:
+        return (raw.astype(np.float32) - 128.0) / 128.0
+    if bits == 16:
+        return raw.astype(np.float32) / 32768.0
+    if bits == 24:
+        raw = raw.reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        values = np.where(values >= 1 << 23, values - (1 << 24), values)
+        return values.astype(np.float32) / float(1 << 23)
+    return raw.astype(np.float32) / float(1 << 31)
+
+
+def map_wav_samples(wav_file, wav_info):
+    """
+    使用memmap读取PCM数据，分块转换成float32写到结果数组里
+    除了结果本身，只需要一块数据的内存，不会把整个文件的原始数据和中间结果同时放在内存里
+    """
+    dtype, sample_size = get_pcm_dtype(wav_info)
+    if dtype is None:
+        return None
+    sample_count = wav_info.frame_count * wav_info.channels
+    samples = np.empty(sample_count, dtype=np.float32)
+    if sample_count == 0:
+        return samples.reshape(-1, wav_info.channels)
+    # 24bit按字节映射，每个采样占3个元素
+    item_count = sample_size // np.dtype(dtype).itemsize
+    raw = np.memmap(wav_file, dtype=dtype, mode='r', offset=wav_info.data_offset,
+                    shape=(sample_count * item_count,))
+    for begin in range(0, sample_count, CONVERT_BLOCK_SAMPLES):
+        end = min(begin + CONVERT_BLOCK_SAMPLES, sample_count)
+        samples[begin:end] = convert_pcm_block(raw[begin * item_count:end * item_count], wav_info)
+    del raw
+    return samples.reshape(-1, wav_info.channels)
+
+
+def decode_audio(audio_file, sample_rate, channels):
+    # 不是wav或者采样率不一致时，用ffmpeg解码成float32直接从管道读取，不生成临时文件
+    command = ['ffmpeg', '-v', 'error', '-i', audio_file, '-vn', '-f', 'f32le', '-acodec', 'pcm_f32le',
+               '-ar', str(sample_rate), '-ac', str(channels), '-']
+    result = subprocess.run(command, capture_output=True, check=True)
+    samples = np.frombuffer(result.stdout, dtype='<f4').reshape(-1, channels)
+    return AudioTrack(samples, sample_rate)
+
+
+def load_audio(audio_file, sample_rate=None, channels=None):
+    """
+    读取音频，wav直接解析，其他格式或者需要重采样时使用ffmpeg解码
+    :param sample_rate: 需要的采样率，None表示使用文件本身的采样率
+    :param channels: 需要的声道数，None表示使用文件本身的声道数
+    """
+    wav_info = read_wav_info(audio_file)
+    if wav_info is not None and (sample_rate is None or sample_rate == wav_info.sample_rate):
+        samples = map_wav_samples(audio_file, wav_info)
+        if samples is not None:
+            return convert_channels(AudioTrack(samples, wav_info.sample_rate), channels)
+    if sample_rate is None:
+        sample_rate = 44100
+    if channels is None:
+        channels = wav_info.channels if wav_info is not None else 2
+    return decode_audio(audio_file, sample_rate, channels)
+
+
+def convert_channels(track, channels):
+    if channels is None or channels == track.channels:
+        return track
+    if channels == 1:
+        return AudioTrack(track.samples.mean(axis=1, keepdims=True), track.sample_rate)
+    if track.channels == 1:
+        return AudioTrack(np.repeat(track.samples, channels, axis=1), track.sample_rate)
+    return AudioTrack(track.samples[:, :channels], track.sample_rate)
+
+
+def pad(track, seconds):
+    # 在结尾补静音
+    pad_frames = int(round(seconds * track.sample_rate))
+    if pad_frames <= 0:
+        return track
+    silence = np.zeros((pad_frames, track.channels), dtype=np.float32)
+    return AudioTrack(np.concatenate([track.samples, silence]), track.sample_rate)
+
+
+def find_trim_range(track, threshold=0.01, keep=0.05):
+    """
+    找到去掉首尾静音后保留的帧范围 (start, end)，全是静音时返回整段
+    :param threshold: 振幅小于threshold的帧认为是静音
+    """
+    loud = np.nonzero(np.abs(track.samples).max(axis=1) > threshold)[0]
+    if len(loud) == 0:
+        return 0, track.frame_count
+    keep_frames = int(round(keep * track.sample_rate))
+    start = max(loud[0] - keep_frames, 0)
+    end = min(loud[-1] + 1 + keep_frames, track.frame_count)
+    return start, end
+
+
+def trim_silence(track, threshold=0.01, keep=0.05):
+    """
+    去掉开头和结尾的静音，前后各保留keep秒
+    :param threshold: 振幅小于threshold的帧认为是静音
+    """
+    start, end = find_trim_range(track, threshold, keep)
+    return AudioTrack(track.samples[start:end], track.sample_rate)
+
+
+def concat(tracks, crossfade=0.0):
+    """
+    拼接多段音频，crossfade大于0时相邻两段按线性淡入淡出重叠crossfade秒
+    所有音频的采样率和声道数需要一致
+    """
+    if not tracks:
+        return None
+    sample_rate = tracks[0].sample_rate
+    fade_frames = int(round(crossfade * sample_rate))
+    if fade_frames <= 0:
+        return AudioTrack(np.concatenate([track.samples for track in tracks]), sample_rate)
+    result = np.array(tracks[0].samples, dtype=np.float32)
+    for track in tracks[1:]:
+        overlap = min(fade_frames, len(result), track.frame_count)
+        fade_out = np.linspace(1.0, 0.0, overlap, dtype=np.float32)[:, None]
+        mixed = result[len(result) - overlap:] * fade_out + track.samples[:overlap] * (1.0 - fade_out)
+        result = np.concatenate([result[:len(result) - overlap], mixed, track.samples[overlap:]])
+    return AudioTrack(result, sample_rate)
+
+
+def loop_to_length(track, frame_count):
+    # 背景音乐循环到需要的长度
+    if track.frame_count == 0:
+        return AudioTrack(np.zeros((frame_count, track.channels), dtype=np.float32), track.sample_rate)
+    repeats = -(-frame_count // track.frame_count)
+    return AudioTrack(np.tile(track.samples, (repeats, 1))[:frame_count], track.sample_rate)
+
+
+def mix(tracks, volumes=None, normalize=True):
+    """
+    混合多段音频，长度以第一段为准（和amix的duration=first一致）
+    normalize为True时每路除以路数，和amix默认的行为一致
+    """
+    if volumes is None:
+        volumes = [1.0] * len(tracks)
+    first = tracks[0]
+    result = np.zeros_like(first.samples, dtype=np.float32)
+    for track, volume in zip(tracks, volumes):
+        length = min(first.frame_count, track.frame_count)
+        result[:length] += track.samples[:length] * float(volume)
+    if normalize:
+        result /= len(tracks)
+    return AudioTrack(result, first.sample_rate)
+
+
+def write_wav(track, output_file):
+    # 写成16bit PCM，先写临时文件再替换，可以直接覆盖输入文件
+    pcm = (np.clip(track.samples, -1.0, 1.0) * 32767.0).astype('<i2')
+    temp_file = output_file + ".tmp"
+    with wave.open(temp_file, 'wb') as f:
+        f.setnchannels(track.channels)
+        f.setsampwidth(2)
+        f.setframerate(track.sample_rate)
+        f.writeframes(pcm.tobytes())
+    os.replace(temp_file, output_file)
+    return output_file
+
+
+def pad_audio_file(audio_file, seconds):
+    """
+    wav文件结尾补静音，不是wav文件返回False
+    """
+    wav_info = read_wav_info(audio_file)
+    if wav_info is None:
+        return False
+    track = load_audio(audio_file)
+    write_wav(pad(track, seconds), audio_file)
+    return True
+
+
+def concat_audio_files(audio_files, output_file, crossfade=0.0):
+    # 以第一个文件的格式为准，其他文件转换成相同的采样率和声道数
+    first = load_audio(audio_files[0])
+    tracks = [first] + [load_audio(audio_file, first.sample_rate, first.channels) for audio_file in audio_files[1:]]
+    return write_wav(concat(tracks, crossfade), output_file)
+
+
+def mix_background_music(voice_file, background_music, volume, output_file):
+    """
+    配音和循环的背景音乐混合成一个音轨，长度和配音一致
+    """
+    voice = load_audio(voice_file)
+    bgm = load_audio(background_music, voice.sample_rate, voice.channels)
+    bgm = loop_to_length(bgm, voice.frame_count)
+    return write_wav(mix([voice, bgm], [1.0, volume]), output_file)
@@ -0,0 +1,255 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows没有fcntl，使用msvcrt加锁
+    fcntl = None
+    import msvcrt
+
+# 获取当前脚本的绝对路径
+script_path = os.path.abspath(__file__)
+
+# 脚本所在的目录
+script_dir = os.path.dirname(script_path)
+
+# cache目录
+cache_root_dir = os.path.join(script_dir, "../cache")
+cache_root_dir = os.path.abspath(cache_root_dir)
+
+_file_hash_memo = {}
+_file_hash_lock = threading.Lock()
+
+
+def file_content_hash(file_path, chunk_size=1024 * 1024):
+    """
+    计算文件内容的sha1，同一进程内按 (路径, 大小, 修改时间) 记忆结果
+    :param file_path: 文件路径
+    :return: 16进制的sha1字符串
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hash_lock:
+        if memo_key in _file_hash_memo:
+            return _file_hash_memo[memo_key]
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    digest = sha1.hexdigest()
+    with _file_hash_lock:
+        _file_hash_memo[memo_key] = digest
+    return digest
+
+
+def hash_key(*parts):
+    # 把多个参数拼成一个稳定的缓存key
+    text = "|".join(str(part) for part in parts)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def link_or_copy(src, dest):
+    # 优先使用硬链接，不支持时再复制
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+@contextlib.contextmanager
+def file_lock(lock_file):
+    """
+    跨进程的文件锁，同一个缓存目录可能被多个页面或者进程同时使用
+    """
+    with open(lock_file, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            # msvcrt.LK_LOCK最多重试10秒，锁被长时间占用时继续等待
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLruCache:
+    """
+    基于目录的文件缓存，按最近使用时间淘汰，总大小不超过 max_size_mb
+    索引保存在缓存目录下的 index.json 中，多次运行之间可以复用
+    每次读写索引都持有index.lock文件锁并重新读取索引，多个进程共用一个缓存目录时不会互相覆盖
+    """
+
+    # 缓存目录下不是缓存文件的文件
+    INDEX_FILE = "index.json"
+    LOCK_FILE = "index.lock"
+    # 超过这个时间的.tmp文件是写入中断留下的，打开缓存时删除
+    STALE_TEMP_SECONDS = 3600
+
+    def __init__(self, name, max_size_mb=1024):
+        self.cache_dir = os.path.join(cache_root_dir, name)
+        self.index_file = os.path.join(self.cache_dir, self.INDEX_FILE)
+        self.lock_file = os.path.join(self.cache_dir, self.LOCK_FILE)
+        self.max_size = int(float(max_size_mb) * 1024 * 1024)
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 索引丢失或者其他进程写入时中断，目录里会有索引中没有的文件，加进索引才能被淘汰
+        with self._locked_index() as (entries, stats):
+            self._adopt_untracked(entries)
+            self._evict(entries, stats)
+
+    @contextlib.contextmanager
+    def _locked_index(self):
+        # 持锁期间读取最新的索引，修改之后原子地写回
+        with self._lock, file_lock(self.lock_file):
+            entries, stats = self._load_index()
+            yield entries, stats
+            self._save_index(entries, stats)
+
+    def _load_index(self):
+        stats = {"hits": 0, "misses": 0, "evictions": 0}
+        if not os.path.exists(self.index_file):
+            return {}, stats
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            stats.update(data.get("stats", {}))
+            entries = {key: entry for key, entry in data.get("entries", {}).items()
+                       if os.path.exists(os.path.join(self.cache_dir, entry["file"]))}
+            return entries, stats
+        except Exception as e:
+            print(f"读取缓存索引失败，重新建立索引: {e}")
+            return {}, stats
+
+    def _save_index(self, entries, stats):
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({"entries": entries, "stats": stats}, f)
+        os.replace(temp_file, self.index_file)
+
+    def _adopt_untracked(self, entries):
+        tracked_files = {entry["file"] for entry in entries.values()}
+        now = time.time()
+        for file_name in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, file_name)
+            if file_name in tracked_files or file_name in (self.INDEX_FILE, self.LOCK_FILE) \
+                    or not os.path.isfile(file_path):
+                continue
+            stat = os.stat(file_path)
+            if file_name.endswith(".tmp"):
+                # 其他进程可能正在写入，只删除很久之前留下的
+                if now - stat.st_mtime > self.STALE_TEMP_SECONDS:
+                    os.remove(file_path)
+                continue
+            # 缓存文件名就是 key + 扩展名，按修改时间参与淘汰
+            key = os.path.splitext(file_name)[0]
+            entries[key] = {"file": file_name, "size": stat.st_size, "last_access": stat.st_mtime}
+
+    def _evict(self, entries, stats):
+        total_size = sum(entry["size"] for entry in entries.values())
+        # 按最近访问时间从旧到新淘汰
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["last_access"]):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, entry["file"]))
+            except OSError:
+                pass
+            total_size -= entry["size"]
+            del entries[key]
+            stats["evictions"] += 1
+
+    def get(self, key):
+        """
+        :return: 缓存文件的路径，没有命中返回None
+        """
+        with self._locked_index() as (entries, stats):
+            entry = entries.get(key)
+            if entry is None:
+                stats["misses"] += 1
+                return None
+            entry["last_access"] = time.time()
+            stats["hits"] += 1
+            return os.path.join(self.cache_dir, entry["file"])
+
+    def fetch(self, key, dest):
+        """
+        把缓存的文件放到dest，命中返回True
+        """
+        cached_file = self.get(key)
+        if cached_file is None:
+            return False
+        try:
+            link_or_copy(cached_file, dest)
+        except OSError as e:
+            # 刚好被其他进程淘汰
+            print(f"读取缓存文件失败: {e}")
+            return False
+        return True
+
+    def put(self, key, src, ext=None):
+        """
+        把src文件加入缓存，返回缓存文件的路径
+        """
+        if not os.path.exists(src) or os.path.getsize(src) == 0:
+            return None
+        if ext is None:
+            ext = os.path.splitext(src)[1]
+        file_name = key + ext
+        cached_file = os.path.join(self.cache_dir, file_name)
+        temp_file = f"{cached_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src, temp_file)
+        with self._locked_index() as (entries, stats):
+            os.replace(temp_file, cached_file)
+            entries[key] = {"file": file_name, "size": os.path.getsize(cached_file),
+                            "last_access": time.time()}
+            self._evict(entries, stats)
+        return cached_file
+
+    def stats(self):
+        with self._lock, file_lock(self.lock_file):
+            entries, stats = self._load_index()
+        stats["entries"] = len(entries)
+        stats["size_mb"] = round(sum(entry["size"] for entry in entries.values()) / 1024 / 1024, 2)
+        return stats
@@ -228,6 +228,18 @@ def convert_mp3_to_wav(input, output):
     subprocess.run(cmd)
 
 
+def convert_audio_bytes_to_wav(data, output):
+    # 内存中的音频通过管道交给ffmpeg解码，不需要先写到临时文件
+    cmd = [
+        'ffmpeg',
+        '-v', 'error',
+        '-i', 'pipe:0',
+        '-y',
+        output
+    ]
+    subprocess.run(cmd, input=data, capture_output=True, check=True)
+
+
 def save_uploaded_file(uploaded_file, save_path):
     # 假设你已经获取了文件内容
     file_content = uploaded_file.read()
@@ -265,3 +277,47 @@ def split_text(text, min_length):
                 merged_segments.append(current_segment)
 
     return merged_segments
+
+
+def merge_segments(segments, max_length):
+    # 相邻的片段合并到不超过max_length
+    merged_segments = []
+    current_segment = ""
+    for segment in segments:
+        if current_segment and len(current_segment) + len(segment) > max_length:
+            merged_segments.append(current_segment)
+            current_segment = ""
+        current_segment += segment
+    if current_segment:
+        merged_segments.append(current_segment)
+    return [segment.strip() for segment in merged_segments if segment.strip()]
+
+
+def split_sentences(text, max_length):
+    """
+    和split_text一样先按句子、再按逗号拆分，但是保留标点，用于分段合成配音
+    英文句号后面必须是空白或者结尾，防止拆开3.5这样的数字
+    :param max_length: 每段的最大长度，短句会合并到一起
+    :return: 每段文本
+    """
+    sentences = re.split(r'(?<=[。！？；!?;\n])|(?<=\.)(?=\s|$)', text)
+    segments = []
+    for sentence in sentences:
+        # 保留英文单词之间的空格，合并之后再去掉首尾空白
+        if not sentence.strip():
+            continue
+        if len(sentence) <= max_length:
+            segments.append(sentence)
+            continue
+        # 句子太长按逗号、冒号拆分，还是太长再按空白拆分，只有单个词(或者没有空白的中文)太长时才按长度截断
+        for sub_segment in re.split(r'(?<=[，,：:、])', sentence):
+            if len(sub_segment) <= max_length:
+                segments.append(sub_segment)
+                continue
+            for word in re.split(r'(?<=\s)', sub_segment):
+                while len(word) > max_length:
+                    segments.append(word[:max_length])
+                    word = word[max_length:]
+                if word:
+                    segments.append(word)
+    return merge_segments(segments, max_length)
@@ -28,6 +28,7 @@ import time
 import streamlit as st
 from typing import Optional
 
+from tools.audio_engine import pad_audio_file
 from tools.file_utils import generate_temp_filename
 
 
@@ -150,6 +151,9 @@ def run_ffmpeg_command(command):
 
 
 def extent_audio(audio_file, pad_dur=2):
+    # wav直接在内存里补静音，不需要启动ffmpeg
+    if pad_audio_file(audio_file, pad_dur):
+        return
     temp_file = generate_temp_filename(audio_file)
     # 构造ffmpeg命令
     command = [
@@ -0,0 +1,123 @@
+#  Copyright © [2024] 程序那些事
+#
+#  All rights reserved. This software and associated documentation files (the "Software") are provided for personal and educational use only. Commercial use of the Software is strictly prohibited unless explicit permission is obtained from the author.
+#
+#  Permission is hereby granted to any person to use, copy, and modify the Software for non-commercial purposes, provided that the following conditions are met:
+#
+#  1. The original copyright notice and this permission notice must be included in all copies or substantial portions of the Software.
+#  2. Modifications, if any, must retain the original copyright information and must not imply that the modified version is an official version of the Software.
+#  3. Any distribution of the Software or its modifications must retain the original copyright notice and include this permission notice.
+#
+#  For commercial use, including but not limited to selling, distributing, or using the Software as part of any commercial product or service, you must obtain explicit authorization from the author.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHOR OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#  Author: 程序那些事
+#  email: flydean@163.com
+#  Website: [www.flydean.com](http://www.flydean.com)
+#  GitHub: [https://github.com/ddean2009/MoneyPrinterPlus](https://github.com/ddean2009/MoneyPrinterPlus)
+#
+#  All rights reserved.
+#
+#
+
+import os
+import struct
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavInfo:
+    """
+    wav文件头信息，data_offset/data_size 是PCM数据在文件中的位置
+    """
+
+    def __init__(self, format_tag, channels, sample_rate, block_align, bits_per_sample, data_offset, data_size):
+        self.format_tag = format_tag
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.block_align = block_align
+        self.bits_per_sample = bits_per_sample
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+    @property
+    def frame_count(self):
+        return self.data_size // self.block_align
+
+    @property
+    def duration(self):
+        return self.frame_count / float(self.sample_rate)
+
+    def __str__(self):
+        return (f"format={self.format_tag} channels={self.channels} sample_rate={self.sample_rate} "
+                f"bits={self.bits_per_sample} frames={self.frame_count}")
+
+
+def read_wav_info(file_path):
+    """
+    直接解析wav文件头，支持RIFF/RF64和WAVE_FORMAT_EXTENSIBLE
+    :return: WavInfo，不是PCM/float的wav文件返回None
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[8:12] != b'WAVE' or header[0:4] not in (b'RIFF', b'RF64'):
+            return None
+        fmt = None
+        rf64_data_size = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'ds64':
+                ds64 = f.read(chunk_size)
+                # riff大小(8字节)之后是data大小(8字节)
+                rf64_data_size = struct.unpack('<Q', ds64[8:16])[0]
+            elif chunk_id == b'fmt ':
+                fmt_data = f.read(chunk_size)
+                format_tag, channels, sample_rate, _, block_align, bits_per_sample = \
+                    struct.unpack('<HHIIHH', fmt_data[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt_data) >= 26:
+                    # 真正的格式在SubFormat GUID的前两个字节
+                    format_tag = struct.unpack('<H', fmt_data[24:26])[0]
+                fmt = (format_tag, channels, sample_rate, block_align, bits_per_sample)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    return None
+                format_tag, channels, sample_rate, block_align, bits_per_sample = fmt
+                if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT) or block_align == 0 \
+                        or sample_rate == 0:
+                    return None
+                data_offset = f.tell()
+                data_size = chunk_size
+                if rf64_data_size is not None and chunk_size == 0xFFFFFFFF:
+                    data_size = rf64_data_size
+                # ffmpeg写管道时不会回填大小，这时以文件实际大小为准
+                if data_size == 0 or data_size == 0xFFFFFFFF or data_offset + data_size > file_size:
+                    data_size = file_size - data_offset
+                return WavInfo(format_tag, channels, sample_rate, block_align, bits_per_sample,
+                               data_offset, data_size)
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+                continue
+            # fmt和ds64块也需要按2字节对齐
+            if chunk_size & 1:
+                f.seek(1, os.SEEK_CUR)
+
+
+def get_wav_duration(file_path):
+    """
+    从wav文件头计算精确时长（秒），不是wav文件返回None
+    """
+    try:
+        wav_info = read_wav_info(file_path)
+    except (OSError, struct.error) as e:
+        print(f"解析wav文件头失败: {e}")
+        return None
+    if wav_info is None:
+        return None
+    return wav_info.duration